@@ -1,9 +1,23 @@
 # langserve_backend/auth.py
-from fastapi import Header, HTTPException, Security
+import hashlib
+import os
+import secrets
+
+from fastapi import Header, HTTPException, Request, Security
 from fastapi.security.api_key import APIKeyHeader
 
 API_KEY_NAME = "Authorization"
-API_KEY = "secret-token-123"  # change this to a strong key or read from ENV
+API_KEY = os.getenv("API_KEY", "secret-token-123")  # change this to a strong key in production
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")  # empty disables admin-only features
+# Key of the Streamlit UI, the only caller trusted to name its user and role; empty ignores those headers
+UI_API_KEY = os.getenv("UI_API_KEY", "")
+# Comma-separated keys issued to other integrations; each gets its own rate limit
+INTEGRATION_API_KEYS = [key.strip() for key in os.getenv("INTEGRATION_API_KEYS", "").split(",") if key.strip()]
+
+# Sent by the UI, which authenticates its users itself; trusted only together with UI_API_KEY
+USER_HEADER = "X-User"
+ROLE_HEADER = "X-User-Role"
+USER_ROLES = ("user", "doctor", "admin")  # any other role header counts as "user"
 
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 
@@ -12,5 +26,49 @@ def verify_api_key(api_key: str = Security(api_key_header)):
         raise HTTPException(status_code=403, detail="Unauthorized access")
     return api_key
 
+def is_admin_request(request: Request) -> bool:
+    """True if the request carries the admin API key"""
+    if not ADMIN_API_KEY:
+        return False
+    supplied = request.headers.get(API_KEY_NAME, "")
+    return secrets.compare_digest(supplied, f"Bearer {ADMIN_API_KEY}")
+
+def verify_admin_key(request: Request):
+    if not is_admin_request(request):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return True
+
+def api_key_id(key: str) -> str:
+    """Short, non-secret id for an API key, used in rate limit settings and metrics"""
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+def _valid_key(supplied: str):
+    for key in (API_KEY, ADMIN_API_KEY, UI_API_KEY, *INTEGRATION_API_KEYS):
+        if key and secrets.compare_digest(supplied, f"Bearer {key}"):
+            return key
+    return None
+
+def verify_key(request: Request):
+    """Accept any valid key: the service's, the UI's, the admin's or an integration's"""
+    if not _valid_key(request.headers.get(API_KEY_NAME, "")):
+        raise HTTPException(status_code=403, detail="Unauthorized access")
+    return True
+
+def request_principal(request: Request):
+    """Who a request is charged to, as (principal, kind, name)
 
-add_routes(app,graph,path="/diagnose",dependencies = [Depends(verify_api_key)])
\ No newline at end of file
+    kind is "user" (name is the role) when UI_API_KEY comes with the UI's
+    user headers, "key" (name is the key id) for other keyed calls, whose
+    user headers are ignored, and "anonymous" (keyed by client address)
+    otherwise.
+    """
+    key = _valid_key(request.headers.get(API_KEY_NAME, ""))
+    if key:
+        user = request.headers.get(USER_HEADER)
+        if user and key == UI_API_KEY:
+            role = request.headers.get(ROLE_HEADER, "user")
+            return f"user:{user}", "user", role if role in USER_ROLES else "user"
+        key_id = api_key_id(key)
+        return f"key:{key_id}", "key", key_id
+    client = request.client.host if request.client else "unknown"
+    return f"ip:{client}", "anonymous", "anonymous"
@@ -0,0 +1,110 @@
+"""Serialization benchmark: bytes on the wire and encode time per response format
+
+Compares the previous response path (pydantic model per record, FastAPI's
+jsonable_encoder, stdlib-json JSONResponse) with the current one
+(NegotiatedResponse: orjson or MessagePack) with and without gzip, on
+payloads shaped like batch diagnosis results and job records. Run it from
+langserve_backend/:
+
+    python bench_serialization.py
+    python bench_serialization.py --records 5000 --repeat 20
+"""
+import argparse
+import gzip
+import random
+import statistics
+import time
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from utils.serialization import GZIP_LEVEL, encode, msgpack
+
+WORDS = (
+    "fever headache nausea cough fatigue possible viral infection consider rest fluids "
+    "monitor temperature consult physician if symptoms persist antipyretics hydration"
+).split()
+
+
+class DiagnosisResponse(BaseModel):
+    input: str
+    symptom_area: str
+    diagnosis: str
+
+
+def text(words):
+    return " ".join(random.choice(WORDS) for _ in range(words))
+
+
+def diagnosis_records(count):
+    return [
+        {"input": text(12), "symptom_area": random.choice(["infection", "respiratory", "Neurological"]),
+         "diagnosis": text(250)}
+        for _ in range(count)
+    ]
+
+
+def job_records(count):
+    now = time.time()
+    return [
+        {"job_id": uuid.uuid4().hex, "status": "completed", "progress": 1.0, "stage": "completed",
+         "partial": {"symptom_area": "infection"}, "result": {"input": text(12), "symptom_area": "infection",
+                                                              "diagnosis": text(120)},
+         "error": None, "cancel_requested": False, "created_at": now, "started_at": now + 0.1,
+         "updated_at": now + 2.5}
+        for _ in range(count)
+    ]
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        times.append(time.perf_counter() - started)
+    return body, statistics.median(times)
+
+
+def paths(records, model):
+    """name -> function producing the response body for the records"""
+    def previous():
+        content = jsonable_encoder([model(**record) for record in records]) if model else jsonable_encoder(records)
+        return JSONResponse(content).body
+
+    result = {
+        "previous (pydantic + json)": previous,
+        "orjson": lambda: encode(records)[0],
+    }
+    if msgpack is not None:
+        result["msgpack"] = lambda: encode(records, "application/msgpack")[0]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare response serialization paths")
+    parser.add_argument("--records", type=int, default=1000, help="Records per payload")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per path (median is reported)")
+    args = parser.parse_args()
+
+    random.seed(0)
+    payloads = {
+        "batch diagnoses": (diagnosis_records(args.records), DiagnosisResponse),
+        "job records": (job_records(args.records), None),
+    }
+
+    for payload_name, (records, model) in payloads.items():
+        print(f"\n{payload_name} ({args.records} records)")
+        print(f"{'path':<28}{'bytes':>12}{'encode ms':>12}{'gzip bytes':>12}{'+gzip ms':>10}  encode speedup")
+        baseline = None
+        for path_name, fn in paths(records, model).items():
+            body, seconds = timed(fn, args.repeat)
+            compressed, gzip_seconds = timed(lambda: gzip.compress(body, compresslevel=GZIP_LEVEL), args.repeat)
+            baseline = baseline or seconds
+            print(f"{path_name:<28}{len(body):>12,}{seconds * 1000:>12.2f}{len(compressed):>12,}"
+                  f"{(seconds + gzip_seconds) * 1000:>10.2f}  {baseline / seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Cold-start benchmark for the backend
+
+Each run imports main in a fresh interpreter and records:
+
+- import_seconds: wall time of `import main` (what uvicorn waits for before serving)
+- import_rss_mb:  peak RSS once main is imported
+- warm_seconds:   time to import and build the diagnosis chain afterwards
+- warm_rss_mb:    peak RSS with the chain loaded
+
+The medians are compared against startup_budget.json, and the script exits
+non-zero if any of them goes over budget or one of the deferred modules is
+imported by main again. Run it from langserve_backend/:
+
+    python bench_startup.py              # check against the budget
+    python bench_startup.py --profile    # also list the slowest imports
+    python bench_startup.py --update     # rewrite the budget from this machine
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BUDGET_PATH = os.path.join(BACKEND_DIR, "startup_budget.json")
+
+# Headroom given to measured values when the budget is rewritten
+UPDATE_HEADROOM = 1.3
+
+_PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+loaded = sorted({name.split(".")[0] for name in sys.modules})
+main._import_chain_stack()
+warmed = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "import_rss_mb": import_rss / 1024,
+    "warm_seconds": warmed - imported,
+    "warm_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": loaded,
+}))
+"""
+
+
+def run_probe():
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    # main prints start-up messages; the measurement is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(limit=15):
+    """Top-level imports of main ranked by cumulative import time"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR,
+        capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Direct imports of main are indented by exactly three spaces
+        if name.startswith("   ") and not name.startswith("    "):
+            rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def measure(runs):
+    results = [run_probe() for _ in range(runs)]
+    metrics = {
+        key: statistics.median(result[key] for result in results)
+        for key in ("import_seconds", "import_rss_mb", "warm_seconds", "warm_rss_mb")
+    }
+    return metrics, results[0]["modules"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure backend import time and RSS against a budget")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure (median is used)")
+    parser.add_argument("--budget", default=BUDGET_PATH, help="Budget JSON file")
+    parser.add_argument("--update", action="store_true", help="Rewrite the budget from this run")
+    parser.add_argument("--profile", action="store_true", help="List the slowest imports of main")
+    args = parser.parse_args()
+
+    metrics, modules = measure(args.runs)
+
+    with open(args.budget) as f:
+        budget = json.load(f)
+
+    if args.update:
+        for key, value in metrics.items():
+            budget["limits"][key] = round(value * UPDATE_HEADROOM, 2)
+        with open(args.budget, "w") as f:
+            json.dump(budget, f, indent=2)
+            f.write("\n")
+        print(f"✅ Budget written to {args.budget}")
+
+    failures = []
+    print(f"{'metric':<16}{'median':>10}{'budget':>10}")
+    for key, value in metrics.items():
+        limit = budget["limits"].get(key)
+        over = limit is not None and value > limit
+        if over:
+            failures.append(f"{key} {value:.2f} > {limit}")
+        print(f"{key:<16}{value:>10.2f}{limit if limit is not None else '-':>10} {'❌' if over else '✅'}")
+
+    eager = sorted(set(budget.get("deferred_modules", [])) & set(modules))
+    if eager:
+        failures.append(f"imported at start-up but should be deferred: {', '.join(eager)}")
+
+    if args.profile:
+        print("\nSlowest imports of main (cumulative seconds):")
+        for seconds, name in slowest_imports():
+            print(f"  {seconds:7.3f}  {name}")
+
+    if failures:
+        print("\n❌ Start-up budget exceeded:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("\n✅ Start-up within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,45 +1,154 @@
-from langchain_core.runnables import RunnableLambda
-from tools.diagnosis_tool import ai_diagnosis
-from tools.symptom_checker import check_symptom
+import time
+from functools import lru_cache
+
+from utils.conversation import conversations
+from utils.deadline import RequestAbandoned, check
+from utils.metrics import STAGE_LATENCY, time_stage
+from utils.prewarm import is_prewarming, prewarmer
+from utils.rollups import rollups
+
+# The tools pull in langchain_core and requests, which dominate import time.
+# They are imported on first use so the API can start serving without them.
+
+
+def run_diagnosis(user_input, on_stage=None, role=None, conversation=None):
+    """Run the diagnosis steps for one input
+
+    on_stage, if given, is called as on_stage(stage, partial_result) after
+    each step so callers such as the job queue can report progress. role
+    (default: the caller's role for this request) feeds model routing.
+    conversation, a key from utils.conversation.conversation_key, makes the
+    input a follow-up to that conversation's earlier turns.
+    """
+    started = time.perf_counter()
+    with time_stage("chain"):
+        result = _run_steps(user_input, on_stage, role, conversation)
+    if user_input and user_input.strip() and not is_prewarming():
+        rollups.record_diagnosis(time.perf_counter() - started, result["symptom_area"])
+    return result
+
+
+def _run_steps(user_input, on_stage, role, conversation):
+    from tools.diagnosis_tool import ai_diagnosis
+    from tools.symptom_checker import check_symptom
+
+    # Validate input
+    if not user_input or user_input.strip() == "":
+        return {
+            "input": user_input,
+            "symptom_area": "No input provided",
+            "diagnosis": "Please provide symptom description for diagnosis"
+        }
+    # Step 1: Get symptom category
+    try:
+        with time_stage("classification"):
+            symptom_area = check_symptom.invoke(user_input)
+    except Exception as e:
+        symptom_area = f"Error categorizing symptoms: {str(e)}"
+    observe(user_input, symptom_area, role, conversation)
+
+    if on_stage:
+        on_stage("classified", {"symptom_area": symptom_area})
+
+    # Step 2: Get AI diagnosis, unless the caller has given up meanwhile
+    check("diagnosis")
+    try:
+        diagnosis = ai_diagnosis.invoke({
+            "symptom_description": user_input,
+            "symptom_area": symptom_area,
+            "role": role,
+            "conversation": conversation,
+        })
+    except RequestAbandoned:
+        raise
+    except Exception as e:
+        diagnosis = f"Error getting diagnosis: {str(e)}"
+
+    # Return structured result
+    return {
+        "input": user_input,
+        "symptom_area": symptom_area,
+        "diagnosis": diagnosis
+    }
+
+
+def run_diagnosis_stream(user_input, emit, role=None, conversation=None):
+    """Run the diagnosis steps, emitting events as they are produced
+
+    emit(event) receives {"type": "category"} once the input is classified
+    and {"type": "token"} for each piece of generated text. Returns the
+    same result dict as run_diagnosis plus the model tier used.
+    """
+    from tools.diagnosis_tool import stream_diagnosis
+    from tools.symptom_checker import check_symptom
+
+    began = time.perf_counter()
+    with time_stage("chain"):
+        try:
+            with time_stage("classification"):
+                symptom_area = check_symptom.invoke(user_input)
+        except Exception as e:
+            symptom_area = f"Error categorizing symptoms: {str(e)}"
+        observe(user_input, symptom_area, role, conversation)
+        emit({"type": "category", "symptom_area": symptom_area})
+
+        parts = []
+        decision = {}
+        started = time.perf_counter()
+        for text in stream_diagnosis(
+            user_input, symptom_area, role, decision_out=decision, conversation=conversation
+        ):
+            if not parts:
+                STAGE_LATENCY.observe(time.perf_counter() - started, "first_token")
+            parts.append(text)
+            emit({"type": "token", "text": text})
+    rollups.record_diagnosis(time.perf_counter() - began, symptom_area)
+
+    return {
+        "input": user_input,
+        "symptom_area": symptom_area,
+        "diagnosis": "".join(parts),
+        "tier": decision.get("tier")
+    }
+
+
+def observe(user_input, symptom_area, role, conversation):
+    """Count the input for the pre-warmer if its prompt does not depend on a conversation
+
+    Standalone inputs and first turns qualify; follow-ups carry their
+    conversation's earlier turns, so their answers are never shared.
+    """
+    if prewarmer.enabled and (conversation is None or conversations.is_new(conversation)):
+        prewarmer.observe(user_input, role, symptom_area)
 
 
 def build_graph():
     """Build a simple medical diagnosis chain"""
+    from langchain_core.runnables import RunnableLambda
 
     def medical_diagnosis_chain(input_data):
         """Process medical diagnosis request"""
 
         # Extract input text
+        conversation = None
         if isinstance(input_data, dict):
             user_input = input_data.get("input", "")
+            conversation = input_data.get("conversation")
         else:
             user_input = str(input_data)
 
-        # Validate input
-        if not user_input or user_input.strip() == "":
-            return {
-                "input": user_input,
-                "symptom_area": "No input provided",
-                "diagnosis": "Please provide symptom description for diagnosis"
-            }
+        return run_diagnosis(user_input, conversation=conversation)
 
-        # Step 1: Get symptom category
-        try:
-            symptom_area = check_symptom.invoke(user_input)
-        except Exception as e:
-            symptom_area = f"Error categorizing symptoms: {str(e)}"
+    return RunnableLambda(medical_diagnosis_chain)
 
-        # Step 2: Get AI diagnosis
-        try:
-            diagnosis = ai_diagnosis.invoke(user_input)
-        except Exception as e:
-            diagnosis = f"Error getting diagnosis: {str(e)}"
 
-        # Return structured result
-        return {
-            "input": user_input,
-            "symptom_area": symptom_area,
-            "diagnosis": diagnosis
-        }
+@lru_cache(maxsize=None)
+def get_chain():
+    """The diagnosis chain, built once per process"""
+    return build_graph()
+
 
-    return RunnableLambda(medical_diagnosis_chain)
\ No newline at end of file
+def preload():
+    """Import the chain's dependencies and build it ahead of the first request"""
+    from tools import diagnosis_tool, symptom_checker  # noqa: F401
+    return get_chain()
@@ -0,0 +1,44 @@
+"""Gunicorn settings for serving the backend from several worker processes
+
+    cd langserve_backend && gunicorn -c gunicorn.conf.py main:app
+
+The app is imported and the diagnosis chain built once in the master
+(preload_app), then shared copy-on-write by the forked workers. Response
+caches, rate-limit counters and metrics live in utils.shared_state, so every
+worker sees the same values.
+"""
+import gc
+import multiprocessing
+import os
+
+# Read by main at import time, which happens in the master before forking
+os.environ.setdefault("PRELOAD_CHAIN", "1")
+os.environ["MULTI_WORKER"] = "1"
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+
+def when_ready(server):
+    from main import job_queue
+
+    requeued = job_queue.requeue_interrupted()
+    if requeued:
+        server.log.info("Requeued %d interrupted diagnosis jobs", requeued)
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers do not touch (and copy) the shared pages
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    from main import job_queue
+
+    requeued = job_queue.requeue_interrupted(worker.pid)
+    if requeued:
+        server.log.info("Requeued %d jobs from worker %s", requeued, worker.pid)
@@ -1,23 +1,245 @@
-from fastapi import FastAPI
-from langserve import add_routes
+import asyncio
+import contextvars
+import json
+import math
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel
-from diagnostics_graph import build_graph
+from auth import is_admin_request, request_principal, verify_admin_key, verify_key
+from diagnostics_graph import get_chain, preload, run_diagnosis, run_diagnosis_stream
+from utils.conversation import conversation_key
+from utils.deadline import RequestAbandoned, RequestDeadlineMiddleware, remaining, request_budget
+from utils.job_queue import JobQueue, JobQueueFull
+from utils.metrics import CONTENT_TYPE, DIAGNOSIS_SLO, HTTP_IN_FLIGHT, HTTP_LATENCY, HTTP_REQUESTS, REGISTRY
+from utils.model_router import caller_role
+from utils.prewarm import prewarmer
+from utils.profiler import profile_path
+from utils.rate_limit import create_rate_limiter
+from utils.request_timing import ServerTimingMiddleware
+from utils.rollups import rollups
+from utils.serialization import GZIP_LEVEL, GZIP_MIN_BYTES, ContentNegotiationMiddleware, NegotiatedResponse, encode
+from utils.shared_state import get_shared_state
+from utils.upstream_scheduler import class_for_role, upstream_priority
+from utils.ws_sessions import WS_HEARTBEAT_INTERVAL, WS_IDLE_TIMEOUT, WS_SEND_QUEUE, sessions as ws_sessions
+
+# Responses from these paths carry a Server-Timing breakdown
+TIMED_PATH_PREFIXES = ("/test", "/diagnose")
+
+# LangServe and the langchain stack take most of the start-up time, so the
+# /diagnose routes are mounted in the background once the server is up.
+# Set PRELOAD_CHAIN=1 to mount them before serving instead.
+PRELOAD_CHAIN = os.getenv("PRELOAD_CHAIN", "0") == "1"
+# Set by gunicorn.conf.py when several worker processes serve the app
+MULTI_WORKER = os.getenv("MULTI_WORKER", "0") == "1"
+# Default deadline for /test; past it the caller gets the category and a job
+# id for the diagnosis. 0 waits for the full result.
+DIAGNOSIS_SLO_MS = int(os.getenv("DIAGNOSIS_SLO_MS", "0"))
+diagnosis_routes = {"mounted": False, "error": None}
 
 # Define explicit input/output schemas
 class DiagnosisRequest(BaseModel):
     input: str
+    conversation_id: Optional[str] = None  # makes the input a follow-up in that conversation
+    deadline_ms: Optional[int] = None  # overrides DIAGNOSIS_SLO_MS
 
 class DiagnosisResponse(BaseModel):
     input: str
     symptom_area: str
-    diagnosis: str
+    diagnosis: Optional[str] = None
+    conversation_id: Optional[str] = None
+    status: str = "complete"  # "partial": the diagnosis follows at /jobs/{job_id}
+    job_id: Optional[str] = None
+
+class JobRequest(BaseModel):
+    input: str
+    batch: bool = False  # bulk work that should yield to interactive users
+    conversation_id: Optional[str] = None
+
+def run_diagnosis_job(payload, report):
+    """Job queue handler: run one diagnosis and report progress per stage"""
+    report(0.1, "classifying")
+    with upstream_priority(class_for_role(payload.get("role"), payload.get("batch", False))):
+        return run_diagnosis(
+            payload.get("input", ""),
+            on_stage=lambda stage, partial: report(0.4, stage, partial),
+            role=payload.get("role"),
+            conversation=payload.get("conversation")
+        )
+
+job_queue = JobQueue(run_diagnosis_job)
+REGISTRY.register_collector(
+    "diagnosis_jobs", "Diagnosis jobs by status, plus the worker pool size", ("status",),
+    job_queue.stats
+)
+
+# Buckets live in the shared store when several workers serve the app
+rate_limiter = create_rate_limiter(get_shared_state() if MULTI_WORKER else None)
+
+def enforce_rate_limit(request: Request):
+    """Charge the caller one token per diagnosis call; 429 once the bucket is empty"""
+    if request.method != "POST":
+        return  # schemas and the playground cost nothing upstream
+    principal, kind, name = request_principal(request)
+    limit = rate_limiter.limit_for(kind, name)
+    allowed, retry_after = rate_limiter.check(principal, limit)
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded ({limit.name}), retry in {retry_after:.0f}s",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+def mount_diagnosis_routes(app):
+    """Build the diagnosis chain and add the LangServe /diagnose routes"""
+    try:
+        from langserve import add_routes
+
+        add_routes(
+            app,
+            get_chain(),
+            path="/diagnose",
+            dependencies=[Depends(enforce_rate_limit)]
+        )
+        diagnosis_routes["mounted"] = True
+        print("✅ Diagnosis chain added successfully")
+    except Exception as e:
+        error = diagnosis_routes["error"] = str(e)
+        print(f"❌ Error building diagnosis chain: {error}")
+
+        # Add a fallback endpoint if the main chain fails
+        @app.post("/diagnose/fallback")
+        async def diagnose_fallback(input_data: DiagnosisRequest):
+            return DiagnosisResponse(
+                input=input_data.input,
+                symptom_area="Service Error",
+                diagnosis=f"Diagnosis service unavailable: {error}"
+            )
+    # Routes changed after start-up, so regenerate the schema on next request
+    app.openapi_schema = None
+
+async def warm_up(app):
+    """Import the chain stack off the event loop, then mount its routes"""
+    started = time.perf_counter()
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, _import_chain_stack)
+    except Exception as e:
+        print(f"❌ Error preloading diagnosis chain: {e}")
+    mount_diagnosis_routes(app)
+    print(f"🔥 Diagnosis chain warm-up took {time.perf_counter() - started:.2f}s")
+
+def _import_chain_stack():
+    import langserve  # noqa: F401
+    preload()
+
+if PRELOAD_CHAIN:
+    # Under gunicorn's preload_app this runs once in the master, so the
+    # workers inherit the imported modules and the built chain when they fork
+    _import_chain_stack()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Runs in each worker after fork, so threads and connections start here
+    job_queue.start(recover=not MULTI_WORKER)
+    if MULTI_WORKER:
+        REGISTRY.enable_multiprocess(get_shared_state())
+    if PRELOAD_CHAIN:
+        _import_chain_stack()
+        mount_diagnosis_routes(app)
+    else:
+        warm_up_task = asyncio.create_task(warm_up(app))
+    # Keeps cached answers to the most frequent inputs from expiring
+    prewarmer.start(run_diagnosis)
+    rollups.start()
+    yield
+    if not PRELOAD_CHAIN:
+        warm_up_task.cancel()
+    rollups.stop()
+    prewarmer.stop()
+    job_queue.stop()
 
 app = FastAPI(
     title="Medical Diagnostics API",
     description="AI-powered medical diagnosis support system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # orjson, or MessagePack for clients sending Accept: application/msgpack
+    default_response_class=NegotiatedResponse
 )
 
+@app.middleware("http")
+async def wait_for_diagnosis_routes(request: Request, call_next):
+    """Answer 503 on /diagnose while its routes are still being mounted"""
+    if (request.url.path.startswith("/diagnose") and not diagnosis_routes["mounted"]
+            and diagnosis_routes["error"] is None):
+        return JSONResponse(
+            {"detail": "Diagnosis service is starting up"},
+            status_code=503,
+            headers={"Retry-After": "1"}
+        )
+    return await call_next(request)
+
+@app.middleware("http")
+async def upstream_priority_class(request: Request, call_next):
+    """Put this request's upstream calls in its caller's priority class and model routing role"""
+    _, kind, name = request_principal(request)
+    role = name if kind == "user" else None
+    priority_class = class_for_role(role, batch=request.url.path.startswith("/diagnose/batch"))
+    with upstream_priority(priority_class), caller_role(role):
+        return await call_next(request)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests and record latency per route template"""
+    started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        HTTP_LATENCY.observe(time.perf_counter() - started, route_path, request.method)
+        HTTP_REQUESTS.inc(route_path, request.method, status)
+
+# Outer layers, innermost first: Server-Timing, slow request log and
+# profiling until the last body chunk, then negotiate the body format, bind
+# the request's deadline and cancellation, then compress large bodies
+app.add_middleware(ServerTimingMiddleware, path_prefixes=TIMED_PATH_PREFIXES, may_profile=is_admin_request)
+app.add_middleware(ContentNegotiationMiddleware)
+app.add_middleware(RequestDeadlineMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_BYTES, compresslevel=GZIP_LEVEL)
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(verify_admin_key)])
+async def download_profile(profile_id: str):
+    """Download a stored request profile as folded stacks for flame graph tools"""
+    path = profile_path(profile_id)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
+
+@app.get("/admin/rollups", dependencies=[Depends(verify_admin_key)])
+async def usage_rollups(resolution: str = "minute", limit: Optional[int] = None):
+    """Requests, latency, categories, cache hits and errors per minute, hour or day"""
+    try:
+        return {"resolution": resolution, "buckets": rollups.series(resolution, limit)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 # Add a simple health check endpoint
 @app.get("/")
 async def root():
@@ -27,9 +249,10 @@ async def root():
 async def health_check():
     """Detailed health check for monitoring"""
     try:
-        # Test the diagnosis chain
-        diagnosis_chain = build_graph()
-        test_result = diagnosis_chain.invoke({"input": "test"})
+        # Test the diagnosis chain, once it has been loaded
+        test_result = None
+        if diagnosis_routes["mounted"]:
+            test_result = await get_chain().ainvoke({"input": "test"})
 
         return {
             "status": "healthy",
@@ -38,7 +261,9 @@ async def health_check():
             "timestamp": "2024-01-01T00:00:00Z",
             "checks": {
                 "api": "ok",
-                "diagnosis_chain": "ok" if test_result else "error",
+                "diagnosis_chain": "ok" if test_result else (
+                    "error" if diagnosis_routes["mounted"] or diagnosis_routes["error"] else "loading"
+                ),
                 "database": "ok"  # Add actual DB check if using database
             }
         }
@@ -51,44 +276,243 @@ async def health_check():
         }
 
 # Add a simple test endpoint
-@app.post("/test", response_model=DiagnosisResponse)
-async def test_diagnosis(request: DiagnosisRequest):
+@app.post("/test", response_model=DiagnosisResponse, dependencies=[Depends(enforce_rate_limit)])
+async def test_diagnosis(request: DiagnosisRequest, http_request: Request):
     """Simple test endpoint for diagnosis"""
+    principal, kind, name = request_principal(http_request)
+    conversation = None
+    if request.conversation_id:
+        conversation = conversation_key(principal, request.conversation_id)
+    deadline_ms = request.deadline_ms if request.deadline_ms is not None else DIAGNOSIS_SLO_MS
+    if deadline_ms > 0:
+        payload = {"input": request.input, "role": name if kind == "user" else None, "conversation": conversation}
+        # Answer before the client's own timeout, whichever comes first
+        left = remaining()
+        deadline = deadline_ms / 1000 if left is None else max(0.0, min(deadline_ms / 1000, left - 0.05))
+        return await diagnose_within(payload, deadline, request.conversation_id, owner=principal)
     try:
-        diagnosis_chain = build_graph()
-        result = diagnosis_chain.invoke({"input": request.input})
-        return DiagnosisResponse(**result)
+        # ainvoke runs the chain in a worker thread, so waiting for an
+        # upstream slot does not block the event loop
+        result = await get_chain().ainvoke({"input": request.input, "conversation": conversation})
+        return DiagnosisResponse(**result, conversation_id=request.conversation_id)
+    except RequestAbandoned as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         return DiagnosisResponse(
             input=request.input,
             symptom_area="Error",
-            diagnosis=f"Error: {str(e)}"
+            diagnosis=f"Error: {str(e)}",
+            conversation_id=request.conversation_id
+        )
+
+async def diagnose_within(payload, deadline, conversation_id=None, owner=None):
+    """Run a diagnosis as a job and wait up to deadline seconds for it
+
+    Past the deadline the caller gets the symptom category, which is ready
+    almost at once, and the job id; the diagnosis keeps running and lands
+    in the job's result.
+    """
+    try:
+        job = job_queue.begin(payload, owner=owner)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Diagnosis queue is full: {e}",
+                            headers={"Retry-After": "5"})
+    job_id = job["job_id"]
+    # Carry the request's priority class, role and timings into the worker
+    # thread, but not its deadline: the job outlives the request
+    with request_budget(None):
+        context = contextvars.copy_context()
+    # The job queue's own bounded threads, so abandoned jobs cannot take the
+    # default executor that ainvoke, warm-up and WebSocket turns share
+    future = asyncio.wrap_future(job_queue.execute_async(job_id, payload, context))
+    try:
+        job = await asyncio.wait_for(asyncio.shield(future), deadline)
+    except asyncio.TimeoutError:
+        DIAGNOSIS_SLO.inc("partial")
+        job = job_queue.get(job_id)
+        return DiagnosisResponse(
+            input=payload["input"],
+            symptom_area=(job["partial"] or {}).get("symptom_area", "Pending"),
+            conversation_id=conversation_id,
+            status="partial",
+            job_id=job_id
         )
 
-# Build and add the diagnosis chain with explicit schemas
-try:
-    diagnosis_chain = build_graph()
-
-    add_routes(
-        app,
-        diagnosis_chain,
-        path="/diagnose"
-    )
-    print("✅ Diagnosis chain added successfully")
-except Exception as e:
-    print(f"❌ Error building diagnosis chain: {e}")
-
-    # Add a fallback endpoint if the main chain fails
-    @app.post("/diagnose/fallback")
-    async def diagnose_fallback(input_data: DiagnosisRequest):
+    DIAGNOSIS_SLO.inc("complete")
+    if job["status"] != "completed":
         return DiagnosisResponse(
-            input=input_data.input,
-            symptom_area="Service Error",
-            diagnosis=f"Diagnosis service unavailable: {str(e)}"
+            input=payload["input"],
+            symptom_area="Error",
+            diagnosis=f"Error: {job['error'] or job['status']}",
+            conversation_id=conversation_id,
+            job_id=job_id
+        )
+    return DiagnosisResponse(**job["result"], conversation_id=conversation_id, job_id=job_id)
+
+# Interactive diagnosis over a WebSocket
+def encode_event(event):
+    return encode(event)[0].decode()
+
+def run_session_turn(session, text, message_id):
+    """Run one message of a WebSocket session in a worker thread, emitting its events"""
+    def emit(event):
+        session.emit(dict(event, message_id=message_id))
+
+    try:
+        result = run_diagnosis_stream(
+            text, emit, role=session.role,
+            conversation=conversation_key(session.principal, session.session_id)
         )
+    except Exception as e:
+        emit({"type": "error", "detail": f"Error getting diagnosis: {str(e)}"})
+        return
+    session.finish_turn(result)
+    emit(dict(result, type="result"))
+
+@app.websocket("/ws/diagnose")
+async def diagnose_session(websocket: WebSocket):
+    """Conversation socket: send {"type": "message", "text": ...}, receive category, tokens and result
+
+    Reconnect with ?session_id=...&last_seq=... to resume a session and
+    receive the events missed in between; messages sent but not yet
+    started when the socket dropped run after the resume. The server pings
+    every WS_HEARTBEAT_INTERVAL seconds; answer with {"type": "pong"}.
+    """
+    principal, kind, name = request_principal(websocket)
+    role = name if kind == "user" else None
+    await websocket.accept()
+    try:
+        session, resumed = ws_sessions.open(websocket.query_params.get("session_id"), principal, role)
+    except RuntimeError as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+
+    loop = asyncio.get_running_loop()
+    outbox = asyncio.Queue(maxsize=WS_SEND_QUEUE)
+    inbox = session.inbox
+    last_seq = int(websocket.query_params.get("last_seq") or 0)
+    replay = session.attach(loop, outbox, last_seq)
+    clock = {"heard": loop.time(), "message": loop.time()}
+
+    # Upstream calls made for this socket run in the caller's priority class and role
+    with upstream_priority(class_for_role(role)), caller_role(role):
+        context = contextvars.copy_context()
+
+    async def send_events():
+        await websocket.send_text(encode_event({
+            "type": "session", "session_id": session.session_id, "resumed": resumed,
+            "turns": session.turn_count, "last_seq": session.seq, "pending": inbox.qsize()
+        }))
+        for event in replay:
+            await websocket.send_text(encode_event(event))
+        while True:
+            await websocket.send_text(encode_event(await outbox.get()))
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            now = loop.time()
+            if now - clock["message"] > WS_IDLE_TIMEOUT:
+                await websocket.close(code=1000, reason="Idle timeout")
+                return
+            if now - clock["heard"] > 3 * WS_HEARTBEAT_INTERVAL:
+                await websocket.close(code=1011, reason="Heartbeat timeout")
+                return
+            await outbox.put({"type": "ping", "ts": time.time()})
+
+    async def run_messages():
+        while True:
+            # A turn started before a reconnect finishes before the next one starts.
+            # Shielded: the turn keeps running in its thread when this socket goes.
+            if session.running is not None:
+                await asyncio.shield(session.running)
+            text, message_id = await inbox.get()
+            limit = rate_limiter.limit_for(kind, name)
+            allowed, retry_after = rate_limiter.check(principal, limit)
+            if not allowed:
+                await outbox.put({"type": "error", "message_id": message_id, "status": 429,
+                                  "retry_after": max(1, math.ceil(retry_after))})
+                continue
+            session.running = loop.run_in_executor(None, context.run, run_session_turn, session, text, message_id)
+
+    tasks = [asyncio.create_task(task()) for task in (send_events, heartbeat, run_messages)]
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            clock["heard"] = loop.time()
+            if frame.get("text") is None:
+                await outbox.put({"type": "error", "status": 400, "detail": "Binary frames are not supported; send JSON text"})
+                continue
+            try:
+                message = json.loads(frame["text"])
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                await outbox.put({"type": "error", "status": 400, "detail": "Messages must be JSON objects"})
+                continue
+            kind_of_message = message.get("type")
+            if kind_of_message == "message":
+                clock["message"] = clock["heard"]
+                text = str(message.get("text") or "").strip()
+                message_id = message.get("id") or uuid.uuid4().hex
+                if not text:
+                    await outbox.put({"type": "error", "message_id": message_id, "status": 400,
+                                      "detail": "Please provide symptom description for diagnosis"})
+                elif inbox.full():
+                    await outbox.put({"type": "error", "message_id": message_id, "status": 429,
+                                      "detail": "Too many messages waiting; wait for the current answer"})
+                else:
+                    inbox.put_nowait((text, message_id))
+            elif kind_of_message == "ping":
+                await outbox.put({"type": "pong", "ts": time.time()})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        session.detach(outbox)
+
+# Asynchronous diagnosis jobs
+@app.post("/jobs", status_code=202, dependencies=[Depends(enforce_rate_limit)])
+async def submit_job(request: JobRequest, http_request: Request):
+    """Queue a diagnosis and return its job id immediately"""
+    principal, kind, name = request_principal(http_request)
+    payload = request.model_dump()
+    # The role comes from the caller's credentials, never from the body
+    payload["role"] = name if kind == "user" else None
+    if request.conversation_id:
+        payload["conversation"] = conversation_key(principal, request.conversation_id)
+    try:
+        return job_queue.submit(payload, owner=principal)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Diagnosis queue is full: {e}",
+                            headers={"Retry-After": "5"})
+
+# Only the principal that submitted a job can see or cancel it; anyone else
+# gets the same 404 as for an unknown id
+@app.get("/jobs/{job_id}", dependencies=[Depends(verify_key)])
+async def get_job(job_id: str, http_request: Request):
+    """Return job status, progress and, once finished, its result"""
+    job = job_queue.get(job_id, owner=request_principal(http_request)[0])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.delete("/jobs/{job_id}", dependencies=[Depends(verify_key)])
+async def cancel_job(job_id: str, http_request: Request):
+    """Cancel a queued job, or stop a running one at its next stage or upstream wait
+
+    The response is the job's state right after the cancel: a running job
+    still shows "running", with cancel_requested set, until it has stopped.
+    """
+    job = job_queue.cancel(job_id, owner=request_principal(http_request)[0])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 if __name__ == "__main__":
     import uvicorn
-    import os
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
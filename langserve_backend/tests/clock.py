@@ -0,0 +1,13 @@
+class FakeClock:
+    """Stands in for a module's `time`, so tests move the clock by hand"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    monotonic = perf_counter = time
+
+    def advance(self, seconds):
+        self.now += seconds
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules import as utils.x and tools.x, relative to langserve_backend
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+import importlib.util
+import os
+
+import pytest
+from starlette.requests import Request
+
+# Loaded by path: run from the repo root, "auth" may already be the UI's module
+_spec = importlib.util.spec_from_file_location(
+    "backend_auth", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "auth.py")
+)
+auth = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(auth)
+
+
+@pytest.fixture(autouse=True)
+def keys(monkeypatch):
+    monkeypatch.setattr(auth, "API_KEY", "service-key")
+    monkeypatch.setattr(auth, "UI_API_KEY", "ui-key")
+    monkeypatch.setattr(auth, "INTEGRATION_API_KEYS", ["partner-key"])
+
+
+def principal(key=None, user=None, role=None):
+    headers = []
+    if key:
+        headers.append((b"authorization", f"Bearer {key}".encode()))
+    if user:
+        headers.append((b"x-user", user.encode()))
+    if role:
+        headers.append((b"x-user-role", role.encode()))
+    return auth.request_principal(Request({"type": "http", "headers": headers, "client": ("10.0.0.1", 1234)}))
+
+
+def test_ui_key_names_the_user_and_role():
+    assert principal("ui-key", "alice", "doctor") == ("user:alice", "user", "doctor")
+    assert principal("ui-key", "alice") == ("user:alice", "user", "user")
+
+
+def test_unknown_roles_count_as_user():
+    assert principal("ui-key", "alice", "superuser") == ("user:alice", "user", "user")
+
+
+@pytest.mark.parametrize("key", ["service-key", "partner-key"])
+def test_other_keys_cannot_claim_a_user_or_role(key):
+    key_id = auth.api_key_id(key)
+    assert principal(key, "alice", "admin") == (f"key:{key_id}", "key", key_id)
+
+
+def test_user_headers_are_ignored_without_a_ui_key(monkeypatch):
+    monkeypatch.setattr(auth, "UI_API_KEY", "")
+    key_id = auth.api_key_id("service-key")
+    assert principal("service-key", "alice", "admin") == (f"key:{key_id}", "key", key_id)
+    assert principal(None, "alice", "admin") == ("ip:10.0.0.1", "anonymous", "anonymous")
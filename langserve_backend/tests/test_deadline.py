@@ -0,0 +1,87 @@
+import asyncio
+
+from utils.deadline import RequestDeadlineMiddleware, current_budget
+
+
+def serve(app, headers=(), body_chunks=(b"",), disconnect_after=0.05):
+    """Run app behind the middleware as a server would, with the client gone after disconnect_after
+
+    Returns the budget the app ran under.
+    """
+    budgets = []
+
+    async def main():
+        messages = [
+            {"type": "http.request", "body": chunk, "more_body": i < len(body_chunks) - 1}
+            for i, chunk in enumerate(body_chunks)
+        ]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(disconnect_after)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        async def recording_app(scope, receive, send):
+            budgets.append(current_budget())
+            await app(scope, receive, send)
+
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": list(headers)}
+        await asyncio.wait_for(RequestDeadlineMiddleware(recording_app)(scope, receive, send), 2)
+
+    asyncio.run(main())
+    return budgets[0]
+
+
+async def wait_until_abandoned(scope, receive, send):
+    while current_budget().abandoned() is None:
+        await asyncio.sleep(0.01)
+
+
+def test_bodiless_request_disconnect_is_seen_without_reading():
+    # The handler never calls receive(), as most GET handlers don't
+    budget = serve(wait_until_abandoned)
+    assert budget.reason == "disconnect"
+
+
+def test_bodiless_request_still_gets_its_empty_body():
+    received = []
+
+    async def app(scope, receive, send):
+        received.append(await receive())
+        received.append(await receive())
+        received.append(await receive())
+
+    budget = serve(app)
+    assert received[0] == {"type": "http.request", "body": b"", "more_body": False}
+    assert received[1]["type"] == received[2]["type"] == "http.disconnect"
+    assert budget.reason == "disconnect"
+
+
+def test_disconnect_after_body_cancels_the_budget():
+    received = []
+
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            received.append(message.get("body"))
+            if not message.get("more_body"):
+                break
+        await wait_until_abandoned(scope, receive, send)
+
+    budget = serve(app, headers=[(b"content-length", b"6")], body_chunks=(b"abc", b"def"))
+    assert received == [b"abc", b"def"]
+    assert budget.reason == "disconnect"
+
+
+def test_disconnect_after_response_is_not_a_cancel():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+        await asyncio.sleep(0.1)
+
+    budget = serve(app, disconnect_after=0.01)
+    assert budget.reason is None
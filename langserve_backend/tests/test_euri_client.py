@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from utils import euri_client
+from utils.response_cache import ResponseCache
+from utils.shared_state import SQLiteState
+from utils.upstream_pool import UpstreamPool
+
+
+class FakeStream:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+
+def sse(*texts, done=True):
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}" for text in texts]
+    return lines + (["data: [DONE]"] if done else [])
+
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+    """Route calls to a fake upstream; returns the list of stream bodies it will serve"""
+    bodies = []
+    monkeypatch.setattr(euri_client, "upstream_pool", UpstreamPool(endpoints=["https://a.example/v1"], keys=["k"]))
+    monkeypatch.setattr(euri_client, "completion_cache",
+                        ResponseCache("test", ttl=60, state=SQLiteState(str(tmp_path / "state.db"))))
+    monkeypatch.setattr(euri_client._session, "post", lambda *args, **kwargs: FakeStream(bodies.pop(0)))
+    return bodies
+
+
+def stream(temperature=0):
+    usage = {}
+    text = "".join(euri_client.euri_chat_completion_stream(
+        [{"role": "user", "content": "hi"}], temperature=temperature, usage=usage
+    ))
+    return text, usage["cached"]
+
+
+def test_finished_stream_is_cached(upstream):
+    upstream.append(sse("Hello", " there"))
+    assert stream() == ("Hello there", False)
+    assert stream() == ("Hello there", True)
+
+
+def test_stream_cut_off_before_done_is_not_cached(upstream):
+    upstream.extend([sse("Hel", done=False), sse("Hello")])
+    assert stream() == ("Hel", False)
+    assert stream() == ("Hello", False)
+
+
+def test_empty_stream_is_not_cached(upstream):
+    upstream.extend([sse(), sse("Hello")])
+    assert stream() == ("", False)
+    assert stream() == ("Hello", False)
+
+
+def test_sampled_requests_are_never_cached(upstream):
+    upstream.extend([sse("one"), sse("two")])
+    assert stream(temperature=0.7) == ("one", False)
+    assert stream(temperature=0.7) == ("two", False)
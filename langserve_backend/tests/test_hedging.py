@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from utils import hedging
+from utils.deadline import RequestAbandoned, request_budget
+from utils.hedging import Hedger
+from utils.upstream_scheduler import UpstreamScheduler
+
+
+class Response:
+    def __init__(self, name):
+        self.name = name
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = UpstreamScheduler(slots=2, weights={"interactive_user": 1.0},
+                                  queue_limits={"interactive_user": 10}, queue_timeout=5)
+    monkeypatch.setattr(hedging, "scheduler", scheduler)
+    return scheduler
+
+
+def in_use(scheduler):
+    return scheduler.stats()[("in_use", "all")]
+
+
+def wait_until(condition, timeout=2.0):
+    give_up = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < give_up, "timed out"
+        time.sleep(0.005)
+
+
+def slow_primary(delays):
+    """fn whose attempt on each target takes delays[target] seconds"""
+    responses = {}
+
+    def fn(target):
+        time.sleep(delays[target])
+        responses[target] = Response(target)
+        return responses[target]
+
+    return fn, responses
+
+
+def test_disabled_runs_inline_in_the_callers_thread(scheduler):
+    caller = threading.get_ident()
+    assert Hedger(enabled=False).call(lambda target: (target, threading.get_ident()), ["a", "b"]) == ("a", caller)
+
+
+def test_slow_call_is_hedged_on_a_second_slot_and_the_loser_closed(scheduler):
+    hedger = Hedger(enabled=True, min_delay=0.02, budget=1.0)
+    fn, responses = slow_primary({"a": 0.3, "b": 0.0})
+    scheduler.acquire()  # the caller's own slot
+
+    assert hedger.call(fn, ["a", "b"]).name == "b"
+    # The hedge's slot is held until the primary has finished as well
+    assert in_use(scheduler) == 2
+    wait_until(lambda: "a" in responses)
+    assert responses["a"].closed.wait(1)
+    wait_until(lambda: in_use(scheduler) == 1)
+    assert not responses["b"].closed.is_set()
+
+
+def test_no_hedge_without_a_free_slot(scheduler):
+    hedger = Hedger(enabled=True, min_delay=0.02, budget=1.0)
+    fn, responses = slow_primary({"a": 0.1, "b": 0.0})
+    scheduler.acquire()
+    scheduler.acquire()  # someone else holds the other slot
+
+    assert hedger.call(fn, ["a", "b"]).name == "a"
+    assert set(responses) == {"a"}
+    assert hedger.stats()["hedged_share"] == 0.0
+
+
+def test_abandoned_call_closes_the_late_response(scheduler):
+    hedger = Hedger(enabled=True, min_delay=5, budget=1.0)
+    fn, responses = slow_primary({"a": 0.2, "b": 0.0})
+    scheduler.acquire()
+    with request_budget(0) as budget:
+        threading.Timer(0.05, budget.cancel, ("disconnect",)).start()
+        with pytest.raises(RequestAbandoned):
+            hedger.call(fn, ["a", "b"])
+    wait_until(lambda: "a" in responses)
+    assert responses["a"].closed.wait(1)
+
+
+def test_executor_is_sized_from_the_scheduler(scheduler):
+    scheduler.resize(5)
+    hedger = Hedger(enabled=True, min_delay=1)
+    hedger.call(lambda target: target, ["a"])
+    assert hedger._executor._max_workers == 10
@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from utils.job_queue import JobQueue, JobQueueFull
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def blocking_queue(tmp_path, release, **kwargs):
+    def handler(payload, report):
+        release.wait(5)
+        return {"input": payload["input"]}
+
+    return JobQueue(handler, db_path=str(tmp_path / "jobs.db"), **kwargs)
+
+
+def test_direct_jobs_run_on_the_bounded_threads(tmp_path, release):
+    queue = blocking_queue(tmp_path, release, direct_workers=1)
+    futures = []
+    for text in ("a", "b"):
+        job = queue.begin({"input": text})
+        futures.append(queue.execute_async(job["job_id"], {"input": text}))
+    assert queue._direct._max_workers == 1 and queue._direct_pending == 2
+    assert not futures[0].done()
+    release.set()
+    assert [future.result(5)["result"] for future in futures] == [{"input": "a"}, {"input": "b"}]
+    queue.stop()
+
+
+def test_begin_refuses_once_the_queue_is_full(tmp_path, release):
+    queue = blocking_queue(tmp_path, release, direct_workers=1, max_queued=2)
+    for text in ("a", "b", "c"):
+        job = queue.begin({"input": text})
+        queue.execute_async(job["job_id"], {"input": text})
+    # One running, two waiting for the thread
+    with pytest.raises(JobQueueFull):
+        queue.begin({"input": "d"})
+    with pytest.raises(JobQueueFull):
+        queue.submit({"input": "d"})
+    queue.stop()
@@ -0,0 +1,55 @@
+import json
+import os
+import time
+
+from utils.metrics import Counter, Registry
+
+
+class MemoryState:
+    """The shared state interface, in one process"""
+
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = json.dumps(value)
+
+    def scan(self, prefix):
+        return {key: json.loads(value) for key, value in self.values.items() if key.startswith(prefix)}
+
+
+def worker_registry(state):
+    registry = Registry()
+    counter = Counter("test_requests_total", "Requests", ("route",))
+    registry.register(counter)
+    counter.inc("/test", amount=2)
+    registry.register_collector("test_pool_connections", "Pool connections", ("state",), lambda: {"idle": 3})
+    registry.enable_multiprocess(state, interval=60)
+    return registry
+
+
+def other_worker(state, pid, ts):
+    state.set(f"metrics:{pid}", {
+        "ts": ts, "pid": pid,
+        "samples": {"test_requests_total": [["test_requests_total", ["/test"], 5.0]]},
+        "collected": {"test_pool_connections": [[["idle"], 7]]},
+    })
+
+
+def test_collectors_are_reported_per_live_worker():
+    state = MemoryState()
+    registry = worker_registry(state)
+    other_worker(state, 1, time.time())
+    other_worker(state, 2, time.time() - 3600)  # stopped publishing
+
+    lines = registry.render().splitlines()
+    assert 'test_requests_total{route="/test"} 12' in lines  # counters still summed
+    pool = [line for line in lines if line.startswith("test_pool_connections{")]
+    assert pool == ['test_pool_connections{state="idle",pid="1"} 7',
+                    f'test_pool_connections{{state="idle",pid="{os.getpid()}"}} 3']
+
+
+def test_single_process_collectors_have_no_pid_label():
+    registry = Registry()
+    registry.register_collector("test_pool_connections", "Pool connections", ("state",), lambda: {("idle",): 3})
+    assert 'test_pool_connections{state="idle"} 3' in registry.render().splitlines()
@@ -0,0 +1,82 @@
+import diagnostics_graph
+from utils.model_router import ModelRouter
+from utils.prewarm import CachePrewarmer, SpaceSaving
+
+TIERS = {
+    "fast": {"model": "nano", "temperature": 0, "max_tokens": 100, "fallback": None},
+    "standard": {"model": "mini", "temperature": 0.5, "max_tokens": 100, "fallback": "fast"},
+}
+RULES = [{"tier": "fast", "max_chars": 80}, {"tier": "standard"}]
+
+
+def prewarmer(tiers=TIERS):
+    return CachePrewarmer(enabled=True, ttl=600, rate=6, min_count=1, model_router=ModelRouter(tiers, RULES))
+
+
+def tracked(warmer):
+    return {item for item, _, _ in warmer._sketch.top(1000)}
+
+
+def test_counts_are_exact_below_capacity():
+    sketch = SpaceSaving(3)
+    for item in "aabac":
+        sketch.add(item)
+    assert sketch.top(3) == [("a", 3, 0), ("b", 1, 0), ("c", 1, 0)]
+
+
+def test_new_item_replaces_the_least_counted_and_inherits_its_count():
+    sketch = SpaceSaving(2)
+    for item in "aaab":
+        sketch.add(item)
+    sketch.add("c")
+    assert len(sketch) == 2
+    # c took b's place: count 1 + 1, of which up to 1 may be b's
+    assert sketch.top(2) == [("a", 3, 0), ("c", 2, 1)]
+
+
+def test_heavy_hitter_survives_a_stream_of_one_offs():
+    sketch = SpaceSaving(5)
+    for i in range(1000):
+        sketch.add("frequent")
+        sketch.add(f"rare-{i}")
+    item, count, error = sketch.top(1)[0]
+    assert item == "frequent"
+    # Never underestimated, and the error bounds the overestimate
+    assert count - error <= 1000 <= count
+
+
+def test_decay_lets_new_items_overtake():
+    sketch = SpaceSaving(2)
+    sketch.add("old", weight=8)
+    sketch.decay(0.25)
+    sketch.add("new", weight=3)
+    assert [item for item, _, _ in sketch.top(2)] == ["new", "old"]
+    assert sketch.top(2)[1][1] == 2
+
+
+def test_prewarmer_stays_off_without_a_cacheable_tier():
+    sampled = {name: dict(settings, temperature=0.3) for name, settings in TIERS.items()}
+    warmer = prewarmer(sampled)
+    assert not warmer.enabled
+    warmer.observe("cough")
+    assert warmer.stats()["tracked"] == 0
+
+
+def test_only_inputs_routed_to_a_cacheable_tier_are_counted():
+    warmer = prewarmer()
+    long_input = "a persistent cough " * 10
+    warmer.observe("cough", "doctor")
+    warmer.observe(long_input, "doctor")
+    assert ("cough", "doctor") in tracked(warmer)
+    assert (long_input, "doctor") not in tracked(warmer)
+
+
+def test_first_turns_are_observed_but_follow_ups_are_not(monkeypatch):
+    warmer = prewarmer()
+    monkeypatch.setattr(diagnostics_graph, "prewarmer", warmer)
+    monkeypatch.setattr(diagnostics_graph.conversations, "is_new", lambda key: key == "conversation:new")
+    diagnostics_graph.observe("first turn", "general", "user", "conversation:new")
+    diagnostics_graph.observe("follow-up", "general", "user", "conversation:old")
+    diagnostics_graph.observe("standalone", "general", "user", None)
+    assert {("first turn", "user"), ("standalone", "user")} <= tracked(warmer)
+    assert ("follow-up", "user") not in tracked(warmer)
@@ -0,0 +1,89 @@
+import pytest
+
+from clock import FakeClock
+from utils import rate_limit
+from utils.rate_limit import Limit, MemoryBuckets, RateLimiter, SharedBuckets, parse_limits
+from utils.shared_state import SQLiteState
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def test_parse_limits():
+    limits = parse_limits("user=20/min, api_key=5/sec,")
+    assert set(limits) == {"user", "api_key"}
+    assert limits["user"].capacity == 20
+    assert limits["user"].rate == pytest.approx(20 / 60)
+    with pytest.raises(ValueError):
+        parse_limits("user=20/fortnight")
+
+
+@pytest.mark.parametrize("make_buckets", [
+    lambda tmp_path: MemoryBuckets(),
+    lambda tmp_path: SharedBuckets(SQLiteState(str(tmp_path / "state.db"))),
+])
+def test_bucket_allows_a_burst_then_refills(clock, tmp_path, make_buckets):
+    buckets = make_buckets(tmp_path)
+    limit = Limit("user", 2, 1)
+
+    assert buckets.take("u", limit) == (True, 0.0)
+    assert buckets.take("u", limit) == (True, 0.0)
+    allowed, retry_after = buckets.take("u", limit)
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+
+    clock.advance(0.5)
+    assert buckets.take("u", limit)[0]
+    assert not buckets.take("u", limit)[0]
+    # Other principals have their own bucket
+    assert buckets.take("v", limit)[0]
+
+
+def test_bucket_never_holds_more_than_its_capacity(clock):
+    buckets = MemoryBuckets()
+    limit = Limit("user", 3, 1)
+    buckets.take("u", limit)
+    clock.advance(3600)
+    assert [buckets.take("u", limit)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_least_recently_used_bucket_is_dropped_past_the_cap(clock):
+    buckets = MemoryBuckets(max_buckets=2)
+    limit = Limit("user", 1, 60)
+    for key in ("a", "b", "a", "c"):
+        buckets.take(key, limit)
+    # "a", used more recently, stays drained; "b" was dropped and starts full again
+    assert not buckets.take("a", limit)[0]
+    assert buckets.take("b", limit)[0]
+    assert len(buckets._buckets) == 2
+
+
+def test_cost_above_tokens_is_refused_with_time_to_refill(clock):
+    buckets = MemoryBuckets()
+    limit = Limit("user", 10, 10)
+    allowed, retry_after = buckets.take("u", limit, cost=12)
+    assert not allowed
+    assert retry_after == pytest.approx(2.0)
+
+
+def test_limit_for_prefers_key_then_role_then_anonymous():
+    limits = parse_limits("user=20/min,doctor=60/min,api_key=300/min,anonymous=10/min")
+    limiter = RateLimiter(MemoryBuckets(), limits=limits, key_limits=parse_limits("abc=5/sec"))
+    assert limiter.limit_for("key", "abc").name == "abc"
+    assert limiter.limit_for("key", "other").name == "api_key"
+    assert limiter.limit_for("user", "doctor").name == "doctor"
+    assert limiter.limit_for("user", "unknown-role").name == "user"
+    assert limiter.limit_for("anonymous", "anonymous").name == "anonymous"
+
+
+def test_limiter_fails_open_when_the_store_breaks():
+    class Broken:
+        def take(self, key, limit, cost=1):
+            raise OSError("store down")
+
+    limiter = RateLimiter(Broken(), limits={}, key_limits={})
+    assert limiter.check("ip:1.2.3.4", Limit("anonymous", 1, 60)) == (True, 0.0)
@@ -0,0 +1,88 @@
+import asyncio
+import os
+
+import pytest
+
+from utils import profiler, request_timing
+from utils.request_timing import ServerTimingMiddleware, record_stage
+
+
+@pytest.fixture
+def logged(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+    entries = []
+    monkeypatch.setattr(request_timing, "log_if_slow", lambda *args: entries.append(args))
+    return entries
+
+
+def run(app, path="/test", headers=()):
+    """Call the middleware around app and return the messages it sends"""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "headers": list(headers)}
+    middleware = ServerTimingMiddleware(app, ("/test",), may_profile=lambda request: True)
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def header(message, name):
+    return dict(message["headers"]).get(name)
+
+
+async def fixed_length(scope, receive, send):
+    record_stage("chain", 0.01)
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", b"2")]})
+    # As BaseHTTPMiddleware passes it on: the body, then an empty last chunk
+    await send({"type": "http.response.body", "body": b"{}", "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def streamed(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"a", "more_body": True})
+    await asyncio.sleep(0.05)
+    record_stage("upstream_call", 0.05)
+    await send({"type": "http.response.body", "body": b"b", "more_body": False})
+
+
+def test_fixed_length_response_gets_server_timing(logged):
+    start, body, end = run(fixed_length)
+    timing = header(start, b"server-timing").decode()
+    assert timing.startswith("total;dur=") and "chain;dur=10.0" in timing
+    assert body["body"] == b"{}" and not end.get("more_body", False)
+    [(method, path, status, total, timings, profile_id)] = logged
+    assert (method, path, status, profile_id) == ("POST", "/test", 200, None)
+
+
+def test_streamed_response_is_timed_to_its_last_chunk(logged):
+    start, first, last = run(streamed, headers=[(b"x-profile", b"1")])
+    assert header(start, b"server-timing") is None
+    profile_id = header(start, b"x-profile-id").decode()
+    assert first["more_body"] and not last["more_body"]
+    [(_, _, status, total, timings, logged_profile)] = logged
+    assert status == 200 and total >= 0.05
+    assert timings == {"upstream_call": 0.05}
+    assert logged_profile == profile_id
+    assert os.path.exists(profiler.profile_path(profile_id))
+
+
+def test_untimed_paths_pass_through(logged):
+    start, *_ = run(fixed_length, path="/health")
+    assert header(start, b"server-timing") is None
+    assert logged == []
+
+
+def test_failed_request_is_still_logged(logged):
+    async def failing(scope, receive, send):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        run(failing)
+    assert logged[0][2] == 500
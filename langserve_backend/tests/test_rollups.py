@@ -0,0 +1,100 @@
+import pytest
+
+from clock import FakeClock
+from utils import rollups as rollups_module
+from utils.rollups import RollupStore
+from utils.shared_state import SQLiteState
+
+START = 1_000_020.0  # 20s into a minute, so minute starts are START // 60 * 60
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock(START)
+    monkeypatch.setattr(rollups_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return RollupStore(
+        resolutions=(("minute", 60, 3), ("hour", 3600, 2)),
+        state=SQLiteState(str(tmp_path / "state.db"))
+    )
+
+
+def test_traffic_is_aggregated_per_bucket(store):
+    store.record_diagnosis(0.3, "Cardiology")
+    store.record_diagnosis(2.5, "Cardiology")
+    store.record_diagnosis(40, "Error: upstream down")
+    store.count("cache_hits", 3)
+    store.count("cache_misses")
+
+    [bucket] = store.series("minute")
+    assert bucket["start"] == START // 60 * 60
+    assert bucket["requests"] == 3
+    assert bucket["categories"] == {"Cardiology": 2, "error": 1}
+    assert bucket["latency_max"] == 40
+    assert bucket["latency_p50"] == 3
+    assert bucket["cache_hit_ratio"] == 0.75
+
+
+def test_flushes_from_several_processes_merge(store, tmp_path):
+    other = RollupStore(resolutions=(("minute", 60, 3), ("hour", 3600, 2)), state=store.state)
+    store.record_diagnosis(1, "Neurology")
+    other.record_diagnosis(1, "Neurology")
+    store.flush()
+    other.flush()
+    [bucket] = store.series("minute")
+    assert bucket["requests"] == 2
+    assert bucket["categories"] == {"Neurology": 2}
+
+
+def test_each_minute_gets_a_bucket_and_coarser_ones_add_up(store, clock):
+    for minute in range(3):
+        clock.advance(60 if minute else 0)
+        store.record_diagnosis(1, "Dermatology")
+    assert [bucket["requests"] for bucket in store.series("minute")] == [1, 1, 1]
+    assert sum(bucket["requests"] for bucket in store.series("hour")) == 3
+
+
+def test_ring_slot_is_reused_once_its_bucket_leaves_the_window(store, clock):
+    first_minute = START // 60 * 60
+    store.record_diagnosis(1, "Cardiology")
+    store.flush()
+    # Three minutes later the same slot (start // 60 % 3) comes round again
+    clock.advance(180)
+    store.record_diagnosis(5, "Neurology")
+
+    series = store.series("minute")
+    assert [bucket["start"] for bucket in series] == [first_minute + 180]
+    assert series[0]["requests"] == 1
+    assert series[0]["categories"] == {"Neurology": 1}
+    assert len(store.state.scan("rollup:minute:")) == 1
+
+
+def test_unknown_resolution_is_refused(store):
+    with pytest.raises(ValueError):
+        store.series("week")
+
+
+def test_failed_flush_keeps_what_was_not_merged(store):
+    state = store.state
+    update = state.update
+    calls = []
+
+    def failing_on_the_hour(key, fn, ttl=None):
+        calls.append(key)
+        if key.startswith("rollup:hour:") and len(calls) == 2:
+            raise OSError("shared state unavailable")
+        return update(key, fn, ttl=ttl)
+
+    store.state.update = failing_on_the_hour
+    store.record_diagnosis(1, "ENT")
+    with pytest.raises(OSError):
+        store.flush()
+    store.record_diagnosis(1, "ENT")
+    store.flush()
+    # The minute was merged before the failure and not again; the hour was retried
+    assert [bucket["requests"] for bucket in store.series("minute")] == [2]
+    assert [bucket["requests"] for bucket in store.series("hour")] == [2]
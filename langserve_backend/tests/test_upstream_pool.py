@@ -0,0 +1,137 @@
+import pytest
+import requests
+
+from clock import FakeClock
+from utils import upstream_pool as pool_module
+from utils.deadline import RequestAbandoned, request_budget
+from utils.upstream_pool import UpstreamPool
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def answer(status_code=200, headers=None):
+    return lambda member: FakeResponse(status_code, headers)
+
+
+def refuse(member):
+    raise requests.exceptions.ConnectionError("refused")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(pool_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def pool(clock):
+    return UpstreamPool(
+        endpoints=["https://a.example/v1", "https://b.example/v1"], keys=["key-a"],
+        eject_failures=3, eject_seconds=30, eject_max_seconds=100, failover=1
+    )
+
+
+def fail(pool, member, times):
+    for _ in range(times):
+        pool.send(member, answer(503))
+
+
+def test_failures_in_a_row_eject_a_member(pool, clock):
+    bad, good = pool.members
+    fail(pool, bad, 2)
+    pool.send(bad, answer(200))
+    fail(pool, bad, 2)
+    assert not bad.ejected_until  # the success reset the run of failures
+
+    pool.send(bad, answer(503))
+    assert bad.ejected_until == clock.now + 30
+    assert all(pool.pick() is good for _ in range(20))
+
+
+def test_ejected_member_is_readmitted_after_one_good_trial_call(pool, clock):
+    bad, good = pool.members
+    fail(pool, bad, 3)
+    clock.advance(31)
+
+    # On probation: picked again, but only for one call at a time
+    seen = {pool.pick(exclude=(good,), strict=True) for _ in range(5)}
+    assert seen == {bad}
+    trial = []
+    pool.send(bad, lambda member: trial.append(pool.pick(exclude=(good,), strict=True)) or FakeResponse(200))
+    assert trial == [None]
+
+    assert bad.ejected_until == 0.0
+    assert bad.error_rate == 0.0
+    assert pool.pick(exclude=(good,), strict=True) is bad
+
+
+def test_failed_trial_call_ejects_again_for_twice_as_long(pool, clock):
+    bad, _ = pool.members
+    fail(pool, bad, 3)
+    clock.advance(31)
+    pool.send(bad, answer(503))
+    assert bad.ejected_until == clock.now + 60
+    clock.advance(61)
+    pool.send(bad, answer(503))
+    assert bad.ejected_until == clock.now + 100  # capped at eject_max_seconds
+
+
+def test_calls_in_flight_at_ejection_do_not_readmit(pool, clock):
+    bad, _ = pool.members
+    fail(pool, bad, 3)
+    pool.send(bad, answer(200))  # started before the ejection, answered during it
+    assert bad.ejected_until > clock.now
+
+
+def test_rate_limited_key_is_skipped_and_the_call_fails_over(clock):
+    pool = UpstreamPool(endpoints=["https://a.example/v1"], keys=["key-a", "key-b"], failover=1)
+    first, second = pool.members
+    limited = FakeResponse(429, {"Retry-After": "10"})
+    responses = {first.name: limited, second.name: FakeResponse(200)}
+
+    response = pool.request(lambda member: responses[member.name], member=first)
+    assert response.status_code == 200
+    assert limited.closed
+    assert all(pool.pick() is second for _ in range(10))
+    clock.advance(11)
+    assert pool.pick(exclude=(second,), strict=True) is first
+
+
+def test_rate_limited_response_is_closed_when_the_request_is_abandoned(clock):
+    pool = UpstreamPool(endpoints=["https://a.example/v1"], keys=["key-a", "key-b"], failover=1)
+    limited = FakeResponse(429, {"Retry-After": "10"})
+
+    with request_budget(0) as budget:
+        def give_up_meanwhile(member):
+            budget.cancel("disconnect")
+            return limited
+
+        with pytest.raises(RequestAbandoned):
+            pool.request(give_up_meanwhile, member=pool.members[0])
+    assert limited.closed
+
+
+def test_connection_error_fails_over_at_most_failover_times(pool):
+    first, second = pool.members
+    assert pool.request(lambda member: refuse(member) if member is first else FakeResponse(200),
+                        member=first).status_code == 200
+    with pytest.raises(requests.exceptions.ConnectionError):
+        pool.request(refuse, member=first)
+
+
+def test_with_nothing_healthy_the_member_back_soonest_is_used(pool, clock):
+    first, second = pool.members
+    fail(pool, first, 3)
+    clock.advance(5)
+    fail(pool, second, 3)
+    assert pool.pick() is first
+    assert pool.pick(strict=True) is None
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from utils.deadline import RequestAbandoned, request_budget
+from utils.upstream_scheduler import UpstreamQueueFull, UpstreamQueueTimeout, UpstreamScheduler
+
+
+def make_scheduler(slots=1):
+    return UpstreamScheduler(
+        slots=slots, weights={"fast": 2.5, "slow": 1.0}, queue_limits={"fast": 10, "slow": 10}, queue_timeout=5
+    )
+
+
+def queued(scheduler):
+    return sum(count for (kind, _), count in scheduler.stats().items() if kind == "queued")
+
+
+def wait_until(condition, timeout=2.0):
+    give_up = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < give_up, "timed out"
+        time.sleep(0.005)
+
+
+def start_waiters(scheduler, classes, granted, labels=None):
+    """One thread per class name, in order, each queued before the next starts
+
+    A thread appends its label, by default its class, to granted once it has a slot.
+    """
+    threads = []
+    for priority_class, label in zip(classes, labels or classes):
+        def run(priority_class=priority_class, label=label):
+            scheduler.acquire(priority_class)
+            granted.append(label)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: queued(scheduler) == len(threads))
+    return threads
+
+
+def test_free_slot_is_taken_without_queueing():
+    scheduler = make_scheduler(slots=2)
+    scheduler.acquire("fast")
+    scheduler.acquire("slow")
+    assert scheduler.stats()[("in_use", "all")] == 2
+    scheduler.release()
+    scheduler.release()
+    assert scheduler.stats()[("in_use", "all")] == 0
+
+
+def test_freed_slots_go_out_by_finish_tag():
+    scheduler = make_scheduler()
+    scheduler.acquire("slow")
+    granted = []
+    # Tags: slow 1, 2; fast 0.4, 0.8, 1.2, 1.6, whatever the arrival order
+    start_waiters(scheduler, ["slow", "slow", "fast", "fast", "fast", "fast"], granted)
+    for served in range(1, 7):
+        scheduler.release()
+        wait_until(lambda: len(granted) == served)
+    assert granted == ["fast", "fast", "slow", "fast", "fast", "slow"]
+
+
+def test_class_is_fifo_and_slot_passes_straight_on():
+    scheduler = make_scheduler()
+    scheduler.acquire("fast")
+    order = []
+    start_waiters(scheduler, ["fast"] * 3, order, labels=["a", "b", "c"])
+    for served in range(1, 4):
+        scheduler.release()
+        wait_until(lambda: len(order) == served)
+        assert scheduler.stats()[("in_use", "all")] == 1
+    assert order == ["a", "b", "c"]
+
+
+def test_resize_grants_added_slots_to_waiters():
+    scheduler = make_scheduler()
+    scheduler.acquire("fast")
+    granted = []
+    start_waiters(scheduler, ["fast", "slow"], granted)
+
+    scheduler.resize(3)
+    wait_until(lambda: len(granted) == 2)
+    assert scheduler.stats()[("in_use", "all")] == 3
+
+    scheduler.resize(1)
+    scheduler.release()
+    scheduler.release()
+    # Over the new size: nothing is handed out until in use drops below it
+    assert scheduler.stats()[("in_use", "all")] == 1
+    start_waiters(scheduler, ["fast"], granted)
+    scheduler.release()
+    wait_until(lambda: len(granted) == 3)
+    assert scheduler.stats()[("in_use", "all")] == 1
+
+
+def test_lowered_size_holds_under_load():
+    scheduler = make_scheduler(slots=3)
+    for _ in range(3):
+        scheduler.acquire("fast")
+    granted = []
+    start_waiters(scheduler, ["fast", "fast"], granted)
+
+    scheduler.resize(1)
+    scheduler.release()
+    scheduler.release()
+    # Freed slots above the new size are retired, not handed to the waiters
+    assert granted == [] and scheduler.stats()[("in_use", "all")] == 1
+    scheduler.release()
+    wait_until(lambda: len(granted) == 1)
+    assert scheduler.stats()[("in_use", "all")] == 1 and queued(scheduler) == 1
+    scheduler.release()
+    wait_until(lambda: len(granted) == 2)
+
+
+def test_full_queue_is_refused():
+    scheduler = UpstreamScheduler(slots=1, weights={"fast": 1.0}, queue_limits={"fast": 0}, queue_timeout=5)
+    scheduler.acquire("fast")
+    with pytest.raises(UpstreamQueueFull):
+        scheduler.acquire("fast")
+
+
+def test_queue_timeout_leaves_the_queue():
+    scheduler = make_scheduler()
+    scheduler.acquire("fast")
+    with pytest.raises(UpstreamQueueTimeout):
+        scheduler.acquire("fast", timeout=0.05)
+    assert queued(scheduler) == 0
+
+
+def test_abandoned_request_stops_waiting():
+    scheduler = make_scheduler()
+    scheduler.acquire("fast")
+    with request_budget(0) as budget:
+        threading.Timer(0.05, budget.cancel, ("disconnect",)).start()
+        started = time.monotonic()
+        with pytest.raises(RequestAbandoned):
+            scheduler.acquire("fast", timeout=5)
+    assert time.monotonic() - started < 1
+    assert queued(scheduler) == 0
+    scheduler.release()
+    assert scheduler.stats()[("in_use", "all")] == 0
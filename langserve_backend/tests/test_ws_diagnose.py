@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+HEADERS = {"Authorization": "Bearer secret-token-123"}
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setenv("SHARED_STATE_PATH", str(tmp_path / "state.db"))
+    monkeypatch.setenv("JOB_DB_PATH", str(tmp_path / "jobs.db"))
+    # Run together with the UI's tests, "auth" may already be the UI's module
+    monkeypatch.syspath_prepend(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if "main" not in sys.modules:
+        monkeypatch.delitem(sys.modules, "auth", raising=False)
+    import main
+
+    release = threading.Event()
+
+    def fake_stream(text, emit, role=None, conversation=None):
+        emit({"type": "category", "symptom_area": "General"})
+        if text == "slow":
+            release.wait(5)
+        for piece in ("answer ", "to ", text):
+            emit({"type": "token", "text": piece})
+        return {"input": text, "symptom_area": "General", "diagnosis": f"answer to {text}"}
+
+    monkeypatch.setattr(main, "run_diagnosis_stream", fake_stream)
+    with TestClient(main.app) as client:
+        client.release = release
+        yield client
+
+
+def receive_until(ws, event_type):
+    events = []
+    while not events or events[-1]["type"] != event_type:
+        events.append(ws.receive_json())
+    return events
+
+
+def test_binary_frame_gets_a_400_event(client):
+    with client.websocket_connect("/ws/diagnose", headers=HEADERS) as ws:
+        ws.receive_json()
+        ws.send_bytes(b"\x00\x01")
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json()["type"] == "pong"
+
+
+def test_messages_waiting_at_disconnect_run_after_resume(client):
+    with client.websocket_connect("/ws/diagnose", headers=HEADERS) as ws:
+        session_id = ws.receive_json()["session_id"]
+        ws.send_json({"type": "message", "text": "slow", "id": "m1"})
+        ws.send_json({"type": "message", "text": "queued", "id": "m2"})
+        seen = ws.receive_json()["seq"]  # m1's category
+
+    client.release.set()
+    with client.websocket_connect(f"/ws/diagnose?session_id={session_id}&last_seq={seen}", headers=HEADERS) as ws:
+        hello = ws.receive_json()
+        assert hello["resumed"]
+        events = receive_until(ws, "result")
+        if events[-1]["message_id"] == "m1":
+            events += receive_until(ws, "result")
+
+    results = [event for event in events if event["type"] == "result"]
+    assert [event["message_id"] for event in results] == ["m1", "m2"]
+    tokens = [event["text"] for event in events if event["type"] == "token" and event["message_id"] == "m1"]
+    assert "".join(tokens) == "answer to slow"
+    seqs = [event["seq"] for event in events]
+    # Tokens emitted while detached come back merged, so seqs may skip but never repeat
+    assert seqs == sorted(set(seqs)) and seqs[0] > seen
+
+
+def test_job_role_comes_from_credentials_not_the_body(client, monkeypatch):
+    import main
+
+    submitted = []
+    monkeypatch.setattr(main.job_queue, "submit", lambda payload, owner: submitted.append(payload) or {"job_id": "j"})
+    response = client.post("/jobs", headers=HEADERS, json={"input": "cough", "role": "doctor", "user": "bob"})
+    assert response.status_code == 202
+    assert submitted[0]["role"] is None and "user" not in submitted[0]
@@ -0,0 +1,68 @@
+import asyncio
+
+from utils import ws_sessions
+from utils.ws_sessions import DiagnosisSession, SessionStore
+
+
+def run_turn(session, message_id, tokens):
+    session.emit({"type": "category", "message_id": message_id, "symptom_area": "Cardiology"})
+    for text in tokens:
+        session.emit({"type": "token", "message_id": message_id, "text": text})
+    session.emit({"type": "result", "message_id": message_id})
+    session.finish_turn({"diagnosis": "".join(tokens)})
+
+
+def replay(session, last_seq=0):
+    return session.attach(asyncio.new_event_loop(), asyncio.Queue(), last_seq)
+
+
+def test_tokens_of_an_answer_are_buffered_as_one_event():
+    session = DiagnosisSession("s", "user:a", "user")
+    run_turn(session, "m1", ["The ", "heart ", "is ", "fine"])
+    assert len(session.events) == 3
+    category, tokens, result = replay(session)
+    assert tokens == {"type": "token", "message_id": "m1", "seq": 5, "text": "The heart is fine"}
+    assert (category["seq"], result["seq"]) == (1, 6)
+
+
+def test_resume_mid_answer_sends_only_the_unseen_tokens():
+    session = DiagnosisSession("s", "user:a", "user")
+    run_turn(session, "m1", ["The ", "heart ", "is ", "fine"])
+    # seq 1 is the category, 2-5 the tokens
+    tokens, result = replay(session, last_seq=3)
+    assert tokens["text"] == "is fine"
+    assert [event["seq"] for event in replay(session, last_seq=5)] == [6]
+
+
+def test_each_answer_keeps_its_own_token_event():
+    session = DiagnosisSession("s", "user:a", "user")
+    run_turn(session, "m1", ["a", "b"])
+    run_turn(session, "m2", ["c", "d"])
+    assert [event.get("text") for event in replay(session) if event["type"] == "token"] == ["ab", "cd"]
+
+
+def test_replay_buffer_holds_whole_answers(monkeypatch):
+    monkeypatch.setattr(ws_sessions, "WS_REPLAY_EVENTS", 6)
+    session = DiagnosisSession("s", "user:a", "user")
+    for turn in range(3):
+        run_turn(session, f"m{turn}", ["x"] * 500)
+    # Two full answers fit in six events despite 1000 tokens between them
+    assert [event["message_id"] for event in replay(session)] == ["m1"] * 3 + ["m2"] * 3
+
+
+def test_finished_turns_are_capped(monkeypatch):
+    monkeypatch.setattr(ws_sessions, "WS_MAX_TURNS", 2)
+    session = DiagnosisSession("s", "user:a", "user")
+    for turn in range(5):
+        session.finish_turn({"turn": turn})
+    assert session.turn_count == 5
+    assert [turn["turn"] for turn in session.turns] == [3, 4]
+
+
+def test_store_resumes_only_for_the_same_principal():
+    store = SessionStore(ttl=60, max_sessions=10)
+    session, resumed = store.open(None, "user:a", "user")
+    assert not resumed
+    assert store.open(session.session_id, "user:a", "user") == (session, True)
+    other, resumed = store.open(session.session_id, "user:b", "user")
+    assert other is not session and not resumed
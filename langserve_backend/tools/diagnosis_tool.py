@@ -1,28 +1,107 @@
-from langchain.tools import tool
+from langchain_core.tools import tool
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.euri_client import euri_chat_completion
+import time
+from typing import Optional
+from utils.conversation import conversations
+from utils.deadline import RequestAbandoned
+from utils.euri_client import euri_chat_completion, euri_chat_completion_stream
+from utils.metrics import time_stage
+from utils.model_router import router
+from utils.rollups import rollups
+
+
+def build_messages(symptom_description, conversation=None):
+    """The prompt for one turn; conversation, if given, adds that conversation's summary and recent turns"""
+    with time_stage("prompt_build"):
+        history = conversations.context_messages(conversation) if conversation else []
+        return history + [
+            {
+                "role": "user",
+                "content": f"A patient reports: {symptom_description}. What are the possible diagnoses, next steps, and suggested treatments for this condition?"
+            }
+        ]
 
 
 @tool
-def ai_diagnosis(symptom_description: str) -> str:
+def ai_diagnosis(symptom_description: str, symptom_area: Optional[str] = None, role: Optional[str] = None,
+                 conversation: Optional[str] = None) -> str:
     """Use euri to provide diagnosis suggestions based on symptoms reported by users.
 
     Args:
         symptom_description: A string describing the patient's symptoms
+        symptom_area: Category from check_symptom, used to pick the model tier
+        role: Role of the requesting user, used to pick the model tier
+        conversation: Conversation key; earlier turns are sent along and this one is recorded
 
     Returns:
         A string containing possible diagnoses, next steps, and treatment suggestions
     """
     try:
-        message = [
-            {
-                "role": "user",
-                "content": f"A patient reports: {symptom_description}. What are the possible diagnoses, next steps, and suggested treatments for this condition?"
-            }
-        ]
-
-        return euri_chat_completion(messages=message)
+        message = build_messages(symptom_description, conversation)
+        decision = router.route(symptom_description, symptom_area, role)
+        usage = {}
+        started = time.perf_counter()
+        try:
+            diagnosis = euri_chat_completion(
+                messages=message,
+                model=decision["model"],
+                temperature=decision["temperature"],
+                max_tokens=decision["max_tokens"],
+                usage=usage
+            )
+        except RequestAbandoned:
+            raise  # says nothing about the tier's health
+        except Exception:
+            router.record(decision, time.perf_counter() - started, ok=False)
+            raise
+        router.record(
+            decision, time.perf_counter() - started, ok=True,
+            tokens=usage.get("total_tokens", 0), cached=usage.get("cached", False)
+        )
+        if conversation:
+            conversations.append(conversation, symptom_description, diagnosis)
+        return diagnosis
+    except RequestAbandoned:
+        raise
     except Exception as e:
-        return f"Error occurred while processing diagnosis request: {str(e)}"
\ No newline at end of file
+        rollups.count("errors")
+        return f"Error occurred while processing diagnosis request: {str(e)}"
+
+def stream_diagnosis(symptom_description, symptom_area=None, role=None, decision_out=None, conversation=None):
+    """Like ai_diagnosis, but yields the diagnosis text as it is generated
+
+    Errors are raised rather than returned as text, so streaming callers can
+    tell them apart from tokens. decision_out, if given, receives the model
+    routing decision.
+    """
+    message = build_messages(symptom_description, conversation)
+    decision = router.route(symptom_description, symptom_area, role)
+    if decision_out is not None:
+        decision_out.update(decision)
+    usage = {}
+    parts = []
+    started = time.perf_counter()
+    try:
+        for text in euri_chat_completion_stream(
+            messages=message,
+            model=decision["model"],
+            temperature=decision["temperature"],
+            max_tokens=decision["max_tokens"],
+            usage=usage
+        ):
+            parts.append(text)
+            yield text
+    except RequestAbandoned:
+        raise
+    except Exception:
+        router.record(decision, time.perf_counter() - started, ok=False)
+        rollups.count("errors")
+        raise
+    router.record(
+        decision, time.perf_counter() - started, ok=True,
+        tokens=usage.get("total_tokens", 0), cached=usage.get("cached", False)
+    )
+    if conversation:
+        conversations.append(conversation, symptom_description, "".join(parts))
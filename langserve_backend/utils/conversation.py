@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics import Counter, Histogram, time_stage
+from utils.shared_state import get_shared_state
+from utils.upstream_scheduler import upstream_priority
+
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", "86400"))  # seconds after the last turn
+# Once the verbatim turns pass this estimate, the older ones are folded into the summary
+CONVERSATION_CONTEXT_TOKENS = int(os.getenv("CONVERSATION_CONTEXT_TOKENS", "1500"))
+CONVERSATION_KEEP_TURNS = int(os.getenv("CONVERSATION_KEEP_TURNS", "1"))  # newest turns never summarized
+CONVERSATION_SUMMARY_MODEL = os.getenv("CONVERSATION_SUMMARY_MODEL", "gpt-4.1-nano")
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "300"))  # summary length cap
+
+CONVERSATION_SUMMARIES = Counter(
+    "conversation_summaries_total", "Rolling conversation summary updates by outcome", ("result",)
+)
+CONTEXT_TOKENS = Histogram(
+    "conversation_context_tokens", "Estimated tokens of conversation context sent with a turn", (),
+    buckets=(0, 100, 250, 500, 1000, 1500, 2000, 3000, 5000)
+)
+
+SUMMARY_PROMPT = (
+    "You maintain a running clinical summary of a symptom consultation. Merge the "
+    "existing summary and the new exchanges into one updated summary. Keep every "
+    "reported symptom, onset and duration, severity, relevant history and the "
+    "diagnoses and next steps already suggested. Drop pleasantries and repetition. "
+    "Answer with the summary only, in at most {words} words."
+)
+
+
+def estimate_tokens(text):
+    # About four characters per token for English; close enough for a budget
+    return len(text or "") // 4 + 1
+
+
+def conversation_key(principal, conversation_id):
+    """Storage id for a caller's conversation, so one caller cannot read another's"""
+    digest = hashlib.sha256(f"{principal}\0{conversation_id}".encode()).hexdigest()[:32]
+    return f"conversation:{digest}"
+
+
+class ConversationStore:
+    """Turns of multi-turn diagnoses with a rolling summary, shared by all workers
+
+    A conversation is {"summary": str, "turns": [{"user", "assistant"}]}.
+    Prompts carry the summary plus the turns not yet summarized. When those
+    turns grow past CONVERSATION_CONTEXT_TOKENS, all but the newest
+    CONVERSATION_KEEP_TURNS are merged into the summary in the background,
+    so the context sent with each turn stays roughly constant in size.
+    """
+
+    def __init__(self, ttl=CONVERSATION_TTL, context_tokens=CONVERSATION_CONTEXT_TOKENS,
+                 keep_turns=CONVERSATION_KEEP_TURNS, state=None):
+        self.ttl = ttl
+        self.context_tokens = context_tokens
+        self.keep_turns = keep_turns
+        self._state = state
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def state(self):
+        if self._state is None:
+            self._state = get_shared_state()
+        return self._state
+
+    def get(self, key):
+        return self.state.get(key) or {"summary": "", "turns": []}
+
+    def is_new(self, key):
+        """True before a conversation's first turn, when its prompt is the same as a standalone input's"""
+        conversation = self.get(key)
+        return not conversation["summary"] and not conversation["turns"]
+
+    def context_messages(self, key):
+        """Chat messages that give the model the conversation so far"""
+        conversation = self.get(key)
+        messages = []
+        if conversation["summary"]:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the consultation so far: {conversation['summary']}"
+            })
+        for turn in conversation["turns"]:
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["assistant"]})
+        CONTEXT_TOKENS.observe(sum(estimate_tokens(message["content"]) for message in messages))
+        return messages
+
+    def append(self, key, user, assistant):
+        """Record a finished turn and start summarizing if the context is over budget"""
+        def add_turn(conversation):
+            conversation = conversation or {"summary": "", "turns": []}
+            conversation["turns"].append({"user": user, "assistant": assistant})
+            return conversation
+
+        conversation = self.state.update(key, add_turn, ttl=self.ttl)
+        if self._turn_tokens(conversation["turns"]) > self.context_tokens:
+            self._schedule_summary(key)
+
+    @staticmethod
+    def _turn_tokens(turns):
+        return sum(estimate_tokens(turn["user"]) + estimate_tokens(turn["assistant"]) for turn in turns)
+
+    def _schedule_summary(self, key):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._executor is None:
+                # Created on first use, in the worker process that needs it
+                self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+        self._executor.submit(self._summarize, key)
+
+    def _summarize(self, key):
+        try:
+            conversation = self.get(key)
+            folded = conversation["turns"][:-self.keep_turns] if self.keep_turns else conversation["turns"]
+            if not folded:
+                return
+            # Summaries are background work, so they yield to interactive calls
+            with upstream_priority("batch"), time_stage("conversation_summary"):
+                summary = self._summary_for(conversation["summary"], folded)
+
+            def fold(current):
+                current = current or {"summary": "", "turns": []}
+                # Turns appended meanwhile stay; only the folded ones are replaced
+                if current["turns"][:len(folded)] == folded:
+                    current["turns"] = current["turns"][len(folded):]
+                    current["summary"] = summary
+                return current
+
+            self.state.update(key, fold, ttl=self.ttl)
+            CONVERSATION_SUMMARIES.inc("ok")
+        except Exception as e:
+            CONVERSATION_SUMMARIES.inc("error")
+            print(f"❌ Conversation summary failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    @staticmethod
+    def _summary_for(summary, turns):
+        from utils.euri_client import euri_chat_completion
+
+        exchanges = "\n\n".join(f"Patient: {turn['user']}\nAssistant: {turn['assistant']}" for turn in turns)
+        return euri_chat_completion(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT.format(words=int(CONVERSATION_SUMMARY_TOKENS * 0.7))},
+                {"role": "user", "content": f"Existing summary: {summary or '(none)'}\n\nNew exchanges:\n{exchanges}"},
+            ],
+            model=CONVERSATION_SUMMARY_MODEL,
+            temperature=0.2,
+            max_tokens=CONVERSATION_SUMMARY_TOKENS
+        )
+
+
+conversations = ConversationStore()
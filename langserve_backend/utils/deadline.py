@@ -0,0 +1,180 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.metrics import Counter
+
+# Clients send how many seconds they will wait for the response
+DEADLINE_HEADER = b"x-request-timeout"
+# Longest deadline honoured, and how long a poll for cancellation may sleep
+REQUEST_TIMEOUT_MAX = float(os.getenv("REQUEST_TIMEOUT_MAX", "300"))
+CANCEL_POLL_INTERVAL = 0.1
+
+ABANDONED_WORK = Counter(
+    "abandoned_work_total",
+    "Work skipped or stopped because the client disconnected or its deadline passed",
+    ("stage", "reason")
+)
+
+
+class RequestAbandoned(Exception):
+    """Raised where work stops because nobody is waiting for its result any more"""
+
+    def __init__(self, reason):
+        super().__init__(f"Request abandoned: {reason}")
+        self.reason = reason
+
+
+class Budget:
+    """Deadline and cancellation flag of one request, shared by every thread working on it"""
+
+    __slots__ = ("expires_at", "cancelled", "reason")
+
+    def __init__(self, timeout=None):
+        self.expires_at = time.monotonic() + timeout if timeout else None
+        self.cancelled = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason):
+        self.reason = reason
+        self.cancelled.set()
+
+    def abandoned(self):
+        """Why the work should stop, or None while it is still wanted"""
+        if self.cancelled.is_set():
+            return self.reason
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            return "deadline"
+        return None
+
+
+_budget: ContextVar = ContextVar("request_budget", default=None)
+
+
+@contextmanager
+def request_budget(timeout=None):
+    """Bind the enclosed work to a new budget; timeout 0 means cancellable but no deadline
+
+    request_budget(None) unbinds the work from any budget, for work that
+    must outlive the request.
+    """
+    budget = Budget(timeout) if timeout is not None else None
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+def current_budget():
+    return _budget.get()
+
+
+def remaining():
+    """Seconds left before the current request's deadline, or None without one"""
+    budget = _budget.get()
+    if budget is None or budget.expires_at is None:
+        return None
+    return budget.expires_at - time.monotonic()
+
+
+def timeout_for(default):
+    """default, capped at what is left of the current request's deadline"""
+    left = remaining()
+    return default if left is None else max(0.001, min(default, left))
+
+
+def check(stage):
+    """Raise RequestAbandoned, and count the work saved, if the caller has gone or run out of time"""
+    budget = _budget.get()
+    reason = budget.abandoned() if budget is not None else None
+    if reason is not None:
+        ABANDONED_WORK.inc(stage, reason)
+        raise RequestAbandoned(reason)
+
+
+class RequestDeadlineMiddleware:
+    """Give each HTTP request a Budget and cancel it when the client disconnects
+
+    The deadline comes from the X-Request-Timeout header, in seconds,
+    capped at REQUEST_TIMEOUT_MAX. Once the request body has been read, the
+    server's next message can only be the disconnect, so it is awaited in
+    the background; the app's own later receive() calls get it from there.
+    A request without Content-Length or Transfer-Encoding has no body, and
+    handlers that never call receive() are common, so for those the
+    background listener starts at once and hands the app the empty body.
+    Plain ASGI so the budget is set before any other middleware copies the
+    request's context.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timeout = None
+        bodiless = True
+        for name, value in scope["headers"]:
+            if name == DEADLINE_HEADER:
+                try:
+                    timeout = min(max(float(value), 0.0), REQUEST_TIMEOUT_MAX)
+                except ValueError:
+                    pass
+            elif name == b"transfer-encoding" or (name == b"content-length" and value.strip() != b"0"):
+                bodiless = False
+
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+        # Messages the listener read before the app asked, for a bodiless request
+        early = asyncio.Queue()
+        app_done = False  # the app has had the last body message or the disconnect
+        response_sent = False
+        if bodiless:
+            body_read.set()
+
+        async def receive_wrapper():
+            nonlocal app_done
+            if bodiless and not app_done:
+                message = await early.get()
+            elif body_read.is_set():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            else:
+                message = await receive()
+            if message["type"] == "http.disconnect":
+                app_done = True
+                disconnected.set()
+            elif not message.get("more_body", False):
+                app_done = True
+                body_read.set()
+            return message
+
+        async def send_wrapper(message):
+            nonlocal response_sent
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
+            await send(message)
+
+        with request_budget(timeout if timeout is not None else 0) as budget:
+            async def watch_disconnect():
+                await body_read.wait()
+                while True:
+                    message = await receive()
+                    if bodiless:
+                        early.put_nowait(message)
+                    if message["type"] == "http.disconnect":
+                        break
+                disconnected.set()
+                if not response_sent:
+                    budget.cancel("disconnect")
+
+            watcher = asyncio.create_task(watch_disconnect())
+            try:
+                await self.app(scope, receive_wrapper, send_wrapper)
+            finally:
+                watcher.cancel()
@@ -1,21 +1,37 @@
+import json
 import requests
 import os
 from dotenv import load_dotenv
+from utils.deadline import RequestAbandoned, check, timeout_for
+from utils.hedging import hedger
+from utils.metrics import UPSTREAM_RESPONSES, UPSTREAM_TOKENS, time_stage
+from utils.response_cache import ResponseCache, is_cacheable
+from utils.upstream_pool import upstream_pool
+from utils.upstream_scheduler import UPSTREAM_SLOTS, scheduler
 
 # Load environment variables from .env file
 load_dotenv()
 
-API_KEY = os.getenv("EURI_API_KEY")
-BASE_URL = "https://api.euron.one/api/v1/euri/alpha/chat/completions"
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "60"))  # seconds
 
-def euri_chat_completion(messages, model="gpt-4.1-nano", temperature=0.7, max_tokens=1000):
-    if not API_KEY:
+# Each API key has its own rate limit, so upstream capacity grows with the keys
+scheduler.resize(UPSTREAM_SLOTS * max(upstream_pool.key_count, 1))
+
+# With RESPONSE_CACHE_TTL set, identical temperature-0 requests within it are
+# answered from the cache shared by all workers instead of calling the API again
+completion_cache = ResponseCache("euri_completion")
+
+# One keep-alive connection pool for all calls instead of a new connection each time
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=32))
+
+def _require_key():
+    if not upstream_pool.members:
         raise Exception("EURI_API_KEY not found in environment variables.")
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+def euri_chat_completion(messages, model="gpt-4.1-nano", temperature=0.7, max_tokens=1000, usage=None):
+    """Return the completion text; usage, if given, is filled with token counts and a cached flag"""
+    _require_key()
     payload = {
         "model": model,
         "messages": messages,
@@ -23,19 +39,128 @@ def euri_chat_completion(messages, model="gpt-4.1-nano", temperature=0.7, max_to
         "max_tokens": max_tokens
     }
 
+    cache_key = completion_cache.key(payload) if is_cacheable(payload) else None
+    cached = completion_cache.get(cache_key) if cache_key else None
+    if usage is not None:
+        usage["cached"] = cached is not None
+    if cached is not None:
+        return cached
+
     try:
-        response = requests.post(BASE_URL, headers=headers, json=payload)
+        try:
+            # Wait for a slot in the caller's priority class, then time the call itself.
+            # Both only get what is left of the caller's deadline.
+            with scheduler.slot(timeout=timeout_for(scheduler.queue_timeout)), time_stage("upstream_call"):
+                check("before_upstream")
+                # Pool members are picked by load and health; a hedge goes to a different one
+                response = hedger.call(
+                    lambda member: upstream_pool.request(
+                        lambda target: _session.post(target.url, headers=target.headers(), json=payload,
+                                                     timeout=timeout_for(UPSTREAM_TIMEOUT)),
+                        member
+                    ),
+                    upstream_pool.targets()
+                )
+        except requests.exceptions.RequestException as e:
+            UPSTREAM_RESPONSES.inc(type(e).__name__)
+            check("upstream_call")  # timed out because the caller's deadline passed
+            raise
+        UPSTREAM_RESPONSES.inc(response.status_code)
         response.raise_for_status()
 
         response_data = response.json()
+        token_usage = response_data.get("usage") or {}
+        UPSTREAM_TOKENS.inc("prompt", amount=token_usage.get("prompt_tokens", 0))
+        UPSTREAM_TOKENS.inc("completion", amount=token_usage.get("completion_tokens", 0))
+        if usage is not None:
+            usage.update(token_usage)
         if "choices" in response_data and len(response_data["choices"]) > 0:
-            return response_data["choices"][0]["message"]["content"]
+            content = response_data["choices"][0]["message"]["content"]
+            if cache_key and content:
+                completion_cache.set(cache_key, content)
+            return content
         else:
             raise ValueError("Invalid response format from API")
 
+    except RequestAbandoned:
+        raise
     except requests.exceptions.RequestException as e:
         raise Exception(f"API request failed: {str(e)}")
     except (KeyError, IndexError) as e:
         raise Exception(f"Error parsing API response: {str(e)}")
     except Exception as e:
         raise Exception(f"Unexpected error: {str(e)}")
+
+
+def euri_chat_completion_stream(messages, model="gpt-4.1-nano", temperature=0.7, max_tokens=1000, usage=None):
+    """Yield the completion text in pieces as the API streams it
+
+    Shares the response cache with euri_chat_completion: a cached completion
+    is yielded whole, and a stream is cached only once the API has ended it
+    with [DONE], never a cut-off one. The upstream slot is held until the
+    stream ends or the caller stops iterating.
+    """
+    _require_key()
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+
+    cache_key = completion_cache.key(payload) if is_cacheable(payload) else None
+    cached = completion_cache.get(cache_key) if cache_key else None
+    if usage is not None:
+        usage["cached"] = cached is not None
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    finished = False
+    with scheduler.slot(timeout=timeout_for(scheduler.queue_timeout)), time_stage("upstream_call"):
+        check("before_upstream")
+        try:
+            response = upstream_pool.request(
+                lambda target: _session.post(
+                    target.url, headers=target.headers(), json=dict(payload, stream=True), stream=True,
+                    timeout=timeout_for(UPSTREAM_TIMEOUT)
+                )
+            )
+        except requests.exceptions.RequestException as e:
+            UPSTREAM_RESPONSES.inc(type(e).__name__)
+            raise Exception(f"API request failed: {str(e)}")
+        UPSTREAM_RESPONSES.inc(response.status_code)
+
+        with response:
+            try:
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"API request failed: {str(e)}")
+
+            # Server-sent events: "data: {chunk}" lines, ended by "data: [DONE]"
+            for line in response.iter_lines(decode_unicode=True):
+                # Leaving the loop closes the connection, so generation stops upstream too
+                check("upstream_stream")
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    finished = True
+                    break
+                chunk = json.loads(data)
+                token_usage = chunk.get("usage")
+                if token_usage:
+                    UPSTREAM_TOKENS.inc("prompt", amount=token_usage.get("prompt_tokens", 0))
+                    UPSTREAM_TOKENS.inc("completion", amount=token_usage.get("completion_tokens", 0))
+                    if usage is not None:
+                        usage.update(token_usage)
+                for choice in chunk.get("choices") or []:
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        parts.append(text)
+                        yield text
+
+    text = "".join(parts)
+    if cache_key and finished and text:
+        completion_cache.set(cache_key, text)
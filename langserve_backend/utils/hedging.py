@@ -0,0 +1,202 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.deadline import CANCEL_POLL_INTERVAL, RequestAbandoned, check, current_budget
+from utils.metrics import REGISTRY, Counter
+from utils.upstream_scheduler import scheduler
+
+UPSTREAM_HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE_ENABLED", "0") == "1"
+# Send the second attempt once the first has run longer than this percentile
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95"))
+# Floor for the hedge delay, and the delay used until enough latencies are known
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY_MS", "1000")) / 1000
+# At most this share of recent calls may be hedged
+UPSTREAM_HEDGE_BUDGET = float(os.getenv("UPSTREAM_HEDGE_BUDGET", "0.1"))
+UPSTREAM_HEDGE_WINDOW = int(os.getenv("UPSTREAM_HEDGE_WINDOW", "1000"))
+
+# Latency samples needed before the percentile replaces the minimum delay
+MIN_SAMPLES = 50
+# Recompute the percentile after this many new samples
+RECOMPUTE_EVERY = 25
+
+UPSTREAM_HEDGES = Counter(
+    "upstream_hedges_total",
+    "Hedged upstream calls: sent, won (hedge answered first), lost, skipped (over budget or no free slot)",
+    ("outcome",)
+)
+
+
+class Hedger:
+    """Tail-latency hedging: a second identical attempt once the first is slow
+
+    The first attempt that returns wins; if one attempt raises, the other is
+    still awaited. Blocking HTTP calls cannot be aborted mid-flight, so the
+    loser is abandoned: its thread finishes in the background (bounded by
+    the upstream timeout) and its response is closed when it arrives. Calls
+    made for a request with a budget (utils.deadline) are abandoned the same
+    way as soon as the client disconnects or the deadline passes.
+
+    The caller holds one upstream slot; a hedge is only sent if a second
+    one is free at once, and that slot is held until both attempts are
+    done. With hedging disabled fn runs inline in the caller's thread.
+    """
+
+    def __init__(self, enabled=UPSTREAM_HEDGE_ENABLED, percentile=UPSTREAM_HEDGE_PERCENTILE,
+                 min_delay=UPSTREAM_HEDGE_MIN_DELAY, budget=UPSTREAM_HEDGE_BUDGET, window=UPSTREAM_HEDGE_WINDOW):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._new_samples = 0
+        self._delay = min_delay
+        # Whether each of the last `window` calls was hedged, and how many were
+        self._recent = deque(maxlen=window)
+        self._hedged = 0
+        self._executor = None
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._new_samples += 1
+            if len(self._latencies) >= MIN_SAMPLES and self._new_samples >= RECOMPUTE_EVERY:
+                ordered = sorted(self._latencies)
+                index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+                self._delay = max(self.min_delay, ordered[index])
+                self._new_samples = 0
+
+    def delay(self):
+        return self._delay
+
+    def _note_call(self, hedged):
+        with self._lock:
+            if len(self._recent) == self._recent.maxlen:
+                self._hedged -= self._recent[0]
+            self._recent.append(hedged)
+            self._hedged += hedged
+
+    def _within_budget(self):
+        with self._lock:
+            return self._hedged + 1 <= self.budget * max(len(self._recent), 1 / self.budget)
+
+    def _submit(self, fn, target):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # Every attempt in flight holds an upstream slot, except ones abandoned
+                    # with their request; twice the slots leaves room for those
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=2 * max(scheduler.slots, 1), thread_name_prefix="upstream-hedge"
+                    )
+        # Run in a copy of the caller's context so request timing still applies
+        context = contextvars.copy_context()
+        started = time.perf_counter()
+
+        def attempt():
+            result = context.run(fn, target)
+            self.record_latency(time.perf_counter() - started)
+            return result
+
+        return self._executor.submit(attempt)
+
+    def _wait(self, futures, timeout=None):
+        """wait() for the first future to finish, raising RequestAbandoned once the request is"""
+        if current_budget() is None:
+            return wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        give_up = None if timeout is None else time.monotonic() + timeout
+        while True:
+            step = CANCEL_POLL_INTERVAL if give_up is None else max(0.0, min(CANCEL_POLL_INTERVAL, give_up - time.monotonic()))
+            done, pending = wait(futures, timeout=step, return_when=FIRST_COMPLETED)
+            if done or (give_up is not None and time.monotonic() >= give_up):
+                return done, pending
+            check("upstream_call")
+
+    def call(self, fn, targets):
+        """Return fn(targets[0]), hedged with fn(targets[1 % len(targets)]) if it is slow"""
+        if not self.enabled:
+            started = time.perf_counter()
+            result = fn(targets[0])
+            self.record_latency(time.perf_counter() - started)
+            return result
+
+        primary = self._submit(fn, targets[0])
+        attempts = [primary]
+        try:
+            done, _ = self._wait([primary], timeout=self.delay())
+            if done:
+                self._note_call(False)
+                return primary.result()
+
+            if not (self._within_budget() and scheduler.try_acquire()):
+                UPSTREAM_HEDGES.inc("skipped")
+                self._note_call(False)
+                self._wait([primary])
+                return primary.result()
+
+            UPSTREAM_HEDGES.inc("sent")
+            self._note_call(True)
+            try:
+                hedge = self._submit(fn, targets[1 % len(targets)])
+            except Exception:
+                scheduler.release()
+                raise
+            attempts.append(hedge)
+            _when_all_done(attempts, scheduler.release)
+            pending = {primary, hedge}
+            while True:
+                done, pending = self._wait(pending)
+                winner = next((future for future in done if future.exception() is None), None)
+                if winner is None and pending:
+                    continue  # one attempt failed; the other may still answer
+                winner = winner or next(iter(done))
+                UPSTREAM_HEDGES.inc("won" if winner is hedge else "lost")
+                for future in attempts:
+                    if future is not winner:
+                        future.add_done_callback(_close_result)
+                return winner.result()
+        except RequestAbandoned:
+            for future in attempts:
+                future.add_done_callback(_close_result)
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                "delay_seconds": self._delay,
+                "hedged_share": self._hedged / len(self._recent) if self._recent else 0.0,
+            }
+
+
+def _close_result(future):
+    """Done callback for an abandoned attempt: close its response so the connection is freed"""
+    if not future.cancelled() and future.exception() is None:
+        close = getattr(future.result(), "close", None)
+        if close is not None:
+            close()
+
+
+def _when_all_done(futures, callback):
+    left = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            left[0] -= 1
+            last = left[0] == 0
+        if last:
+            callback()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+hedger = Hedger()
+REGISTRY.register_collector(
+    "upstream_hedge", "Current hedge delay and share of recent calls hedged", ("stat",),
+    hedger.stats
+)
@@ -0,0 +1,365 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.deadline import RequestAbandoned, request_budget
+
+JOB_DB_PATH = os.getenv(
+    "JOB_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "jobs.db")
+)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+# Threads running the jobs /test waits for up to its deadline, per process
+JOB_DIRECT_WORKERS = int(os.getenv("JOB_DIRECT_WORKERS", "8"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", str(7 * 86400)))  # seconds
+# How often running jobs look for a cancel made through another worker process
+JOB_CANCEL_POLL = float(os.getenv("JOB_CANCEL_POLL", "1.0"))  # seconds
+
+CANCEL_REASON = "job_cancelled"
+
+PENDING_STATUSES = ("queued", "running")
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    stage TEXT,
+    partial TEXT,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    claimed_by INTEGER,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation was requested"""
+
+
+class JobQueue:
+    """Durable job queue in a local SQLite file, drained by a bounded pool of worker threads
+
+    handler(payload, report) runs one job and returns a JSON-serialisable
+    result. report(progress, stage, partial) records progress and raises
+    JobCancelled if the job was cancelled meanwhile. The handler also runs
+    under its own request budget (utils.deadline), cancelled together with
+    the job, so waits for an upstream slot or response stop at once.
+    """
+
+    def __init__(self, handler, db_path=JOB_DB_PATH, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED,
+                 direct_workers=JOB_DIRECT_WORKERS):
+        self.handler = handler
+        self.db_path = db_path
+        self.workers = workers
+        self.max_queued = max_queued
+        self.direct_workers = direct_workers
+        self._direct = None
+        self._direct_pending = 0  # jobs handed to execute_async() and not finished
+        self._direct_lock = threading.Lock()
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._budgets = {}  # job id -> Budget of the jobs running in this process
+        self._budgets_lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("claimed_by", "INTEGER"), ("owner", "TEXT")):
+            if column not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    pass  # added concurrently by another worker
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection inherited across fork must not be used by the child
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit; multi-statement updates use explicit BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # -- lifecycle ----------------------------------------------------------
+
+    def start(self, recover=True):
+        """Start the workers, first requeueing jobs interrupted by a restart
+
+        With several worker processes sharing the database, pass
+        recover=False and let the process manager call requeue_interrupted()
+        instead, or one worker restarting would requeue its siblings' jobs.
+        """
+        if recover:
+            self.requeue_interrupted()
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') AND updated_at < ?",
+            (time.time() - JOB_RESULT_TTL,)
+        )
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._watch_cancels, name="job-cancel-watcher", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        with self._direct_lock:
+            if self._direct is not None:
+                self._direct.shutdown(wait=False)
+                self._direct = None
+
+    def requeue_interrupted(self, pid=None):
+        """Put running jobs back in the queue, only those claimed by pid if given"""
+        query = "UPDATE jobs SET status = 'queued', claimed_by = NULL, updated_at = ? WHERE status = 'running'"
+        params = (time.time(),)
+        if pid is not None:
+            query += " AND claimed_by = ?"
+            params += (pid,)
+        return self._conn().execute(query, params).rowcount
+
+    # -- API ----------------------------------------------------------------
+
+    def submit(self, payload, owner=None):
+        """Queue a job for owner, the submitting principal, and return its initial state"""
+        self._check_room()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, status, payload, owner, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, json.dumps(payload), owner, now, now)
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return self.get(job_id)
+
+    def begin(self, payload, owner=None):
+        """Record a job as already running in this process, for the caller to execute() or execute_async()
+
+        Used when the caller waits for the result up to a deadline and hands
+        out the job id only if it is not met; the job skips the queue, and
+        is requeued like any other running job if the process dies. Raises
+        JobQueueFull like submit(), counting the jobs still waiting for a
+        thread in execute_async().
+        """
+        self._check_room()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, status, payload, owner, claimed_by, created_at, started_at, updated_at)"
+            " VALUES (?, 'running', ?, ?, ?, ?, ?, ?)",
+            (job_id, json.dumps(payload), owner, os.getpid(), now, now, now)
+        )
+        return self.get(job_id)
+
+    def execute(self, job_id, payload):
+        """Run a job started with begin() in the calling thread and return its final state"""
+        self._run(job_id, payload)
+        return self.get(job_id)
+
+    def execute_async(self, job_id, payload, context=None):
+        """Run a job started with begin() on the JOB_DIRECT_WORKERS threads; returns a Future of its final state
+
+        context, a contextvars.Context, is the one the job runs in.
+        """
+        with self._direct_lock:
+            if self._direct is None:
+                self._direct = ThreadPoolExecutor(max_workers=self.direct_workers, thread_name_prefix="job-direct")
+            self._direct_pending += 1
+            call = (context.run, self.execute) if context is not None else (self.execute,)
+            future = self._direct.submit(*call, job_id, payload)
+        future.add_done_callback(self._direct_done)
+        return future
+
+    def _direct_done(self, future):
+        with self._direct_lock:
+            self._direct_pending -= 1
+
+    def _check_room(self):
+        queued = self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        with self._direct_lock:
+            waiting = max(0, self._direct_pending - self.direct_workers)
+        if queued + waiting >= self.max_queued:
+            raise JobQueueFull(f"{queued + waiting} jobs already queued")
+
+    def get(self, job_id, owner=None):
+        """A job's state; with owner, only if that principal submitted it"""
+        if owner is None:
+            row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        else:
+            row = self._conn().execute(
+                "SELECT * FROM jobs WHERE id = ? AND owner = ?", (job_id, owner)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def cancel(self, job_id, owner=None):
+        """Cancel a queued job at once, or stop a running one at its next stage or upstream wait
+
+        A running job's budget is cancelled here when it runs in this process,
+        and within JOB_CANCEL_POLL seconds by its own process otherwise.
+        """
+        if owner is not None and self.get(job_id, owner) is None:
+            return None
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'queued'",
+            (now, job_id)
+        )
+        conn.execute(
+            "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'running'",
+            (now, job_id)
+        )
+        with self._budgets_lock:
+            budget = self._budgets.get(job_id)
+        if budget is not None:
+            budget.cancel(CANCEL_REASON)
+        return self.get(job_id)
+
+    def stats(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in PENDING_STATUSES + FINAL_STATUSES}
+        counts.update({row[0]: row[1] for row in rows})
+        counts["workers"] = self.workers
+        return counts
+
+    # -- workers ------------------------------------------------------------
+
+    def _claim(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, payload FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row:
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', claimed_by = ?, started_at = ?, updated_at = ? WHERE id = ?",
+                    (os.getpid(), now, now, row["id"])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return (row["id"], json.loads(row["payload"])) if row else None
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self._claim()
+            except sqlite3.Error as e:
+                print(f"❌ Job queue error: {e}")
+                claimed = None
+            if claimed is None:
+                with self._wakeup:
+                    # Timed wait also picks up jobs queued by other processes
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            self._run(*claimed)
+
+    def _watch_cancels(self):
+        """Cancel the budgets of jobs running here that were cancelled through another process"""
+        while not self._stop.wait(JOB_CANCEL_POLL):
+            with self._budgets_lock:
+                running = dict(self._budgets)
+            if not running:
+                continue
+            try:
+                rows = self._conn().execute(
+                    f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({','.join('?' * len(running))})",
+                    tuple(running)
+                ).fetchall()
+            except sqlite3.Error as e:
+                print(f"❌ Job queue error: {e}")
+                continue
+            for row in rows:
+                running[row["id"]].cancel(CANCEL_REASON)
+
+    def _run(self, job_id, payload):
+        conn = self._conn()
+
+        def report(progress, stage, partial=None):
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[0]:
+                raise JobCancelled(job_id)
+            conn.execute(
+                "UPDATE jobs SET progress = ?, stage = ?, partial = COALESCE(?, partial), updated_at = ? WHERE id = ?",
+                (progress, stage, json.dumps(partial) if partial else None, time.time(), job_id)
+            )
+
+        # No deadline: a job is only stopped by cancelling it
+        with request_budget(0) as budget:
+            with self._budgets_lock:
+                self._budgets[job_id] = budget
+            try:
+                result = self.handler(payload, report)
+                report(1.0, "completed")
+            except JobCancelled:
+                self._finish(job_id, "cancelled")
+            except RequestAbandoned as e:
+                if budget.reason == CANCEL_REASON:
+                    self._finish(job_id, "cancelled")
+                else:
+                    self._finish(job_id, "failed", error=str(e))
+            except Exception as e:
+                self._finish(job_id, "failed", error=str(e))
+            else:
+                self._finish(job_id, "completed", result=result)
+            finally:
+                with self._budgets_lock:
+                    self._budgets.pop(job_id, None)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+        )
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "progress": row["progress"],
+            "stage": row["stage"],
+            "partial": json.loads(row["partial"]) if row["partial"] else None,
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "cancel_requested": bool(row["cancel_requested"]),
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "updated_at": row["updated_at"],
+        }
@@ -0,0 +1,335 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.request_timing import record_stage
+
+# Latency buckets in seconds, tuned for sub-ms routing up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Multi-worker mode: how often each worker publishes its samples, and how long
+# a dead worker's counters are kept in the merged totals
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", "5"))
+METRICS_SNAPSHOT_TTL = int(os.getenv("METRICS_SNAPSHOT_TTL", str(7 * 86400)))
+
+
+class _Sharded:
+    """Per-thread value shards so the recording path never takes a lock
+
+    Each thread writes only to its own dict; the lock is taken once per
+    thread to register the shard and on scrape to list the shards.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _snapshots(self):
+        with self._lock:
+            shards = list(self._shards)
+        # dict.copy() runs entirely in C, so it is atomic under the GIL
+        return [shard.copy() for shard in shards]
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(v) for v in labels)
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1.0):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0.0) + amount
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshots():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0.0) + value
+        return [(self.name, key, value) for key, value in totals.items()]
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        key = self._key(labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket, then +Inf, sum and count
+            counts = shard[key] = [0.0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def collect(self):
+        merged = {}
+        for shard in self._snapshots():
+            for key, counts in shard.items():
+                counts = list(counts)
+                total = merged.get(key)
+                merged[key] = counts if total is None else [a + b for a, b in zip(total, counts)]
+
+        samples = []
+        for key, counts in merged.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key + (_format_bound(bound),), cumulative))
+            samples.append((f"{self.name}_sum", key, counts[-2]))
+            samples.append((f"{self.name}_count", key, counts[-1]))
+        return samples
+
+    def _label_names(self, sample_name):
+        if sample_name.endswith("_bucket"):
+            return self.labelnames + ("le",)
+        return self.labelnames
+
+
+class Gauge:
+    """Point-in-time value; updated rarely, so a plain lock is fine"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[tuple(str(v) for v in labels)] = float(value)
+
+    def inc(self, *labels, amount=1.0):
+        key = tuple(str(v) for v in labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, *labels, amount=1.0):
+        self.inc(*labels, amount=-amount)
+
+    def collect(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._shared = None
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, name, documentation, labelnames, callback):
+        """Add a gauge computed at scrape time; callback returns {label_tuple: value}"""
+        with self._lock:
+            self._collectors.append((name, documentation, tuple(labelnames), callback))
+
+    def enable_multiprocess(self, state, interval=METRICS_PUBLISH_INTERVAL):
+        """Share samples with the other worker processes through state
+
+        Each worker publishes a snapshot of its own samples every interval
+        seconds (and whenever it serves a scrape); render() then sums the
+        snapshots of all workers. Gauges only count workers that published
+        recently, so a dead worker's in-flight requests drop out. Scrape-time
+        collectors describe one process's scheduler, pool or queue view, so
+        they are not summed: each live worker's values get a pid label.
+        """
+        self._shared = state
+        self._publish_interval = interval
+
+        def publish_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.publish()
+                except Exception as e:
+                    print(f"❌ Metrics publish failed: {e}")
+
+        threading.Thread(target=publish_loop, name="metrics-publisher", daemon=True).start()
+
+    def publish(self):
+        samples = {metric.name: metric.collect() for metric in list(self._metrics)}
+        self._shared.set(
+            f"metrics:{os.getpid()}",
+            {"ts": time.time(), "pid": os.getpid(), "samples": samples, "collected": self._collected()},
+            ttl=METRICS_SNAPSHOT_TTL
+        )
+
+    def _collected(self):
+        """{collector name: [(labels, value)]} from this process's collectors"""
+        collected = {}
+        for name, _, _, callback in list(self._collectors):
+            try:
+                values = callback()
+            except Exception as e:
+                print(f"❌ Metrics collector {name} failed: {e}")
+                continue
+            collected[name] = [
+                (tuple(str(v) for v in (key if isinstance(key, tuple) else (key,))), value)
+                for key, value in values.items()
+            ]
+        return collected
+
+    def _merged_collected(self, snapshots, live_after):
+        """{collector name: [(labels + (pid,), value)]} over the workers that published recently"""
+        merged = {}
+        for snapshot in sorted(snapshots, key=lambda snapshot: snapshot.get("pid", 0)):
+            if snapshot["ts"] < live_after:
+                continue
+            pid = str(snapshot.get("pid", ""))
+            for name, values in snapshot.get("collected", {}).items():
+                merged.setdefault(name, []).extend((tuple(key) + (pid,), value) for key, value in values)
+        return merged
+
+    def _merged_samples(self):
+        """({metric name: [(sample name, labels, value)]} summed over workers, collector samples)"""
+        if self._shared is None:
+            return {metric.name: metric.collect() for metric in list(self._metrics)}, self._collected()
+
+        self.publish()
+        live_after = time.time() - 3 * self._publish_interval
+        kinds = {metric.name: metric.kind for metric in self._metrics}
+        totals = {}
+        snapshots = list(self._shared.scan("metrics:").values())
+        for snapshot in snapshots:
+            live = snapshot["ts"] >= live_after
+            for name, samples in snapshot["samples"].items():
+                if kinds.get(name) == "gauge" and not live:
+                    continue
+                merged = totals.setdefault(name, {})
+                for sample_name, key, value in samples:
+                    sample = (sample_name, tuple(key))
+                    merged[sample] = merged.get(sample, 0.0) + value
+        merged_samples = {
+            name: [(sample_name, key, value) for (sample_name, key), value in merged.items()]
+            for name, merged in totals.items()
+        }
+        return merged_samples, self._merged_collected(snapshots, live_after)
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        merged, collected = self._merged_samples()
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, key, value in merged.get(metric.name, []):
+                names = metric._label_names(sample_name) if hasattr(metric, "_label_names") else metric.labelnames
+                lines.append(_format_sample(sample_name, names, key, value))
+
+        for name, documentation, labelnames, _ in list(self._collectors):
+            if name not in collected:
+                continue
+            if self._shared is not None:
+                labelnames = labelnames + ("pid",)
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in collected[name]:
+                lines.append(_format_sample(name, labelnames, key, value))
+        return "\n".join(lines) + "\n"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _format_sample(name, labelnames, key, value):
+    value = float(value)
+    text = str(int(value)) if value.is_integer() else repr(value)
+    if labelnames:
+        labels = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(labelnames, key))
+        return f"{name}{{{labels}}} {text}"
+    return f"{name} {text}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = Registry()
+
+# HTTP layer
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("route", "method")
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests currently being served"
+)
+
+# Diagnosis chain
+STAGE_LATENCY = Histogram(
+    "diagnosis_stage_duration_seconds",
+    "Latency per chain stage (chain, classification, prompt_build, upstream_call)",
+    ("stage",)
+)
+
+DIAGNOSIS_SLO = Counter(
+    "diagnosis_slo_responses_total",
+    "Deadline-bound diagnoses answered in full (complete) or with the category and a job id (partial)",
+    ("status",)
+)
+
+# Upstream Euri API
+UPSTREAM_RESPONSES = Counter(
+    "upstream_responses_total", "Upstream responses by HTTP status (or error kind)", ("status",)
+)
+UPSTREAM_TOKENS = Counter(
+    "upstream_tokens_total", "Tokens reported by the upstream API", ("type",)
+)
+
+
+@contextmanager
+def time_stage(stage):
+    """Record how long a chain stage takes, in metrics and in the request's Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.observe(elapsed, stage)
+        record_stage(stage, elapsed)
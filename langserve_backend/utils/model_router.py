@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.metrics import REGISTRY, Counter, Histogram
+from utils.request_timing import jsonl_logger
+from utils.response_cache import is_cacheable
+
+# Model tiers, cheapest first. latency_budget_ms is the EWMA latency above
+# which the tier counts as unhealthy; hourly_cost_budget caps the estimated
+# spend (price_per_1k_tokens) per rolling hour. An unhealthy or over-budget
+# tier hands its requests to its fallback.
+DEFAULT_TIERS = {
+    "fast": {
+        "model": "gpt-4.1-nano", "temperature": 0.3, "max_tokens": 600,
+        "latency_budget_ms": 6000, "price_per_1k_tokens": 0.0004, "hourly_cost_budget": 2.0,
+        "fallback": None,
+    },
+    "standard": {
+        "model": "gpt-4.1-mini", "temperature": 0.5, "max_tokens": 1000,
+        "latency_budget_ms": 10000, "price_per_1k_tokens": 0.0016, "hourly_cost_budget": 5.0,
+        "fallback": "fast",
+    },
+    "thorough": {
+        "model": "gpt-4.1", "temperature": 0.3, "max_tokens": 1500,
+        "latency_budget_ms": 20000, "price_per_1k_tokens": 0.008, "hourly_cost_budget": 10.0,
+        "fallback": "standard",
+    },
+}
+
+# First matching rule wins. Conditions: min_chars, max_chars, categories, roles.
+DEFAULT_RULES = [
+    {"tier": "thorough", "roles": ["doctor", "admin"], "min_chars": 300},
+    {"tier": "thorough", "categories": ["Neurological"], "min_chars": 150},
+    {"tier": "fast", "max_chars": 80},
+    {"tier": "standard"},
+]
+
+MODEL_TIERS = json.loads(os.getenv("MODEL_TIERS", "null")) or DEFAULT_TIERS
+MODEL_ROUTING_RULES = json.loads(os.getenv("MODEL_ROUTING_RULES", "null")) or DEFAULT_RULES
+# A tier whose recent error rate is above this is routed around
+MODEL_MAX_ERROR_RATE = float(os.getenv("MODEL_MAX_ERROR_RATE", "0.2"))
+# Weight of the newest observation in the latency and error EWMAs
+MODEL_HEALTH_ALPHA = float(os.getenv("MODEL_HEALTH_ALPHA", "0.2"))
+# A tier skipped for latency or errors gets a request again after this many
+# seconds without observations, so it can recover
+MODEL_HEALTH_RETRY = float(os.getenv("MODEL_HEALTH_RETRY", "30"))
+MODEL_DECISION_LOG = os.getenv("MODEL_DECISION_LOG", "1") == "1"
+
+ROUTING_DECISIONS = Counter(
+    "model_routing_decisions_total", "Model tier chosen per request and why", ("tier", "reason")
+)
+TIER_LATENCY = Histogram(
+    "model_tier_duration_seconds", "Upstream completion latency by model tier", ("tier",)
+)
+
+_caller_role: ContextVar = ContextVar("caller_role", default=None)
+
+decision_log = jsonl_logger("model_routing")
+
+
+@contextmanager
+def caller_role(role):
+    """Make role the default for model routing within the enclosed code"""
+    token = _caller_role.set(role)
+    try:
+        yield
+    finally:
+        _caller_role.reset(token)
+
+
+def current_caller_role():
+    return _caller_role.get()
+
+
+def _matches(rule, chars, category, role):
+    if chars < rule.get("min_chars", 0):
+        return False
+    if "max_chars" in rule and chars > rule["max_chars"]:
+        return False
+    if "categories" in rule and category not in rule["categories"]:
+        return False
+    if "roles" in rule and role not in rule["roles"]:
+        return False
+    return True
+
+
+class _TierHealth:
+    def __init__(self):
+        self.latency_ms = None
+        self.error_rate = 0.0
+        self.updated = 0.0
+        self.spend = deque()  # (timestamp, cost) over the last hour
+        self.hourly_cost = 0.0
+
+
+class ModelRouter:
+    """Picks a model tier per request from rules, then steps down while the tier is unhealthy"""
+
+    def __init__(self, tiers=None, rules=None, alpha=MODEL_HEALTH_ALPHA, max_error_rate=MODEL_MAX_ERROR_RATE):
+        self.tiers = tiers or MODEL_TIERS
+        self.rules = rules or MODEL_ROUTING_RULES
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self._health = {name: _TierHealth() for name in self.tiers}
+        self._lock = threading.Lock()
+
+    def route(self, text, category=None, role=None):
+        """Decide the tier for one request; returns the decision as a dict"""
+        role = role or current_caller_role() or "user"
+        chars = len(text or "")
+        rule_index, tier = self._rule(chars, category, role)
+        reason = f"rule_{rule_index}" if rule_index is not None else "default"
+
+        seen = set()
+        with self._lock:
+            while tier not in seen:
+                seen.add(tier)
+                problem = self._problem(tier)
+                fallback = self.tiers[tier].get("fallback")
+                if problem is None or fallback is None:
+                    break
+                reason = f"{problem}_fallback"
+                tier = fallback
+
+        settings = self.tiers[tier]
+        ROUTING_DECISIONS.inc(tier, reason)
+        return {
+            "tier": tier,
+            "reason": reason,
+            "model": settings["model"],
+            "temperature": settings["temperature"],
+            "max_tokens": settings["max_tokens"],
+            "input_chars": chars,
+            "category": category,
+            "role": role,
+        }
+
+    def cacheable(self, text, category=None, role=None):
+        """True when the rules route this request to a tier whose answers the response cache keeps"""
+        _, tier = self._rule(len(text or ""), category, role or "user")
+        return is_cacheable(self.tiers[tier])
+
+    def any_cacheable(self):
+        return any(is_cacheable(settings) for settings in self.tiers.values())
+
+    def _rule(self, chars, category, role):
+        # (index of the first matching rule, its tier), else the first tier
+        return next(
+            ((i, rule["tier"]) for i, rule in enumerate(self.rules) if _matches(rule, chars, category, role)),
+            (None, next(iter(self.tiers)))
+        )
+
+    def _problem(self, tier):
+        health = self._health[tier]
+        settings = self.tiers[tier]
+        self._expire_spend(health)
+        stale = time.time() - health.updated > MODEL_HEALTH_RETRY
+        if health.error_rate > self.max_error_rate and not stale:
+            return "errors"
+        over_latency = health.latency_ms is not None and health.latency_ms > settings.get("latency_budget_ms", float("inf"))
+        if over_latency and not stale:
+            return "latency"
+        if health.hourly_cost > settings.get("hourly_cost_budget", float("inf")):
+            return "cost"
+        return None
+
+    @staticmethod
+    def _expire_spend(health):
+        cutoff = time.time() - 3600
+        while health.spend and health.spend[0][0] < cutoff:
+            health.hourly_cost -= health.spend.popleft()[1]
+
+    def record(self, decision, seconds, ok, tokens=0, cached=False):
+        """Feed back the outcome of a routed call and write it to the decision log"""
+        tier = decision["tier"]
+        cost = tokens / 1000 * self.tiers[tier].get("price_per_1k_tokens", 0.0)
+        if not cached:
+            TIER_LATENCY.observe(seconds, tier)
+            with self._lock:
+                health = self._health[tier]
+                latency_ms = seconds * 1000
+                health.latency_ms = latency_ms if health.latency_ms is None else (
+                    self.alpha * latency_ms + (1 - self.alpha) * health.latency_ms
+                )
+                health.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * health.error_rate
+                health.updated = time.time()
+                if cost:
+                    health.spend.append((time.time(), cost))
+                    health.hourly_cost += cost
+
+        if MODEL_DECISION_LOG:
+            decision_log.info(json.dumps(dict(
+                decision, ts=time.time(), latency_ms=round(seconds * 1000, 1),
+                ok=ok, tokens=tokens, cost=round(cost, 6), cached=cached
+            )))
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for name, health in self._health.items():
+                self._expire_spend(health)
+                stats[(name, "latency_ms")] = health.latency_ms or 0.0
+                stats[(name, "error_rate")] = health.error_rate
+                stats[(name, "hourly_cost")] = health.hourly_cost
+            return stats
+
+
+router = ModelRouter()
+REGISTRY.register_collector(
+    "model_tier_health", "Latency EWMA, error rate and hourly cost estimate per model tier", ("tier", "stat"),
+    router.stats
+)
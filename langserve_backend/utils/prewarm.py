@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from utils.metrics import REGISTRY, Counter
+from utils.model_router import caller_role, current_caller_role, router
+from utils.response_cache import RESPONSE_CACHE_TTL, refreshing
+from utils.shared_state import get_shared_state
+from utils.upstream_scheduler import scheduler, upstream_priority
+
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "0") == "1"
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "20"))  # most frequent inputs kept warm
+PREWARM_SKETCH_SIZE = int(os.getenv("PREWARM_SKETCH_SIZE", "500"))  # distinct inputs tracked
+PREWARM_MIN_COUNT = int(os.getenv("PREWARM_MIN_COUNT", "3"))  # seen less often: not worth an upstream call
+PREWARM_RATE = float(os.getenv("PREWARM_RATE", "6"))  # refreshes per minute, per worker
+PREWARM_LEAD = float(os.getenv("PREWARM_LEAD", "300"))  # seconds before expiry to refresh
+PREWARM_PRIORITY = os.getenv("PREWARM_PRIORITY", "batch")  # upstream scheduler class
+PREWARM_DECAY_INTERVAL = float(os.getenv("PREWARM_DECAY_INTERVAL", "3600"))  # counts halve this often
+
+# The UI's Quick Examples; PREWARM_SEEDS (a JSON list) replaces them
+DEFAULT_SEEDS = [
+    "I have a high fever of 102°F and severe headache that started this morning",
+    "I have a persistent dry cough and difficulty breathing for the past 3 days",
+    "I have severe stomach pain, nausea, and have been vomiting since yesterday",
+    "I have a severe headache on the right side and feel dizzy when standing up",
+]
+PREWARM_SEEDS = json.loads(os.getenv("PREWARM_SEEDS", "null")) or DEFAULT_SEEDS
+
+PREWARM_REFRESHES = Counter(
+    "cache_prewarm_refreshes_total", "Pre-warmer cache refreshes by result", ("result",)
+)
+
+_warming: ContextVar = ContextVar("prewarming", default=False)
+
+
+def is_prewarming():
+    """True inside a pre-warmer refresh, which is not live traffic"""
+    return _warming.get()
+
+
+class SpaceSaving:
+    """Approximate counts of the most frequent items in fixed memory
+
+    The Space-Saving algorithm: at most capacity items are counted; a new
+    item replaces the least counted one and inherits its count, which is
+    recorded as the new item's possible overestimate.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._counts = {}  # item -> [count, error]
+
+    def __len__(self):
+        return len(self._counts)
+
+    def add(self, item, weight=1):
+        entry = self._counts.get(item)
+        if entry is not None:
+            entry[0] += weight
+        elif len(self._counts) < self.capacity:
+            self._counts[item] = [weight, 0]
+        else:
+            victim = min(self._counts, key=lambda key: self._counts[key][0])
+            floor = self._counts.pop(victim)[0]
+            self._counts[item] = [floor + weight, floor]
+
+    def top(self, n):
+        """The n most frequent items as (item, count, error), most frequent first"""
+        ranked = sorted(self._counts.items(), key=lambda pair: pair[1][0], reverse=True)[:n]
+        return [(item, count, error) for item, (count, error) in ranked]
+
+    def decay(self, factor=0.5):
+        """Scale all counts down so inputs that stop recurring fall out of the top"""
+        for entry in self._counts.values():
+            entry[0] *= factor
+            entry[1] *= factor
+
+
+class CachePrewarmer:
+    """Keeps the response cache warm for the most frequent diagnosis inputs
+
+    Inputs are counted per (text, role), since the role can change the model
+    tier and so the cached request. Only inputs routed to a tier the response
+    cache keeps (temperature 0) are counted; with no such tier the pre-warmer
+    stays off, as its refreshes would cost upstream calls and store nothing. A background thread refreshes each top
+    input once per cache TTL, PREWARM_LEAD seconds before its entry expires,
+    at most PREWARM_RATE times a minute. It runs in the PREWARM_PRIORITY
+    upstream class and skips a turn while live calls are waiting for a slot.
+    Refreshes are claimed in the shared state, so workers do not repeat
+    each other's.
+    """
+
+    def __init__(self, enabled=PREWARM_ENABLED, top_n=PREWARM_TOP_N, sketch_size=PREWARM_SKETCH_SIZE,
+                 min_count=PREWARM_MIN_COUNT, rate=PREWARM_RATE, ttl=RESPONSE_CACHE_TTL, lead=PREWARM_LEAD,
+                 model_router=None):
+        self.router = model_router or router
+        self.enabled = enabled and ttl > 0 and rate > 0
+        if self.enabled and not self.router.any_cacheable():
+            print("❌ Cache pre-warmer off: no model tier has temperature 0, so no answer would be cached")
+            self.enabled = False
+        self.top_n = top_n
+        self.min_count = min_count
+        self.interval = 60.0 / rate if rate > 0 else None
+        self.refresh_after = max(ttl - lead, ttl / 2)
+        self._sketch = SpaceSaving(sketch_size)
+        self._warmed_at = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._warm = None
+        for text in PREWARM_SEEDS:
+            # Seeds are counted before they are classified, so rules on categories do not apply
+            if self.router.cacheable(text, role="user"):
+                self._sketch.add((text, "user"), weight=min_count)
+
+    def observe(self, text, role=None, category=None):
+        """Count one live diagnosis input, classified as category"""
+        if not self.enabled or _warming.get() or not text or not text.strip():
+            return
+        role = role or current_caller_role() or "user"
+        if not self.router.cacheable(text, category, role):
+            return
+        with self._lock:
+            self._sketch.add((text, role))
+
+    def start(self, warm):
+        """Refresh in the background by calling warm(text, role=role)"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._warm = warm
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-prewarmer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        decayed_at = time.monotonic()
+        while not self._stop.wait(self.interval):
+            if time.monotonic() - decayed_at > PREWARM_DECAY_INTERVAL:
+                with self._lock:
+                    self._sketch.decay()
+                decayed_at = time.monotonic()
+            try:
+                self.warm_next()
+            except Exception as e:
+                print(f"❌ Cache pre-warm failed: {e}")
+
+    def due(self):
+        """Top inputs whose cache entries are near expiry or were never warmed, most frequent first"""
+        now = time.time()
+        with self._lock:
+            top = [item for item, count, _ in self._sketch.top(self.top_n) if count >= self.min_count]
+            # Forget inputs that dropped out of the top
+            self._warmed_at = {item: at for item, at in self._warmed_at.items() if item in top}
+            return [item for item in top if now - self._warmed_at.get(item, 0) > self.refresh_after]
+
+    def warm_next(self):
+        """Refresh the most frequent due input, if live traffic leaves room; returns it or None"""
+        due = self.due()
+        if not due:
+            return None
+        if self._busy():
+            PREWARM_REFRESHES.inc("skipped_busy")
+            return None
+
+        item = due[0]
+        text, role = item
+        with self._lock:
+            self._warmed_at[item] = time.time()
+        claim = "prewarm:" + hashlib.sha256(json.dumps(item).encode()).hexdigest()[:32]
+        if get_shared_state().incr(claim, ttl=self.refresh_after) > 1:
+            PREWARM_REFRESHES.inc("claimed_elsewhere")
+            return None
+
+        token = _warming.set(True)
+        try:
+            with upstream_priority(PREWARM_PRIORITY), caller_role(role), refreshing():
+                self._warm(text, role=role)
+            PREWARM_REFRESHES.inc("ok")
+        except Exception:
+            PREWARM_REFRESHES.inc("error")
+            raise
+        finally:
+            _warming.reset(token)
+        return item
+
+    @staticmethod
+    def _busy():
+        # Live calls queued for a slot, or every slot taken
+        stats = scheduler.stats()
+        waiting = sum(count for (state, cls), count in stats.items() if state == "queued" and cls != PREWARM_PRIORITY)
+        return waiting > 0 or stats[("in_use", "all")] >= stats[("slots", "all")]
+
+    def stats(self):
+        with self._lock:
+            return {"tracked": len(self._sketch), "warm": len(self._warmed_at)}
+
+
+prewarmer = CachePrewarmer()
+REGISTRY.register_collector(
+    "cache_prewarm_inputs", "Inputs tracked by the cache pre-warmer and those kept warm", ("state",),
+    prewarmer.stats
+)
@@ -0,0 +1,75 @@
+import os
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "profiles")
+)
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "2")) / 1000
+PROFILE_MAX_SAMPLES = 50000
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SamplingProfiler:
+    """Samples every thread's stack on a fixed interval while active
+
+    The result is written in the folded-stack format ("frame;frame;frame count")
+    that flamegraph.pl and speedscope render as a flame graph. All threads are
+    sampled because a request hops between the event loop and executor threads;
+    stacks from concurrent requests will show up too.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        # Known from the start, so a streamed response can name it in its headers
+        self.profile_id = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {}
+        taken = 0
+        while not self._stop.wait(self.interval) and taken < PROFILE_MAX_SAMPLES:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+            taken += 1
+
+    def save(self):
+        """Write the folded stacks and return the profile id"""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(profile_path(self.profile_id), "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return self.profile_id
+
+
+def profile_path(profile_id):
+    """Path of a stored profile, or None for a malformed id"""
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    return os.path.join(PROFILE_DIR, f"{profile_id}.folded")
@@ -0,0 +1,149 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.metrics import Counter
+
+# Token-bucket limits as "name=count/period", period one of sec, min, hour, day.
+# Roles come from the UI's auth roles; api_key applies to integrations calling
+# with a key, anonymous to everything else (keyed by client IP).
+RATE_LIMITS = os.getenv(
+    "RATE_LIMITS", "admin=120/min,doctor=60/min,user=20/min,api_key=300/min,anonymous=10/min"
+)
+# Per-key overrides as "key_id=count/period"; key_id is from api_key_id()
+RATE_LIMIT_KEYS = os.getenv("RATE_LIMIT_KEYS", "")
+# memory: per process; shared: utils.shared_state, for several workers or replicas
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "")
+# Idle buckets kept in memory before full ones are swept
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+_PERIODS = {"sec": 1, "s": 1, "min": 60, "m": 60, "hour": 3600, "h": 3600, "day": 86400, "d": 86400}
+
+RATE_LIMIT_DECISIONS = Counter(
+    "rate_limit_decisions_total", "Rate limit checks by limit and result", ("limit", "result")
+)
+
+
+class Limit:
+    """count requests per period, refilled continuously; bursts up to count"""
+
+    def __init__(self, name, count, period):
+        self.name = name
+        self.capacity = float(count)
+        self.rate = count / period  # tokens per second
+
+    def __repr__(self):
+        return f"Limit({self.name!r}, {self.capacity:g} per {self.capacity / self.rate:g}s)"
+
+
+def parse_limits(spec):
+    """Parse "name=count/period,..." into {name: Limit}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        count, _, period = value.partition("/")
+        if period not in _PERIODS:
+            raise ValueError(f"Bad rate limit {item!r}: period must be one of {sorted(_PERIODS)}")
+        limits[name.strip()] = Limit(name.strip(), int(count), _PERIODS[period])
+    return limits
+
+
+def _refill(bucket, limit, now):
+    tokens, updated = bucket if bucket else (limit.capacity, now)
+    return min(limit.capacity, tokens + (now - updated) * limit.rate)
+
+
+def _decide(tokens, limit, cost):
+    """(allowed, tokens left, seconds until cost tokens are available)"""
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / limit.rate
+
+
+class MemoryBuckets:
+    """Token buckets in this process: O(1) state, (tokens, last refill) per principal
+
+    Kept in least recently used order; past max_buckets the least recently
+    used bucket is dropped, which is the one most likely to have refilled
+    completely and so be the same as no bucket.
+    """
+
+    def __init__(self, max_buckets=RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            tokens = _refill(bucket[:2] if bucket else None, limit, now)
+            allowed, tokens, retry_after = _decide(tokens, limit, cost)
+            self._buckets[key] = (tokens, now, limit)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+
+class SharedBuckets:
+    """The same buckets kept in utils.shared_state, so every worker draws from them"""
+
+    def __init__(self, state):
+        self.state = state
+
+    def take(self, key, limit, cost=1):
+        decision = {}
+
+        def spend(bucket):
+            now = time.time()
+            tokens = _refill(bucket, limit, now)
+            decision["allowed"], tokens, decision["retry_after"] = _decide(tokens, limit, cost)
+            return [tokens, now]
+
+        # Expire once the bucket would be full again anyway
+        ttl = math.ceil(limit.capacity / limit.rate) + 1
+        self.state.update(f"ratelimit:{key}", spend, ttl=ttl)
+        return decision["allowed"], decision["retry_after"]
+
+
+class RateLimiter:
+    def __init__(self, buckets, limits=None, key_limits=None):
+        self.buckets = buckets
+        self.limits = limits if limits is not None else parse_limits(RATE_LIMITS)
+        self.key_limits = key_limits if key_limits is not None else parse_limits(RATE_LIMIT_KEYS)
+
+    def limit_for(self, kind, name):
+        """The limit for a principal: key overrides, then its role, then anonymous"""
+        if kind == "key" and name in self.key_limits:
+            return self.key_limits[name]
+        if kind == "key":
+            return self.limits.get("api_key")
+        if kind == "user":
+            return self.limits.get(name) or self.limits.get("user")
+        return self.limits.get("anonymous")
+
+    def check(self, principal, limit, cost=1):
+        """Spend cost tokens; returns (allowed, retry_after_seconds)"""
+        if limit is None:
+            return True, 0.0
+        try:
+            allowed, retry_after = self.buckets.take(f"{limit.name}:{principal}", limit, cost)
+        except Exception as e:
+            # Fail open: a broken limiter store must not take the API down
+            print(f"❌ Rate limiter error: {e}")
+            return True, 0.0
+        RATE_LIMIT_DECISIONS.inc(limit.name, "allowed" if allowed else "rejected")
+        return allowed, retry_after
+
+
+def create_rate_limiter(shared_state=None):
+    """Memory buckets for one process, shared ones when a shared store is given"""
+    backend = RATE_LIMIT_BACKEND or ("shared" if shared_state is not None else "memory")
+    if backend == "shared":
+        if shared_state is None:
+            from utils.shared_state import get_shared_state
+            shared_state = get_shared_state()
+        return RateLimiter(SharedBuckets(shared_state))
+    return RateLimiter(MemoryBuckets())
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from starlette.requests import Request
+
+from utils.profiler import SamplingProfiler
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "5000"))
+LOG_DIR = os.getenv(
+    "LOG_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logs")
+)
+
+# Stage durations (seconds) for the request being served. The dict is created
+# by the middleware and mutated in place, so stages timed in executor threads
+# (which run in a copy of the context) still land in the same dict.
+_timings: ContextVar = ContextVar("request_timings", default=None)
+
+
+def start_request_timing():
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+
+def record_stage(stage, seconds):
+    """Add a stage duration to the current request, if one is being timed"""
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def server_timing_header(timings, total):
+    """Format stage durations as a Server-Timing header value (milliseconds)"""
+    entries = [f"total;dur={total * 1000:.1f}"]
+    if "chain" in timings:
+        entries.append(f"framework;dur={(total - timings['chain']) * 1000:.1f};desc=\"API and LangServe overhead\"")
+    for stage, seconds in timings.items():
+        entries.append(f"{stage};dur={seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def jsonl_logger(name):
+    """Logger writing bare message lines to LOG_DIR/<name>.log (stderr if unwritable)"""
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        try:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            handler = logging.FileHandler(os.path.join(LOG_DIR, f"{name}.log"))
+        except OSError:
+            handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+slow_request_log = jsonl_logger("slow_requests")
+
+
+def log_if_slow(method, path, status, total, timings, profile_id=None):
+    """Write one JSON line for requests slower than SLOW_REQUEST_MS"""
+    duration_ms = total * 1000
+    if duration_ms < SLOW_REQUEST_MS:
+        return
+    slow_request_log.info(json.dumps({
+        "ts": time.time(),
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration_ms": round(duration_ms, 1),
+        "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+        "profile_id": profile_id,
+    }))
+
+
+class ServerTimingMiddleware:
+    """Time requests under path_prefixes, log slow ones and profile when may_profile(request) allows
+
+    Plain ASGI, so streamed bodies pass through as they are produced and the
+    request is timed and profiled until its last body chunk. A response with
+    a Content-Length is already complete, so its chunks are held to add the
+    Server-Timing header. A streamed one sends its headers before the work is
+    done, so its timings go to the slow request log only; HTTP trailers would
+    fit, but GZipMiddleware drops trailer messages.
+    """
+
+    def __init__(self, app, path_prefixes, may_profile):
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes)
+        self.may_profile = may_profile
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            return await self.app(scope, receive, send)
+
+        timings = start_request_timing()
+        profiler = None
+        if (b"x-profile", b"1") in scope["headers"] and self.may_profile(Request(scope)):
+            profiler = SamplingProfiler().start()
+        started = time.perf_counter()
+        held = []  # start and body chunks of a fixed-length response
+        status = 500
+        finished = False
+
+        def finish():
+            nonlocal finished
+            finished = True
+            total = time.perf_counter() - started
+            profile_id = None
+            if profiler:
+                profiler.stop()
+                profile_id = profiler.save()
+            log_if_slow(scope["method"], scope["path"], status, total, timings, profile_id)
+            return server_timing_header(timings, total)
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                if profiler:
+                    # For a streamed body the profile is saved once it is complete
+                    headers.append((b"x-profile-id", profiler.profile_id.encode("latin-1")))
+                message = dict(message, headers=headers)
+                if any(name.lower() == b"content-length" for name, _ in headers):
+                    held.append(message)
+                    return
+                return await send(message)
+            last = message["type"] == "http.response.body" and not message.get("more_body", False)
+            if not held:
+                if last:
+                    finish()
+                return await send(message)
+            held.append(message)
+            if last:
+                start, *chunks = held
+                held.clear()
+                start["headers"].append((b"server-timing", finish().encode("latin-1")))
+                await send(start)
+                for chunk in chunks:
+                    await send(chunk)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            if not finished:
+                finish()
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.metrics import Counter
+from utils.rollups import rollups
+from utils.shared_state import get_shared_state
+
+# Opt-in: seconds an answer is reused, 0 (the default) disables the cache.
+# Only deterministic requests are cached; see is_cacheable().
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "0"))
+
+CACHE_REQUESTS = Counter(
+    "response_cache_requests_total", "Response cache lookups by cache and result", ("cache", "result")
+)
+
+_refreshing: ContextVar = ContextVar("cache_refreshing", default=False)
+
+
+def is_cacheable(payload):
+    """Only temperature 0 asks for the same answer each time; anything else is sampled anew"""
+    return not payload.get("temperature")
+
+
+@contextmanager
+def refreshing():
+    """Within the enclosed code, lookups miss so responses are fetched and cached anew"""
+    token = _refreshing.set(True)
+    try:
+        yield
+    finally:
+        _refreshing.reset(token)
+
+
+class ResponseCache:
+    """Upstream responses keyed by a hash of the request, shared by all workers"""
+
+    def __init__(self, name, ttl=RESPONSE_CACHE_TTL, state=None):
+        self.name = name
+        self.ttl = ttl
+        self._state = state
+
+    @property
+    def state(self):
+        # Resolved lazily so the store is opened in the process that uses it
+        if self._state is None:
+            self._state = get_shared_state()
+        return self._state
+
+    def key(self, *parts):
+        digest = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+        return f"cache:{self.name}:{digest}"
+
+    def get(self, key):
+        if not self.ttl:
+            return None
+        if _refreshing.get():
+            CACHE_REQUESTS.inc(self.name, "refresh")
+            return None
+        try:
+            value = self.state.get(key)
+        except Exception as e:
+            print(f"❌ Response cache read failed: {e}")
+            value = None
+        CACHE_REQUESTS.inc(self.name, "hit" if value is not None else "miss")
+        rollups.count("cache_hits" if value is not None else "cache_misses")
+        return value
+
+    def set(self, key, value):
+        if not self.ttl:
+            return
+        try:
+            self.state.set(key, value, ttl=self.ttl)
+        except Exception as e:
+            print(f"❌ Response cache write failed: {e}")
@@ -0,0 +1,195 @@
+import bisect
+import os
+import threading
+import time
+
+from utils.shared_state import get_shared_state
+
+# (name, bucket width in seconds, buckets kept). Each resolution is a fixed
+# ring of slots in the shared state: a slot is reused once its bucket falls
+# out of the window, so minutes cover the last hours, hours the last days
+# and days the last months, and older data survives only at the coarser
+# resolution.
+RESOLUTIONS = (
+    ("minute", 60, int(os.getenv("ROLLUP_MINUTES", "180"))),
+    ("hour", 3600, int(os.getenv("ROLLUP_HOURS", "72"))),
+    ("day", 86400, int(os.getenv("ROLLUP_DAYS", "90"))),
+)
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "10"))  # seconds
+ROLLUP_MAX_CATEGORIES = int(os.getenv("ROLLUP_MAX_CATEGORIES", "20"))  # per bucket, the rest count as "other"
+
+# Diagnosis latency histogram bounds in seconds, for percentiles per bucket
+LATENCY_BOUNDS = (0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+COUNTERS = ("requests", "errors", "cache_hits", "cache_misses")
+
+
+def _empty_bucket(start):
+    return {
+        "start": start,
+        **{name: 0 for name in COUNTERS},
+        "latency_sum": 0.0,
+        "latency_max": 0.0,
+        "latency_counts": [0] * (len(LATENCY_BOUNDS) + 1),
+        "categories": {},
+    }
+
+
+def _merge(bucket, delta):
+    for name in COUNTERS:
+        bucket[name] += delta[name]
+    bucket["latency_sum"] += delta["latency_sum"]
+    bucket["latency_max"] = max(bucket["latency_max"], delta["latency_max"])
+    bucket["latency_counts"] = [a + b for a, b in zip(bucket["latency_counts"], delta["latency_counts"])]
+    categories = bucket["categories"]
+    for category, count in delta["categories"].items():
+        if category not in categories and len(categories) >= ROLLUP_MAX_CATEGORIES:
+            category = "other"
+        categories[category] = categories.get(category, 0) + count
+    return bucket
+
+
+def _percentile(counts, q):
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bound, count in zip(LATENCY_BOUNDS + (float("inf"),), counts):
+        seen += count
+        if seen >= rank:
+            return bound if bound != float("inf") else LATENCY_BOUNDS[-1]
+    return LATENCY_BOUNDS[-1]
+
+
+class RollupStore:
+    """Diagnosis traffic aggregated into per-minute, per-hour and per-day buckets
+
+    Each process adds up its traffic in memory and merges it into the
+    shared buckets every ROLLUP_FLUSH_INTERVAL seconds, so recording costs
+    no I/O and a read is one prefix scan of at most the ring size, whatever
+    the traffic.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS, flush_interval=ROLLUP_FLUSH_INTERVAL, state=None):
+        self.resolutions = {name: (width, size) for name, width, size in resolutions}
+        self.flush_interval = flush_interval
+        self._state = state
+        self._pending = {}  # minute start -> bucket not yet flushed
+        self._retry = []  # (minute start, bucket, resolutions) a failed flush did not merge
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def state(self):
+        if self._state is None:
+            self._state = get_shared_state()
+        return self._state
+
+    def _bucket(self):
+        start = int(time.time()) // 60 * 60
+        bucket = self._pending.get(start)
+        if bucket is None:
+            bucket = self._pending[start] = _empty_bucket(start)
+        return bucket
+
+    def record_diagnosis(self, seconds, category):
+        """Count one finished diagnosis with its latency and symptom category"""
+        category = "error" if str(category).startswith("Error") else str(category).strip()
+        with self._lock:
+            bucket = self._bucket()
+            bucket["requests"] += 1
+            bucket["latency_sum"] += seconds
+            bucket["latency_max"] = max(bucket["latency_max"], seconds)
+            bucket["latency_counts"][bisect.bisect_left(LATENCY_BOUNDS, seconds)] += 1
+            bucket["categories"][category] = bucket["categories"].get(category, 0) + 1
+
+    def count(self, name, amount=1):
+        """Add to one of the plain counters: errors, cache_hits or cache_misses"""
+        with self._lock:
+            self._bucket()[name] += amount
+
+    def flush(self):
+        """Merge the buckets recorded in this process into the shared rings
+
+        If the shared state fails, what was not merged yet is kept for the
+        next flush, down to the resolutions still missing, so nothing is lost
+        or counted twice.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            work, self._retry = self._retry, []
+        work += [(minute_start, delta, tuple(self.resolutions)) for minute_start, delta in sorted(pending.items())]
+        for i, (minute_start, delta, names) in enumerate(work):
+            for j, name in enumerate(names):
+                width, size = self.resolutions[name]
+                start = minute_start // width * width
+
+                def merge(current, start=start, delta=delta):
+                    # A slot still holding an older bucket is reused for this one
+                    if current is None or current["start"] != start:
+                        current = _empty_bucket(start)
+                    return _merge(current, delta)
+
+                try:
+                    self.state.update(self._slot_key(name, start), merge, ttl=width * size)
+                except Exception:
+                    with self._lock:
+                        self._retry = [(minute_start, delta, names[j:])] + work[i + 1:] + self._retry
+                    raise
+
+    def _slot_key(self, name, start):
+        width, size = self.resolutions[name]
+        return f"rollup:{name}:{start // width % size}"
+
+    def series(self, resolution="minute", limit=None):
+        """Buckets of one resolution, oldest first, with averages and percentiles filled in"""
+        if resolution not in self.resolutions:
+            raise ValueError(f"Unknown resolution {resolution!r}")
+        self.flush()
+        width, size = self.resolutions[resolution]
+        oldest = time.time() - width * size
+        buckets = sorted(
+            (bucket for bucket in self.state.scan(f"rollup:{resolution}:").values() if bucket["start"] > oldest),
+            key=lambda bucket: bucket["start"]
+        )
+        if limit:
+            buckets = buckets[-limit:]
+        for bucket in buckets:
+            requests = bucket["requests"]
+            lookups = bucket["cache_hits"] + bucket["cache_misses"]
+            bucket["latency_avg"] = bucket["latency_sum"] / requests if requests else None
+            bucket["latency_p50"] = _percentile(bucket["latency_counts"], 0.5)
+            bucket["latency_p95"] = _percentile(bucket["latency_counts"], 0.95)
+            bucket["cache_hit_ratio"] = bucket["cache_hits"] / lookups if lookups else None
+            bucket["error_rate"] = bucket["errors"] / requests if requests else None
+        return buckets
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def flush_loop():
+            while not self._stop.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"❌ Rollup flush failed: {e}")
+
+        self._thread = threading.Thread(target=flush_loop, name="rollup-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"❌ Rollup flush failed: {e}")
+
+
+rollups = RollupStore()
@@ -0,0 +1,81 @@
+import os
+from contextvars import ContextVar
+
+import orjson
+from starlette.responses import Response
+
+try:
+    import msgpack
+except ImportError:  # optional; without it every client gets JSON
+    msgpack = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Responses at least this large are gzip-compressed for clients that accept it
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+
+_accept: ContextVar = ContextVar("accept", default="")
+
+
+def wants_msgpack(accept):
+    return msgpack is not None and any(media_type in accept for media_type in MSGPACK_TYPES)
+
+
+def _default(value):
+    # pydantic models and anything else orjson does not know natively
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def encode(content, accept=""):
+    """Encode content for the Accept header given; returns (body, media type)"""
+    if wants_msgpack(accept):
+        return msgpack.packb(content, default=_default, use_bin_type=True), MSGPACK_TYPES[0]
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS), JSON_TYPE
+
+
+class NegotiatedResponse(Response):
+    """orjson by default, MessagePack when the request's Accept header asks for it"""
+
+    media_type = JSON_TYPE
+
+    def render(self, content):
+        # render() runs before the headers are built, so the media type can still change
+        body, self.media_type = encode(content, _accept.get())
+        return body
+
+
+class ContentNegotiationMiddleware:
+    """Make the request's Accept header visible to NegotiatedResponse
+
+    Plain ASGI rather than @app.middleware so it adds no extra task per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accept = ""
+        for name, value in scope["headers"]:
+            if name == b"accept":
+                accept = value.decode("latin-1")
+                break
+        token = _accept.set(accept)
+
+        async def send_with_vary(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"vary", b"Accept")]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_vary)
+        finally:
+            _accept.reset(token)
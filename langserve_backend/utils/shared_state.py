@@ -0,0 +1,190 @@
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Key/value state shared by every worker process on the host. By default it is
+# a SQLite file on tmpfs (/dev/shm), so it lives in shared memory and needs no
+# extra service; set REDIS_URL to share it through Redis instead.
+SHARED_STATE_PATH = os.getenv(
+    "SHARED_STATE_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "medical-backend-state.db")
+)
+REDIS_URL = os.getenv("REDIS_URL", "")
+KEY_PREFIX = "medical:"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires_at);
+"""
+
+
+class SQLiteState:
+    """Shared key/value store in a SQLite file, safe across threads and processes
+
+    Values are stored as JSON. Connections are per thread and per process, so
+    a store created before gunicorn forks is still safe to use in the workers.
+    """
+
+    # Share of writes that also sweep expired keys
+    PURGE_PROBABILITY = 0.01
+
+    def __init__(self, path=SHARED_STATE_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # Losing the last writes on power failure is fine for caches and counters
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None)
+        )
+        self._maybe_purge()
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        """Add to a numeric value and return the new total; ttl applies when the key is created"""
+        now = time.time()
+        row = self._conn().execute(
+            """
+            INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                value = CASE WHEN expires_at IS NOT NULL AND expires_at <= ? THEN excluded.value
+                             ELSE CAST(value AS REAL) + ? END,
+                expires_at = CASE WHEN expires_at IS NOT NULL AND expires_at <= ? THEN excluded.expires_at
+                                  ELSE expires_at END
+            RETURNING value
+            """,
+            (key, json.dumps(amount), now + ttl if ttl else None, now, amount, now)
+        ).fetchone()
+        self._maybe_purge()
+        return json.loads(row[0])
+
+    def update(self, key, fn, ttl=None):
+        """Atomically replace a value with fn(current value or None) and return it"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+            value = fn(json.loads(row[0]) if row else None)
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl if ttl else None)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def scan(self, prefix):
+        """All live keys starting with prefix, as {key: value}"""
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)",
+            (prefix, prefix + "￿", time.time())
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def _maybe_purge(self):
+        if random.random() < self.PURGE_PROBABILITY:
+            self._conn().execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+
+class RedisState:
+    """The same interface backed by Redis, for hosts that already run one"""
+
+    def __init__(self, url=REDIS_URL):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.client.ping()
+
+    def get(self, key):
+        value = self.client.get(KEY_PREFIX + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(KEY_PREFIX + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(KEY_PREFIX + key)
+
+    def incr(self, key, amount=1, ttl=None):
+        pipe = self.client.pipeline()
+        pipe.incrbyfloat(KEY_PREFIX + key, amount)
+        if ttl:
+            pipe.expire(KEY_PREFIX + key, int(ttl), nx=True)
+        return float(pipe.execute()[0])
+
+    def update(self, key, fn, ttl=None):
+        key = KEY_PREFIX + key
+        result = {}
+
+        def transaction(pipe):
+            current = pipe.get(key)
+            value = fn(json.loads(current) if current is not None else None)
+            pipe.multi()
+            pipe.set(key, json.dumps(value), ex=int(ttl) if ttl else None)
+            result["value"] = value
+
+        self.client.transaction(transaction, key)
+        return result["value"]
+
+    def scan(self, prefix):
+        keys = list(self.client.scan_iter(match=KEY_PREFIX + prefix + "*", count=500))
+        values = self.client.mget(keys) if keys else []
+        return {
+            key.decode()[len(KEY_PREFIX):]: json.loads(value)
+            for key, value in zip(keys, values) if value is not None
+        }
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state():
+    """The process-wide shared store: Redis if REDIS_URL is set and reachable, else SQLite"""
+    global _state
+    with _state_lock:
+        if _state is None:
+            if REDIS_URL:
+                try:
+                    _state = RedisState(REDIS_URL)
+                    print("✅ Shared state: Redis")
+                except Exception as e:
+                    print(f"❌ Redis unavailable ({e}); using {SHARED_STATE_PATH}")
+            if _state is None:
+                _state = SQLiteState(SHARED_STATE_PATH)
+        return _state
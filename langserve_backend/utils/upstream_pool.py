@@ -0,0 +1,326 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from dotenv import load_dotenv
+
+from utils.deadline import check
+from utils.metrics import REGISTRY, Counter
+
+load_dotenv()
+
+DEFAULT_ENDPOINT = "https://api.euron.one/api/v1/euri/alpha/chat/completions"
+# Comma-separated; every endpoint is used with every key. EURI_ALT_URL, the
+# former hedge-only endpoint, joins the pool when set.
+EURI_ENDPOINTS = os.getenv("EURI_ENDPOINTS", DEFAULT_ENDPOINT)
+EURI_ALT_URL = os.getenv("EURI_ALT_URL", "")
+EURI_API_KEYS = os.getenv("EURI_API_KEYS", "") or os.getenv("EURI_API_KEY", "")
+
+UPSTREAM_POOL_EWMA_ALPHA = float(os.getenv("UPSTREAM_POOL_EWMA_ALPHA", "0.2"))  # weight of the newest sample
+UPSTREAM_POOL_EJECT_FAILURES = int(os.getenv("UPSTREAM_POOL_EJECT_FAILURES", "5"))  # in a row
+UPSTREAM_POOL_EJECT_ERROR_RATE = float(os.getenv("UPSTREAM_POOL_EJECT_ERROR_RATE", "0.5"))
+UPSTREAM_POOL_EJECT_SECONDS = float(os.getenv("UPSTREAM_POOL_EJECT_SECONDS", "30"))  # doubles on each repeat
+UPSTREAM_POOL_EJECT_MAX_SECONDS = float(os.getenv("UPSTREAM_POOL_EJECT_MAX_SECONDS", "300"))
+UPSTREAM_POOL_FAILOVER = int(os.getenv("UPSTREAM_POOL_FAILOVER", "1"))  # other members tried after a 429 or connect error
+UPSTREAM_POOL_RATE_LIMIT_COOLDOWN = float(os.getenv("UPSTREAM_POOL_RATE_LIMIT_COOLDOWN", "5"))  # 429 without Retry-After
+
+# Calls a member needs before its error rate can eject it, and the
+# successes in a row after which an earlier ejection is forgiven
+MIN_SAMPLES = 10
+# A member's error rate halves every this many seconds without new calls,
+# so one that is avoided for its errors is tried again eventually
+ERROR_HALF_LIFE = 30
+# Rate-limit headers older than this no longer describe the key
+HEADROOM_TTL = 60
+# Floor for the headroom share in the cost, so a key near its limit is
+# avoided but still picked when it is the only choice
+MIN_HEADROOM = 0.05
+
+UPSTREAM_POOL_EVENTS = Counter(
+    "upstream_pool_events_total",
+    "Upstream pool member events: ejected, readmitted, rate_limited, failover",
+    ("member", "event")
+)
+
+
+def _split(spec):
+    return [item.strip() for item in spec.split(",") if item.strip()]
+
+
+class PoolMember:
+    """One endpoint used with one API key, and its recent health"""
+
+    def __init__(self, url, key, name):
+        self.url = url
+        self.key = key
+        self.name = name
+        self.latency = None  # EWMA of successful call latency, seconds
+        self.error_rate = 0.0  # EWMA of failures (1) and successes (0)
+        self.samples = 0
+        self.error_at = 0.0  # when error_rate was last updated
+        self.failures = 0  # in a row
+        self.successes = 0  # in a row
+        self.in_flight = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.probing = False
+
+    def headers(self):
+        return {
+            "Authorization": f"Bearer {self.key}",
+            "Content-Type": "application/json"
+        }
+
+
+class _KeyLimit:
+    __slots__ = ("remaining", "limit", "seen_at", "blocked_until")
+
+    def __init__(self):
+        self.remaining = None
+        self.limit = None
+        self.seen_at = 0.0
+        self.blocked_until = 0.0
+
+
+class UpstreamPool:
+    """Spreads upstream calls over every endpoint and API key
+
+    Each call goes to the cheaper of two random healthy members (power of
+    two choices), where the cost is the member's EWMA latency, scaled up by
+    its calls in flight and error rate and down by the rate-limit headroom
+    its key reports. Two random picks keep load even without every worker
+    herding onto the single best member.
+
+    A member is ejected after UPSTREAM_POOL_EJECT_FAILURES failures in a row
+    or an error rate above UPSTREAM_POOL_EJECT_ERROR_RATE, for
+    UPSTREAM_POOL_EJECT_SECONDS, doubled on each repeat. It is then
+    re-admitted on probation: one trial call at a time until one succeeds.
+    A key answering 429 is skipped until its Retry-After. If nothing is
+    healthy, the member whose ejection ends first is used anyway.
+    """
+
+    def __init__(self, endpoints=None, keys=None, alpha=UPSTREAM_POOL_EWMA_ALPHA,
+                 eject_failures=UPSTREAM_POOL_EJECT_FAILURES, eject_error_rate=UPSTREAM_POOL_EJECT_ERROR_RATE,
+                 eject_seconds=UPSTREAM_POOL_EJECT_SECONDS, eject_max_seconds=UPSTREAM_POOL_EJECT_MAX_SECONDS,
+                 failover=UPSTREAM_POOL_FAILOVER):
+        if endpoints is None:
+            endpoints = _split(EURI_ENDPOINTS)
+            if EURI_ALT_URL and EURI_ALT_URL not in endpoints:
+                endpoints.append(EURI_ALT_URL)
+        keys = _split(EURI_API_KEYS) if keys is None else keys
+        self.members = [
+            PoolMember(url, key, f"{urlparse(url).netloc or url}/key{index}")
+            for url in endpoints
+            for index, key in enumerate(keys, start=1)
+        ]
+        self.key_count = len(keys)
+        self.alpha = alpha
+        self.eject_failures = eject_failures
+        self.eject_error_rate = eject_error_rate
+        self.eject_seconds = eject_seconds
+        self.eject_max_seconds = eject_max_seconds
+        self.failover = failover
+        self._limits = {key: _KeyLimit() for key in keys}
+        self._lock = threading.Lock()
+
+    def _available(self, member, now):
+        if member.ejected_until > now or self._limits[member.key].blocked_until > now:
+            return False
+        # On probation only one trial call at a time
+        return not (member.ejected_until and member.probing)
+
+    def _headroom(self, key, now):
+        limit = self._limits[key]
+        if limit.limit and limit.remaining is not None and now - limit.seen_at < HEADROOM_TTL:
+            return max(limit.remaining / limit.limit, MIN_HEADROOM)
+        return 1.0
+
+    @staticmethod
+    def _error_rate(member, now):
+        return member.error_rate * 0.5 ** ((now - member.error_at) / ERROR_HALF_LIFE)
+
+    def _cost(self, member, now, default_latency):
+        latency = member.latency if member.latency is not None else default_latency
+        errors = self._error_rate(member, now)
+        return latency * (1 + member.in_flight) * (1 + 4 * errors) / self._headroom(member.key, now)
+
+    def pick(self, exclude=(), strict=False):
+        """A member for the next call, not one of exclude unless there is no other
+
+        With strict, returns None rather than an excluded or unhealthy member.
+        """
+        if not self.members:
+            raise Exception("EURI_API_KEY not found in environment variables.")
+        now = time.time()
+        with self._lock:
+            candidates = [m for m in self.members if m not in exclude and self._available(m, now)]
+            if not candidates:
+                if strict:
+                    return None
+                # Nothing healthy: better the member closest to re-admission than no call at all
+                fallback = [m for m in self.members if m not in exclude] or self.members
+                return min(fallback, key=lambda m: max(m.ejected_until, self._limits[m.key].blocked_until))
+            if len(candidates) == 1:
+                return candidates[0]
+            known = [m.latency for m in self.members if m.latency is not None]
+            # Members without samples look average, so they get traffic without being flooded
+            default_latency = sum(known) / len(known) if known else 1.0
+            first, second = random.sample(candidates, 2)
+            return min((first, second), key=lambda m: self._cost(m, now, default_latency))
+
+    def targets(self):
+        """[primary, alternate] members for a call that may be hedged"""
+        primary = self.pick()
+        return [primary, self.pick(exclude=(primary,))]
+
+    def send(self, member, request):
+        """Return request(member), recording the member's latency and outcome"""
+        with self._lock:
+            member.in_flight += 1
+            if member.ejected_until:
+                member.probing = True
+        started = time.perf_counter()
+        try:
+            response = request(member)
+        except requests.exceptions.RequestException:
+            self._record(member, ok=False)
+            raise
+        finally:
+            with self._lock:
+                member.in_flight -= 1
+
+        self._note_limits(member, response)
+        if response.status_code == 429:
+            self._rate_limited(member, response)
+        else:
+            self._record(member, ok=response.status_code < 500, latency=time.perf_counter() - started)
+        return response
+
+    def request(self, request, member=None):
+        """request(member) on member, or a picked one, failing over after a 429 or connection error
+
+        Up to `failover` other healthy members are tried. A connection
+        error means the request never reached the upstream, so repeating it
+        elsewhere is safe; a 429 was refused before any work was done.
+        """
+        tried = []
+        member = member or self.pick()
+        while True:
+            tried.append(member)
+            try:
+                response = self.send(member, request)
+            except requests.exceptions.ConnectionError:
+                alternate = self._alternate(tried)
+                if alternate is None:
+                    raise
+                member = alternate
+                continue
+            if response.status_code == 429:
+                returned = False
+                try:
+                    alternate = self._alternate(tried)
+                    returned = alternate is None
+                finally:
+                    # Frees the connection unless the 429 is the answer, also
+                    # when the request was abandoned meanwhile
+                    if not returned:
+                        response.close()
+                if alternate is not None:
+                    member = alternate
+                    continue
+            return response
+
+    def _alternate(self, tried):
+        if len(tried) > self.failover:
+            return None
+        alternate = self.pick(exclude=tried, strict=True)
+        if alternate is not None:
+            check("upstream_failover")
+            UPSTREAM_POOL_EVENTS.inc(alternate.name, "failover")
+        return alternate
+
+    def _record(self, member, ok, latency=None):
+        event = None
+        now = time.time()
+        with self._lock:
+            # Calls still in flight when the member was ejected do not end the ejection early
+            on_probation = 0 < member.ejected_until <= now
+            member.samples += 1
+            member.error_rate = self._error_rate(member, now)
+            member.error_rate += self.alpha * ((0.0 if ok else 1.0) - member.error_rate)
+            member.error_at = now
+            member.probing = False
+            if ok:
+                member.failures = 0
+                member.successes += 1
+                if latency is not None:
+                    member.latency = latency if member.latency is None else member.latency + self.alpha * (latency - member.latency)
+                if on_probation:
+                    member.ejected_until = 0.0
+                    member.error_rate = 0.0
+                    event = "readmitted"
+                elif member.successes >= MIN_SAMPLES and not member.ejected_until:
+                    member.ejections = 0
+            else:
+                member.successes = 0
+                member.failures += 1
+                failing = member.failures >= self.eject_failures or (
+                    member.samples >= MIN_SAMPLES and member.error_rate > self.eject_error_rate
+                )
+                # A failed trial call sends a member on probation straight back out
+                if on_probation or (failing and not member.ejected_until):
+                    member.ejections += 1
+                    seconds = min(self.eject_seconds * 2 ** (member.ejections - 1), self.eject_max_seconds)
+                    member.ejected_until = now + seconds
+                    member.failures = 0
+                    event = "ejected"
+        if event:
+            UPSTREAM_POOL_EVENTS.inc(member.name, event)
+            print(f"{'✅' if event == 'readmitted' else '❌'} Upstream {member.name} {event}")
+
+    def _note_limits(self, member, response):
+        headers = response.headers
+        remaining = headers.get("x-ratelimit-remaining-requests", headers.get("x-ratelimit-remaining"))
+        limit = headers.get("x-ratelimit-limit-requests", headers.get("x-ratelimit-limit"))
+        try:
+            remaining, limit = int(remaining), int(limit)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            state = self._limits[member.key]
+            state.remaining, state.limit, state.seen_at = remaining, limit, time.time()
+
+    def _rate_limited(self, member, response):
+        try:
+            cooldown = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            cooldown = UPSTREAM_POOL_RATE_LIMIT_COOLDOWN
+        with self._lock:
+            member.probing = False
+            state = self._limits[member.key]
+            state.blocked_until = max(state.blocked_until, time.time() + cooldown)
+            state.remaining, state.seen_at = 0, time.time()
+        UPSTREAM_POOL_EVENTS.inc(member.name, "rate_limited")
+
+    def stats(self):
+        now = time.time()
+        stats = {}
+        with self._lock:
+            for member in self.members:
+                stats[(member.name, "latency_ewma_seconds")] = member.latency or 0.0
+                stats[(member.name, "error_rate")] = self._error_rate(member, now)
+                stats[(member.name, "in_flight")] = member.in_flight
+                stats[(member.name, "headroom")] = self._headroom(member.key, now)
+                stats[(member.name, "ejected")] = int(member.ejected_until > now)
+                stats[(member.name, "rate_limited")] = int(self._limits[member.key].blocked_until > now)
+        return stats
+
+
+upstream_pool = UpstreamPool()
+REGISTRY.register_collector(
+    "upstream_pool", "Per-member latency, error rate, calls in flight, rate-limit headroom and ejection",
+    ("member", "stat"), upstream_pool.stats
+)
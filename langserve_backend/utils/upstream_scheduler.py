@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.deadline import CANCEL_POLL_INTERVAL, RequestAbandoned, check, current_budget
+from utils.metrics import REGISTRY, Counter, Histogram
+from utils.request_timing import record_stage
+
+# Concurrent upstream calls allowed per process (per worker under gunicorn)
+# and per API key in the upstream pool
+UPSTREAM_SLOTS = int(os.getenv("UPSTREAM_SLOTS", "4"))
+# Share of slots each class gets when all of them are waiting
+UPSTREAM_CLASS_WEIGHTS = os.getenv(
+    "UPSTREAM_CLASS_WEIGHTS", "interactive_doctor=8,interactive_user=4,batch=1"
+)
+# Waiting calls allowed per class before new ones are refused
+UPSTREAM_QUEUE_LIMITS = os.getenv(
+    "UPSTREAM_QUEUE_LIMITS", "interactive_doctor=100,interactive_user=200,batch=1000"
+)
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "60"))  # seconds
+
+DEFAULT_CLASS = "interactive_user"
+
+UPSTREAM_QUEUE_TIME = Histogram(
+    "upstream_queue_seconds", "Time spent waiting for an upstream slot by priority class", ("class",)
+)
+UPSTREAM_QUEUE_REJECTED = Counter(
+    "upstream_queue_rejected_total", "Upstream calls refused by priority class and reason", ("class", "reason")
+)
+
+_priority: ContextVar = ContextVar("upstream_priority", default=DEFAULT_CLASS)
+
+
+class UpstreamQueueFull(Exception):
+    """Raised when a priority class already has its maximum of waiting calls"""
+
+
+class UpstreamQueueTimeout(Exception):
+    """Raised when no slot was free within the queue timeout"""
+
+
+def _parse_classes(spec, cast):
+    return {
+        name.strip(): cast(value)
+        for name, _, value in (item.partition("=") for item in spec.split(",") if item.strip())
+    }
+
+
+def class_for_role(role, batch=False):
+    """Priority class for a caller: clinicians first, bulk work last"""
+    if batch:
+        return "batch"
+    return "interactive_doctor" if role in ("doctor", "admin") else "interactive_user"
+
+
+@contextmanager
+def upstream_priority(priority_class):
+    """Run the enclosed upstream calls in priority_class"""
+    token = _priority.set(priority_class)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class _Waiter:
+    __slots__ = ("tag", "event", "granted")
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.event = threading.Event()
+        self.granted = False
+
+
+class UpstreamScheduler:
+    """Hands out a fixed number of upstream slots with weighted fair queuing
+
+    Each waiting call gets a virtual finish tag of
+    max(virtual time, previous tag of its class) + 1 / weight, and a freed slot
+    goes to the waiter with the smallest tag. Under contention every class is
+    served in proportion to its weight, so batch work keeps making progress
+    but cannot starve interactive callers; within a class calls are FIFO.
+    """
+
+    def __init__(self, slots=UPSTREAM_SLOTS, weights=None, queue_limits=None, queue_timeout=UPSTREAM_QUEUE_TIMEOUT):
+        self.slots = slots
+        self.weights = weights or _parse_classes(UPSTREAM_CLASS_WEIGHTS, float)
+        self.queue_limits = queue_limits or _parse_classes(UPSTREAM_QUEUE_LIMITS, int)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._virtual_time = 0.0
+        self._last_tag = {name: 0.0 for name in self.weights}
+        self._queues = {name: deque() for name in self.weights}
+
+    def acquire(self, priority_class=None, timeout=None):
+        """Wait for a slot, at most timeout seconds (default: the queue timeout)"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        priority_class = priority_class if priority_class in self.weights else DEFAULT_CLASS
+        started = time.perf_counter()
+        waiter = None
+        with self._lock:
+            if self._in_use < self.slots and not any(self._queues.values()):
+                self._in_use += 1
+            else:
+                queue = self._queues[priority_class]
+                if len(queue) >= self.queue_limits.get(priority_class, 0):
+                    UPSTREAM_QUEUE_REJECTED.inc(priority_class, "full")
+                    raise UpstreamQueueFull(f"{len(queue)} {priority_class} calls already waiting")
+                tag = max(self._virtual_time, self._last_tag[priority_class]) + 1.0 / self.weights[priority_class]
+                self._last_tag[priority_class] = tag
+                waiter = _Waiter(tag)
+                queue.append(waiter)
+
+        if waiter is not None:
+            try:
+                granted = self._wait(waiter, timeout)
+            except RequestAbandoned:
+                with self._lock:
+                    granted = waiter.granted
+                    if not granted:
+                        self._queues[priority_class].remove(waiter)
+                if granted:
+                    self.release()  # granted just as the request was abandoned; hand it on
+                raise
+            if not granted:
+                with self._lock:
+                    if not waiter.granted:
+                        self._queues[priority_class].remove(waiter)
+                        UPSTREAM_QUEUE_REJECTED.inc(priority_class, "timeout")
+                        raise UpstreamQueueTimeout(f"No upstream slot within {timeout:g}s")
+
+        waited = time.perf_counter() - started
+        UPSTREAM_QUEUE_TIME.observe(waited, priority_class)
+        record_stage("upstream_queue", waited)
+
+    def try_acquire(self):
+        """Take a free slot without waiting; False if none is free or calls are already waiting"""
+        with self._lock:
+            if self._in_use < self.slots and not any(self._queues.values()):
+                self._in_use += 1
+                return True
+            return False
+
+    @staticmethod
+    def _wait(waiter, timeout):
+        """Wait to be granted a slot, giving up at once if the current request is abandoned"""
+        if current_budget() is None:
+            return waiter.event.wait(timeout)
+        give_up = time.monotonic() + timeout
+        while True:
+            step = max(0.0, min(CANCEL_POLL_INTERVAL, give_up - time.monotonic()))
+            if waiter.event.wait(step):
+                return True
+            if time.monotonic() >= give_up:
+                return False
+            check("upstream_queue")
+
+    def _grant_next(self):
+        """Hand a slot to the waiter with the smallest tag; False if nobody waits"""
+        heads = [queue[0] for queue in self._queues.values() if queue]
+        if not heads:
+            return False
+        waiter = min(heads, key=lambda w: w.tag)
+        for queue in self._queues.values():
+            if queue and queue[0] is waiter:
+                queue.popleft()
+                break
+        self._virtual_time = waiter.tag
+        waiter.granted = True
+        waiter.event.set()
+        return True
+
+    def release(self):
+        with self._lock:
+            # The slot passes straight to the next waiter, so _in_use is
+            # unchanged; after resize() lowered the slots it is retired instead
+            if self._in_use > self.slots or not self._grant_next():
+                self._in_use -= 1
+
+    def resize(self, slots):
+        """Change the number of slots; added ones go straight to waiting calls"""
+        with self._lock:
+            self.slots = slots
+            while self._in_use < self.slots and self._grant_next():
+                self._in_use += 1
+
+    @contextmanager
+    def slot(self, priority_class=None, timeout=None):
+        """Hold an upstream slot, in the current request's class unless given"""
+        self.acquire(priority_class or current_priority(), timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            stats = {("queued", name): len(queue) for name, queue in self._queues.items()}
+            stats[("in_use", "all")] = self._in_use
+            stats[("slots", "all")] = self.slots
+        return stats
+
+
+scheduler = UpstreamScheduler()
+REGISTRY.register_collector(
+    "upstream_scheduler", "Upstream slots in use and calls waiting per priority class", ("state", "class"),
+    scheduler.stats
+)
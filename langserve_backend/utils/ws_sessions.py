@@ -0,0 +1,159 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from utils.metrics import REGISTRY
+
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "15"))  # seconds between pings
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))  # close after this long without a message
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "256"))  # events buffered per connection
+WS_MAX_PENDING = int(os.getenv("WS_MAX_PENDING", "4"))  # messages queued behind the running one
+WS_SESSION_TTL = float(os.getenv("WS_SESSION_TTL", "600"))  # kept after disconnect for resume
+WS_REPLAY_EVENTS = int(os.getenv("WS_REPLAY_EVENTS", "1000"))  # events kept for resume; an answer's tokens count as one
+WS_MAX_TURNS = int(os.getenv("WS_MAX_TURNS", "50"))  # finished turns' results kept per session
+WS_MAX_SESSIONS = int(os.getenv("WS_MAX_SESSIONS", "10000"))
+
+
+class DiagnosisSession:
+    """State of one conversation, kept across reconnects
+
+    Diagnosis events are numbered and kept in a bounded replay buffer, where
+    the token events of one answer are merged into a single entry. While a
+    connection is attached they are also pushed into its bounded send
+    queue; a producer that outruns the client blocks on that queue, which
+    in turn stops it reading from the upstream stream (backpressure).
+    Detached sessions finish the running turn and buffer its events until
+    the client reconnects with the last sequence number it saw; messages
+    still waiting in the inbox are run once it has.
+    """
+
+    def __init__(self, session_id, principal, role):
+        self.session_id = session_id
+        self.principal = principal
+        self.role = role
+        self.turns = deque(maxlen=WS_MAX_TURNS)
+        self.turn_count = 0
+        self.seq = 0
+        self.events = deque(maxlen=WS_REPLAY_EVENTS)
+        self.inbox = asyncio.Queue(maxsize=WS_MAX_PENDING)  # (text, message_id) not yet run
+        self.running = None  # future of the turn in a worker thread, which outlives a connection
+        self.detached_at = time.monotonic()
+        self._outbox = None
+        self._lock = threading.Lock()
+
+    @property
+    def attached(self):
+        return self._outbox is not None
+
+    def attach(self, loop, queue, last_seq=0):
+        """Route new events to queue; returns the buffered events after last_seq"""
+        with self._lock:
+            self._outbox = (loop, queue)
+            self.detached_at = None
+            return [_replayed(event, last_seq) for event in self.events if event["seq"] > last_seq]
+
+    def finish_turn(self, result):
+        with self._lock:
+            self.turns.append(result)
+            self.turn_count += 1
+
+    def detach(self, queue):
+        with self._lock:
+            if self._outbox and self._outbox[1] is queue:
+                self._outbox = None
+                self.detached_at = time.monotonic()
+
+    def emit(self, event):
+        """Number, buffer and deliver an event; call from a worker thread, not the event loop"""
+        with self._lock:
+            self.seq += 1
+            event["seq"] = self.seq
+            self._buffer(event)
+            outbox = self._outbox
+        if outbox is not None:
+            self._deliver(outbox, event)
+
+    def _buffer(self, event):
+        last = self.events[-1] if self.events else None
+        if event.get("type") != "token":
+            self.events.append(event)
+        elif (last is not None and "_parts" in last and last["message_id"] == event.get("message_id")
+                and last["seq"] == event["seq"] - 1):
+            last["_parts"].append(event["text"])
+            last["seq"] = event["seq"]
+        else:
+            self.events.append({"type": "token", "message_id": event.get("message_id"), "seq": event["seq"],
+                                "_first_seq": event["seq"], "_parts": [event["text"]]})
+
+    def _deliver(self, outbox, event):
+        loop, queue = outbox
+        try:
+            future = asyncio.run_coroutine_threadsafe(queue.put(event), loop)
+        except RuntimeError:
+            return  # loop closed; the event stays in the replay buffer
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return
+            except concurrent.futures.TimeoutError:
+                if self._outbox is not outbox:
+                    future.cancel()
+                    return
+            except Exception:
+                return
+
+
+def _replayed(event, last_seq):
+    """A buffered event as sent on resume; merged tokens resume after the last one seen"""
+    if "_parts" not in event:
+        return event
+    parts = event["_parts"][max(0, last_seq + 1 - event["_first_seq"]):]
+    return {"type": "token", "message_id": event["message_id"], "seq": event["seq"], "text": "".join(parts)}
+
+
+class SessionStore:
+    """In-process sessions by id; under several workers a resume must reach the same worker"""
+
+    def __init__(self, ttl=WS_SESSION_TTL, max_sessions=WS_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def open(self, session_id, principal, role):
+        """Resume the caller's session if it is still held, else start a new one; returns (session, resumed)"""
+        with self._lock:
+            self._sweep()
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None and session.principal == principal:
+                return session, True
+            if len(self._sessions) >= self.max_sessions:
+                raise RuntimeError("Too many open diagnosis sessions")
+            session = DiagnosisSession(uuid.uuid4().hex, principal, role)
+            self._sessions[session.session_id] = session
+            return session, False
+
+    def _sweep(self):
+        now = time.monotonic()
+        expired = [
+            session_id for session_id, session in self._sessions.items()
+            if session.detached_at is not None and now - session.detached_at > self.ttl
+        ]
+        for session_id in expired:
+            del self._sessions[session_id]
+
+    def stats(self):
+        with self._lock:
+            attached = sum(1 for session in self._sessions.values() if session.attached)
+            return {"attached": attached, "detached": len(self._sessions) - attached}
+
+
+sessions = SessionStore()
+REGISTRY.register_collector(
+    "ws_diagnosis_sessions", "Diagnosis WebSocket sessions, attached or held for resume", ("state",),
+    sessions.stats
+)
@@ -4,10 +4,82 @@ User management and system administration features
 """
 
 import streamlit as st
-import json
+import os
 import pandas as pd
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta, time as dt_time
 from auth import AuthManager
+from audit_log import EVENT_TYPES, audit, get_audit_log
+from http_client import get_http_client
+from history_store import get_history_store, to_session_record
+from exporter import (DOWNLOAD_MAX_BYTES, EXPORT_FORMATS, available_formats, cli_command, export_file_name,
+                      export_for_download, iter_diagnosis_rows, iter_user_rows)
+
+backend_url = os.environ.get("BACKEND_URL", "http://localhost:8000")
+# /admin/* on the backend needs its ADMIN_API_KEY
+backend_admin_api_key = os.environ.get("BACKEND_ADMIN_API_KEY", "")
+# Audit events shown at most; the newest are kept
+AUDIT_VIEW_LIMIT = 5000
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_rollups(resolution):
+    """System-wide usage buckets from the backend; one request per resolution every 30s at most"""
+    response = get_http_client().get(
+        f"{backend_url}/admin/rollups",
+        params={"resolution": resolution},
+        headers={"Authorization": f"Bearer {backend_admin_api_key}"},
+        timeout=5
+    )
+    response.raise_for_status()
+    return response.json()["buckets"]
+
+
+def show_usage_rollups():
+    """Charts of backend traffic from its per-minute/hour/day rollups"""
+    st.subheader("System-wide Diagnosis Traffic")
+    if not backend_admin_api_key:
+        st.info("Set BACKEND_ADMIN_API_KEY to the backend's ADMIN_API_KEY to see system-wide traffic")
+        return
+    resolution = st.radio("Resolution", ["minute", "hour", "day"], horizontal=True, key="rollup_resolution")
+    try:
+        buckets = fetch_rollups(resolution)
+    except Exception as e:
+        st.warning(f"Could not load usage rollups: {e}")
+        return
+    if not buckets:
+        st.info("No diagnosis traffic recorded yet")
+        return
+
+    df = pd.DataFrame(buckets)
+    df["time"] = pd.to_datetime(df["start"], unit="s")
+    df = df.set_index("time")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Diagnoses", int(df["requests"].sum()))
+    with col2:
+        st.metric("Errors", int(df["errors"].sum()))
+    with col3:
+        lookups = df["cache_hits"].sum() + df["cache_misses"].sum()
+        st.metric("Cache Hit Ratio", f"{df['cache_hits'].sum() / lookups:.0%}" if lookups else "n/a")
+    with col4:
+        st.metric("Worst p95 Latency", f"{df['latency_p95'].max():.2f}s" if df["latency_p95"].notna().any() else "n/a")
+
+    st.write("**Requests and errors**")
+    st.line_chart(df[["requests", "errors"]])
+    st.write("**Latency (seconds)**")
+    st.line_chart(df[["latency_avg", "latency_p50", "latency_p95"]])
+    st.write("**Cache hit ratio**")
+    st.line_chart(df[["cache_hit_ratio"]])
+
+    categories = {}
+    for bucket in buckets:
+        for category, count in bucket["categories"].items():
+            categories[category] = categories.get(category, 0) + count
+    if categories:
+        st.write("**Symptom categories**")
+        st.bar_chart(pd.DataFrame(list(categories.items()), columns=["Category", "Diagnoses"]).set_index("Category"))
 
 def show_admin_panel():
     """Display admin panel interface"""
@@ -57,6 +129,7 @@ def show_admin_panel():
                         users[username_reset]["login_attempts"] = 0
                         users[username_reset]["locked_until"] = None
                         auth_manager.save_users(users)
+                        audit("password_reset", st.session_state.username, target=username_reset)
                         st.success(f"Password reset for {username_reset}")
                         st.rerun()
                     else:
@@ -71,6 +144,7 @@ def show_admin_panel():
                         users[username_unlock]["login_attempts"] = 0
                         users[username_unlock]["locked_until"] = None
                         auth_manager.save_users(users)
+                        audit("account_unlocked", st.session_state.username, target=username_unlock)
                         st.success(f"Account unlocked for {username_unlock}")
                         st.rerun()
                 else:
@@ -85,6 +159,7 @@ def show_admin_panel():
                 if username_delete and username_delete != st.session_state.username:
                     del users[username_delete]
                     auth_manager.save_users(users)
+                    audit("user_deleted", st.session_state.username, target=username_delete)
                     st.success(f"User {username_delete} deleted")
                     st.rerun()
         else:
@@ -123,17 +198,41 @@ def show_admin_panel():
         
         # Diagnosis statistics
         st.subheader("Diagnosis Usage")
-        if 'diagnosis_history' in st.session_state and st.session_state.diagnosis_history:
-            total_diagnoses = len(st.session_state.diagnosis_history)
-            st.metric("Total Diagnoses (Current Session)", total_diagnoses)
+        history_store = get_history_store()
+        total_diagnoses = history_store.count()
+        if total_diagnoses:
+            st.metric("Total Diagnoses (All Users)", total_diagnoses)
             
-            # Recent activity
-            recent_diagnoses = st.session_state.diagnosis_history[-5:]
+            # Per-user usage
+            user_counts = history_store.counts_by_user()
+            usage_df = pd.DataFrame(list(user_counts.items()), columns=["User", "Diagnoses"])
+            st.bar_chart(usage_df.set_index("User"))
+            
+            # Recent activity across all users
             st.write("**Recent Diagnoses:**")
-            for diag in reversed(recent_diagnoses):
+            for row in history_store.recent(limit=5):
+                diag = to_session_record(row)
                 st.write(f"- {diag['timestamp'][:16]} by {diag['user']}: {diag['input'][:50]}...")
         else:
             st.info("No diagnosis data available")
+
+        show_usage_rollups()
+        
+        # Outbound HTTP pool
+        st.subheader("Backend Connection Pool")
+        http_metrics = get_http_client().metrics()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Requests Sent", http_metrics["requests_sent"])
+        with col2:
+            st.metric("Connections Opened", http_metrics["connections_opened"])
+        with col3:
+            st.metric("Connection Reuse", f"{http_metrics['connection_reuse_ratio']:.0%}")
+        with col4:
+            st.metric("Failed Calls", http_metrics["errors"])
+        if http_metrics["hosts"]:
+            st.dataframe(pd.DataFrame([{"Host": host, **stats} for host, stats in http_metrics["hosts"].items()]),
+                         use_container_width=True)
     
     with tab3:
         st.header("🔧 System Settings")
@@ -159,6 +258,8 @@ def show_admin_panel():
                                     value=current_lockout, step=60)
         
         if st.button("💾 Save Settings"):
+            audit("settings_saved", st.session_state.username, session_timeout=new_timeout,
+                  max_login_attempts=new_attempts, lockout_duration=new_lockout)
             st.success("Settings saved! (Note: Restart required for some changes)")
         
         st.subheader("System Maintenance")
@@ -166,29 +267,45 @@ def show_admin_panel():
         
         with col1:
             if st.button("🧹 Clear Session Data"):
+                # Only the session ring buffer; stored history is kept
                 if 'diagnosis_history' in st.session_state:
-                    st.session_state.diagnosis_history = []
+                    st.session_state.diagnosis_history.clear()
+                audit("session_data_cleared", st.session_state.username)
                 st.success("Session data cleared")
         
         with col2:
-            if st.button("📤 Export User Data"):
-                users = auth_manager.load_users()
-                # Remove sensitive data for export
-                export_data = {}
-                for username, info in users.items():
-                    export_data[username] = {
-                        "email": info.get("email"),
-                        "role": info.get("role"),
-                        "created_at": info.get("created_at"),
-                        "last_login": info.get("last_login")
-                    }
+            export_dataset = st.selectbox("Dataset", ["users", "diagnoses"], key="export_dataset",
+                                          format_func=lambda d: "Users" if d == "users" else "Diagnosis History")
+            export_format = st.selectbox("Format", available_formats(), key="export_format")
+            if st.button("📤 Export Data"):
+                if export_dataset == "users":
+                    rows = iter_user_rows(auth_manager.load_users())
+                else:
+                    rows = iter_diagnosis_rows(get_history_store())
                 
-                st.download_button(
-                    label="📥 Download User Data",
-                    data=json.dumps(export_data, indent=2),
-                    file_name=f"user_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                    mime="application/json"
-                )
+                # Rows are streamed to disk in chunks; sensitive fields are never exported
+                try:
+                    path, count, size = export_for_download(export_dataset, rows, export_format)
+                except RuntimeError as e:
+                    st.error(str(e))
+                else:
+                    if path is None:
+                        # The download button would keep the whole file in the server's memory
+                        st.warning(f"{count} rows make {size / 2**20:.0f} MB, over the "
+                                   f"{DOWNLOAD_MAX_BYTES / 2**20:.0f} MB download limit. "
+                                   "Export them on the server instead, from streamlit_ui/:")
+                        st.code(cli_command(export_dataset, export_format), language="bash")
+                    else:
+                        audit("user_data_exported", st.session_state.username,
+                              dataset=export_dataset, format=export_format, rows=count)
+                        with open(path, "rb") as f:
+                            st.download_button(
+                                label=f"📥 Download {count} rows",
+                                data=f,
+                                file_name=export_file_name(export_dataset, export_format),
+                                mime=EXPORT_FORMATS[export_format]["mime"]
+                            )
+                        os.remove(path)
     
     with tab4:
         st.header("📋 Audit Logs")
@@ -214,7 +331,51 @@ def show_admin_panel():
             st.info("No login activity recorded")
         
         st.subheader("System Events")
-        st.info("Detailed audit logging feature - Coming soon")
+        audit_log = get_audit_log()
+        
+        col1, col2, col3 = st.columns([2, 2, 1])
+        with col1:
+            today = datetime.now().date()
+            date_range = st.date_input("Date Range", value=(today - timedelta(days=7), today),
+                                       max_value=today, key="audit_range")
+        with col2:
+            event_filter = st.multiselect("Event Types", EVENT_TYPES, key="audit_events")
+        with col3:
+            actor_filter = st.text_input("User", key="audit_actor")
+        
+        if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+            start_date, end_date = date_range
+        else:
+            start_date = end_date = date_range[0] if isinstance(date_range, (list, tuple)) else date_range
+        start_ts = datetime.combine(start_date, dt_time.min).timestamp()
+        end_ts = datetime.combine(end_date, dt_time.max).timestamp()
+        
+        # Make events still waiting in the queue visible
+        audit_log.flush(timeout=2.0)
+        # Keep only the newest matches while streaming through the range, counting them all
+        events = deque(maxlen=AUDIT_VIEW_LIMIT)
+        matched = 0
+        for event in audit_log.iter_query(start_ts, end_ts, event_types=event_filter or None,
+                                          actor=actor_filter.strip() or None):
+            events.append(event)
+            matched += 1
+        
+        if matched > len(events):
+            oldest_shown = datetime.fromtimestamp(events[0]["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+            st.warning(f"{matched} events match, showing only the newest {len(events)}. The "
+                       f"{matched - len(events)} oldest, from before {oldest_shown}, were left out; "
+                       "narrow the date range or filters to see them.")
+        if events:
+            event_df = pd.DataFrame([{
+                "Time": datetime.fromtimestamp(e["ts"]).strftime("%Y-%m-%d %H:%M:%S"),
+                "Event": e["event"],
+                "User": e.get("actor") or "-",
+                "Details": ", ".join(f"{k}={v}" for k, v in e.get("details", {}).items())
+            } for e in reversed(events)])
+            st.dataframe(event_df, use_container_width=True)
+            st.caption(f"{len(events)} of {matched} events, newest first")
+        else:
+            st.info("No events recorded in this range")
 
 if __name__ == "__main__":
     # This allows running the admin panel as a standalone page
@@ -1,8 +1,21 @@
 import streamlit as st
 import requests
 import os
+import time
+import uuid
 from datetime import datetime
 from auth import init_session_state, check_session_timeout, show_login_page, logout
+from audit_log import audit
+from backend_status import STATUS_CONFIG, get_backend_status_poller
+from http_client import get_http_client
+from case_search import CLINICIAN_ROLES, show_case_search
+from history_store import HISTORY_CONFIG, get_history_store, init_session_history, page_cursor, to_session_record
+
+# Seconds between job status checks while a diagnosis is pending
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1.5"))
+# How long the backend may take before answering with the symptom category
+# only; the diagnosis is then fetched as a job
+DIAGNOSIS_DEADLINE_MS = int(os.environ.get("DIAGNOSIS_DEADLINE_MS", "3000"))
 
 # Health check endpoint for Render
 if st.query_params.get("health") == "check":
@@ -47,252 +60,19 @@ if not st.session_state.authenticated:
     show_login_page()
     st.stop()
 
-# Custom CSS for modern, professional styling
-st.markdown("""
-<style>
-    /* Import Google Fonts */
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
-
-    /* Global Styles */
-    .stApp {
-        font-family: 'Inter', sans-serif;
-    }
-
-    /* Hide Streamlit branding and confusing elements */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-    .stDeployButton {visibility: hidden;}
-    .stDecoration {visibility: hidden;}
-
-    /* Hide any default labels or confusing text */
-    .stTextArea > label {display: none !important;}
-    .stTextInput > label {display: none !important;}
-
-    /* Hide any potential confusing elements */
-    .stAlert {margin-top: 0 !important;}
-    .stMarkdown > div > p:empty {display: none !important;}
-
-    /* Ensure clean spacing around main content */
-    .main .block-container {
-        padding-top: 1rem !important;
-        max-width: 1200px !important;
-    }
-
-    /* Main container */
-    .main-container {
-        max-width: 1200px;
-        margin: 0 auto;
-        padding: 2rem 1rem;
-    }
-
-    /* Header styles */
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: 700;
-        color: #1e293b;
-        text-align: center;
-        margin-bottom: 0.5rem;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-    }
-
-    .subtitle {
-        text-align: center;
-        color: #64748b;
-        font-size: 1.1rem;
-        margin-bottom: 3rem;
-        font-weight: 400;
-    }
-
-    /* Card styles */
-    .card {
-        background: white;
-        border-radius: 16px;
-        padding: 2rem;
-        box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1), 0 2px 4px -1px rgba(0, 0, 0, 0.06);
-        border: 1px solid #e2e8f0;
-        margin-bottom: 2rem;
-        transition: all 0.3s ease;
-    }
-
-    .card:hover {
-        box-shadow: 0 10px 15px -3px rgba(0, 0, 0, 0.1), 0 4px 6px -2px rgba(0, 0, 0, 0.05);
-        transform: translateY(-2px);
-    }
-
-    /* Input section */
-    .input-section {
-        background: linear-gradient(135deg, #f8fafc 0%, #f1f5f9 100%);
-        border-radius: 16px;
-        padding: 2rem;
-        margin-bottom: 2rem;
-        border: 2px solid #e2e8f0;
-    }
-
-    /* Results section */
-    .results-container {
-        background: white;
-        border-radius: 16px;
-        padding: 2rem;
-        box-shadow: 0 8px 25px -5px rgba(0, 0, 0, 0.1);
-        border: 1px solid #e2e8f0;
-        margin-top: 2rem;
-    }
-
-    .symptom-card {
-        background: linear-gradient(135deg, #dbeafe 0%, #bfdbfe 100%);
-        padding: 1.5rem;
-        border-radius: 12px;
-        border-left: 4px solid #3b82f6;
-        margin-bottom: 1.5rem;
-        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.05);
-    }
-
-    .diagnosis-card {
-        background: linear-gradient(135deg, #dcfce7 0%, #bbf7d0 100%);
-        padding: 1.5rem;
-        border-radius: 12px;
-        border-left: 4px solid #10b981;
-        margin-bottom: 1.5rem;
-        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.05);
-    }
-
-    .warning-card {
-        background: linear-gradient(135deg, #fef3c7 0%, #fde68a 100%);
-        padding: 1.5rem;
-        border-radius: 12px;
-        border-left: 4px solid #f59e0b;
-        margin: 1.5rem 0;
-        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.05);
-    }
-
-    /* Button styles */
-    .stButton > button {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        border: none;
-        border-radius: 12px;
-        padding: 0.75rem 2rem;
-        font-weight: 600;
-        font-size: 1rem;
-        transition: all 0.3s ease;
-        box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1);
-    }
-
-    .stButton > button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 8px 15px -3px rgba(0, 0, 0, 0.2);
-    }
-
-    /* Example buttons */
-    .example-btn {
-        background: linear-gradient(135deg, #f1f5f9 0%, #e2e8f0 100%);
-        border: 1px solid #cbd5e1;
-        border-radius: 8px;
-        padding: 0.5rem 1rem;
-        margin: 0.25rem;
-        font-size: 0.875rem;
-        color: #475569;
-        transition: all 0.2s ease;
-    }
-
-    .example-btn:hover {
-        background: linear-gradient(135deg, #e2e8f0 0%, #cbd5e1 100%);
-        transform: translateY(-1px);
-    }
-
-    /* Sidebar styles */
-    .css-1d391kg {
-        background: linear-gradient(180deg, #f8fafc 0%, #f1f5f9 100%);
-    }
-
-    /* Loading animation */
-    .loading-container {
-        display: flex;
-        justify-content: center;
-        align-items: center;
-        padding: 2rem;
-    }
-
-    .loading-spinner {
-        border: 3px solid #f3f4f6;
-        border-top: 3px solid #667eea;
-        border-radius: 50%;
-        width: 40px;
-        height: 40px;
-        animation: spin 1s linear infinite;
-    }
-
-    @keyframes spin {
-        0% { transform: rotate(0deg); }
-        100% { transform: rotate(360deg); }
-    }
-
-    /* Status indicators */
-    .status-indicator {
-        display: inline-flex;
-        align-items: center;
-        padding: 0.25rem 0.75rem;
-        border-radius: 9999px;
-        font-size: 0.875rem;
-        font-weight: 500;
-    }
 
-    .status-success {
-        background-color: #dcfce7;
-        color: #166534;
-    }
-
-    .status-warning {
-        background-color: #fef3c7;
-        color: #92400e;
-    }
 
-    .status-error {
-        background-color: #fee2e2;
-        color: #991b1b;
-    }
+@st.cache_resource
+def load_css():
+    """Read the stylesheet once per process"""
+    with open(os.path.join(os.path.dirname(__file__), "static", "app.css"), encoding="utf-8") as f:
+        return f.read()
 
-    /* Typography */
-    .section-title {
-        font-size: 1.5rem;
-        font-weight: 600;
-        color: #1e293b;
-        margin-bottom: 1rem;
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-    }
 
-    .result-title {
-        font-size: 1.25rem;
-        font-weight: 600;
-        color: #1e293b;
-        margin-bottom: 0.75rem;
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-    }
-
-    /* Responsive design */
-    @media (max-width: 768px) {
-        .main-header {
-            font-size: 2rem;
-        }
-
-        .card {
-            padding: 1.5rem;
-        }
-
-        .input-section {
-            padding: 1.5rem;
-        }
-    }
-</style>
-""", unsafe_allow_html=True)
+# Custom CSS for modern, professional styling. The page is split into
+# fragments, so widget interactions rerun only their fragment and the
+# stylesheet is sent again only on a full rerun.
+st.html(f"<style>{load_css()}</style>")
 
 # Main header with modern design
 st.markdown("""
@@ -302,11 +82,28 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Modern sidebar with compact design
-with st.sidebar:
-    # Get user info
-    user_info = st.session_state.user_info
+backend_url = os.environ.get("BACKEND_URL", "http://localhost:8000")
+backend_api_key = os.environ.get("BACKEND_API_KEY", "secret-token-123")
+
+
+def backend_headers():
+    """Identify the signed-in user to the backend, which rate-limits per user and role"""
+    return {
+        "Authorization": f"Bearer {backend_api_key}",
+        "X-User": st.session_state.username,
+        "X-User-Role": st.session_state.user_info.get('role', 'user'),
+    }
+
+# Persistent history; the session only keeps a small ring buffer of recent records
+history_store = get_history_store()
+init_session_history(st.session_state.username)
 
+user_info = st.session_state.user_info
+
+
+@st.fragment(run_every=STATUS_CONFIG["interval"])
+def sidebar_status():
+    """Profile card and backend status, refreshed as often as the status is polled"""
     # User profile card
     st.markdown("""
     <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
@@ -330,33 +127,48 @@ with st.sidebar:
 
     # System status - compact
     st.markdown("### 🔧 System Status")
-    backend_url = os.environ.get("BACKEND_URL", "http://localhost:8000")
 
-    try:
-        health_response = requests.get(f"{backend_url}/", timeout=3)
-        if health_response.status_code == 200:
-            st.markdown('<span class="status-indicator status-success">✅ System Online</span>', unsafe_allow_html=True)
-        else:
-            st.markdown('<span class="status-indicator status-error">❌ System Error</span>', unsafe_allow_html=True)
-    except Exception:
+    # Read the shared cached status; the poller thread does the network call
+    backend_status = get_backend_status_poller(backend_url).snapshot()
+    if backend_status["state"] == "online":
+        st.markdown('<span class="status-indicator status-success">✅ System Online</span>', unsafe_allow_html=True)
+    elif backend_status["state"] == "error":
+        st.markdown('<span class="status-indicator status-error">❌ System Error</span>', unsafe_allow_html=True)
+    elif backend_status["state"] == "offline":
         st.markdown('<span class="status-indicator status-error">❌ System Offline</span>', unsafe_allow_html=True)
+    else:
+        st.markdown('<span class="status-indicator status-warning">⏳ Checking...</span>', unsafe_allow_html=True)
+    if backend_status["age"] is not None:
+        st.caption(f"Checked {int(backend_status['age'])}s ago")
 
+
+def newer_history_page():
+    st.session_state.history_cursors.pop()
+
+
+def older_history_page(page):
+    st.session_state.history_cursors.append(page_cursor(page))
+
+
+@st.fragment
+def history_panel():
+    """Diagnosis count, recent activity and paged full history"""
     # Quick stats
-    if 'diagnosis_history' in st.session_state and st.session_state.diagnosis_history:
-        total_diagnoses = len(st.session_state.diagnosis_history)
+    total_diagnoses = history_store.count(user=st.session_state.username)
+    if total_diagnoses:
         st.markdown(f"""
         <div style="background: #f8fafc; padding: 1rem; border-radius: 8px; margin: 1rem 0;">
             <p style="margin: 0; text-align: center;">
                 <strong style="font-size: 1.5rem; color: #667eea;">{total_diagnoses}</strong><br>
-                <small style="color: #64748b;">Diagnoses This Session</small>
+                <small style="color: #64748b;">Your Diagnoses</small>
             </p>
         </div>
         """, unsafe_allow_html=True)
 
     # Recent diagnoses - compact
     st.markdown("### 📋 Recent Activity")
-    if 'diagnosis_history' in st.session_state and st.session_state.diagnosis_history:
-        recent_diagnoses = st.session_state.diagnosis_history[-2:]  # Show last 2
+    if st.session_state.diagnosis_history:
+        recent_diagnoses = list(st.session_state.diagnosis_history)[-2:]  # Show last 2
         for record in reversed(recent_diagnoses):
             st.markdown(f"""
             <div style="background: white; padding: 0.75rem; border-radius: 8px;
@@ -370,16 +182,44 @@ with st.sidebar:
     else:
         st.info("No recent activity")
 
+    # Older history is paged in from the store on demand
+    if total_diagnoses > 2:
+        with st.expander("📚 Full History"):
+            cursors = st.session_state.history_cursors
+            page = history_store.recent(user=st.session_state.username, before=cursors[-1])
+            for row in page:
+                record = to_session_record(row)
+                st.markdown(f"**{record['symptom_area']}** · {record['timestamp'][:16].replace('T', ' ')}")
+                st.caption(record['input'][:80])
+            page_col1, page_col2 = st.columns(2)
+            with page_col1:
+                if len(cursors) > 1:
+                    st.button("◀ Newer", key="history_newer", on_click=newer_history_page)
+            with page_col2:
+                if len(page) == HISTORY_CONFIG["page_size"]:
+                    st.button("Older ▶", key="history_older", on_click=older_history_page, args=(page,))
+
+
+@st.fragment
+def admin_tools():
+    st.markdown("### ⚙️ Admin")
+    admin_col1, admin_col2 = st.columns(2)
+    with admin_col1:
+        if st.button("📊", help="System Logs"):
+            st.info("Coming soon")
+    with admin_col2:
+        if st.button("👥", help="Manage Users"):
+            st.info("Coming soon")
+
+
+# Modern sidebar with compact design
+with st.sidebar:
+    sidebar_status()
+    history_panel()
+
     # Admin features - compact
     if user_info.get('role') == 'admin':
-        st.markdown("### ⚙️ Admin")
-        admin_col1, admin_col2 = st.columns(2)
-        with admin_col1:
-            if st.button("📊", help="System Logs"):
-                st.info("Coming soon")
-        with admin_col2:
-            if st.button("👥", help="Manage Users"):
-                st.info("Coming soon")
+        admin_tools()
 
     # About section - collapsible
     with st.expander("ℹ️ About This Tool"):
@@ -394,168 +234,133 @@ with st.sidebar:
         """)
 
 
-
 # Clear separation and main content area
 st.markdown('<br>', unsafe_allow_html=True)
 
-# Main content area with modern layout
-st.markdown('<div class="input-section">', unsafe_allow_html=True)
+# Quick example buttons: (label, tooltip, symptoms put in the text area)
+QUICK_EXAMPLES = [
+    ("🤒 Fever & Headache", "High fever with severe headache",
+     "I have a high fever of 102°F and severe headache that started this morning"),
+    ("😷 Respiratory Issues", "Cough and breathing problems",
+     "I have a persistent dry cough and difficulty breathing for the past 3 days"),
+    ("🤢 Digestive Problems", "Stomach pain and nausea",
+     "I have severe stomach pain, nausea, and have been vomiting since yesterday"),
+    ("🧠 Neurological", "Headache and dizziness",
+     "I have a severe headache on the right side and feel dizzy when standing up"),
+]
 
-# Symptom input section - clean and clear
-st.markdown('<h2 class="section-title">📝 Describe Your Symptoms</h2>', unsafe_allow_html=True)
 
-# Input area with better UX
-symptom_input = st.text_area(
-    "",
-    placeholder="Example: I have a headache, fever, and feel nauseous. The headache started this morning and is getting worse...",
-    height=120,
-    help="💡 Be as specific as possible about your symptoms, when they started, their severity, and any other relevant details.",
-    label_visibility="collapsed"
-)
+def use_example(text):
+    st.session_state.symptom_input = text
 
-# Quick example buttons
-st.markdown('<h3 class="result-title">💡 Quick Examples</h3>', unsafe_allow_html=True)
-example_col1, example_col2, example_col3, example_col4 = st.columns(4)
 
-with example_col1:
-    if st.button("🤒 Fever & Headache", key="ex1", help="High fever with severe headache"):
-        symptom_input = "I have a high fever of 102°F and severe headache that started this morning"
-        st.rerun()
+def start_new_case():
+    st.session_state.case_id = None
 
-with example_col2:
-    if st.button("😷 Respiratory Issues", key="ex2", help="Cough and breathing problems"):
-        symptom_input = "I have a persistent dry cough and difficulty breathing for the past 3 days"
-        st.rerun()
-
-with example_col3:
-    if st.button("🤢 Digestive Problems", key="ex3", help="Stomach pain and nausea"):
-        symptom_input = "I have severe stomach pain, nausea, and have been vomiting since yesterday"
-        st.rerun()
 
-with example_col4:
-    if st.button("🧠 Neurological", key="ex4", help="Headache and dizziness"):
-        symptom_input = "I have a severe headache on the right side and feel dizzy when standing up"
-        st.rerun()
+@st.fragment
+def input_panel():
+    """Symptom input, examples and submission; a submitted diagnosis reruns the whole page"""
+    # Main content area with modern layout
+    st.markdown('<div class="input-section">', unsafe_allow_html=True)
 
-st.markdown('</div>', unsafe_allow_html=True)
+    # Symptom input section - clean and clear
+    st.markdown('<h2 class="section-title">📝 Describe Your Symptoms</h2>', unsafe_allow_html=True)
 
-# Analysis button - prominent and centered
-st.markdown('<br>', unsafe_allow_html=True)
-col1, col2, col3 = st.columns([1, 2, 1])
-with col2:
-    analyze_button = st.button(
-        "🔍 Analyze Symptoms with AI",
-        type="primary",
-        use_container_width=True,
-        help="Get AI-powered analysis of your symptoms"
+    # Input area with better UX
+    symptom_input = st.text_area(
+        "Describe your symptoms",
+        key="symptom_input",
+        placeholder="Example: I have a headache, fever, and feel nauseous. The headache started this morning and is getting worse...",
+        height=120,
+        help="💡 Be as specific as possible about your symptoms, when they started, their severity, and any other relevant details.",
+        label_visibility="collapsed"
     )
 
-# Results section
-if analyze_button:
-    if not symptom_input or symptom_input.strip() == "":
-        st.markdown("""
-        <div class="warning-card">
-            <h3>⚠️ Input Required</h3>
-            <p>Please describe your symptoms in the text area above before getting a diagnosis.</p>
-        </div>
-        """, unsafe_allow_html=True)
-    else:
-        # Loading state
-        with st.container():
+    # Quick example buttons fill the text area in a callback, before the fragment reruns
+    st.markdown('<h3 class="result-title">💡 Quick Examples</h3>', unsafe_allow_html=True)
+    for i, (example_col, (label, hint, text)) in enumerate(zip(st.columns(4), QUICK_EXAMPLES), start=1):
+        with example_col:
+            st.button(label, key=f"ex{i}", help=hint, on_click=use_example, args=(text,))
+
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Follow-ups go to the backend under the same case id, so the AI sees the earlier turns
+    if st.session_state.get("case_id"):
+        case_col1, case_col2 = st.columns([3, 1])
+        with case_col1:
+            st.caption("➕ Your next analysis is a follow-up to the current case, "
+                       "e.g. \"also, the fever started 3 days ago\".")
+        with case_col2:
+            st.button("🆕 New Case", use_container_width=True, on_click=start_new_case)
+
+    # Analysis button - prominent and centered
+    st.markdown('<br>', unsafe_allow_html=True)
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        analyze_button = st.button(
+            "🔍 Analyze Symptoms with AI",
+            type="primary",
+            use_container_width=True,
+            help="Get AI-powered analysis of your symptoms"
+        )
+
+    # Submit a new diagnosis; the backend answers in full within the deadline, or
+    # with the category and a job id to poll for the diagnosis
+    if analyze_button:
+        if not symptom_input or symptom_input.strip() == "":
             st.markdown("""
-            <div class="loading-container">
-                <div class="loading-spinner"></div>
+            <div class="warning-card">
+                <h3>⚠️ Input Required</h3>
+                <p>Please describe your symptoms in the text area above before getting a diagnosis.</p>
             </div>
             """, unsafe_allow_html=True)
-
-            st.markdown('<h3 style="text-align: center; color: #667eea;">🤖 AI is analyzing your symptoms...</h3>', unsafe_allow_html=True)
-
+        else:
+            audit("diagnosis_requested", st.session_state.username, input_chars=len(symptom_input))
+            if not st.session_state.get("case_id"):
+                st.session_state.case_id = uuid.uuid4().hex
             try:
-                # API call
-                backend_url = os.environ.get("BACKEND_URL", "http://localhost:8000")
-                response = requests.post(
+                started = time.time()
+                request_timeout = DIAGNOSIS_DEADLINE_MS / 1000 + 10
+                response = get_http_client().post(
                     f"{backend_url}/test",
-                    headers={"Content-Type": "application/json"},
-                    json={"input": symptom_input},
-                    timeout=30
+                    # The backend stops working on the request once this much time has passed
+                    headers={"Content-Type": "application/json", "X-Request-Timeout": str(request_timeout),
+                             **backend_headers()},
+                    json={"input": symptom_input, "conversation_id": st.session_state.case_id,
+                          "deadline_ms": DIAGNOSIS_DEADLINE_MS},
+                    timeout=request_timeout
                 )
-
                 if response.status_code == 200:
                     data = response.json()
-
-                    # Clear loading state
-                    st.empty()
-
-                    # Results container
-                    st.markdown('<div class="results-container">', unsafe_allow_html=True)
-
-                    # Success indicator
-                    st.markdown("""
-                    <div style="text-align: center; margin-bottom: 2rem;">
-                        <span class="status-indicator status-success">✅ Analysis Complete</span>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-                    # Results in two columns for better layout
-                    result_col1, result_col2 = st.columns([1, 2])
-
-                    with result_col1:
-                        # Symptom Category
-                        st.markdown(f"""
-                        <div class="symptom-card">
-                            <h3 class="result-title">🎯 Symptom Category</h3>
-                            <h2 style="color: #3b82f6; margin: 0; font-size: 1.5rem;">{data.get("symptom_area", "Unknown")}</h2>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                        # Analysis metadata
-                        st.markdown(f"""
-                        <div style="background: #f8fafc; padding: 1rem; border-radius: 8px; margin-top: 1rem;">
-                            <p style="margin: 0; font-size: 0.875rem; color: #64748b;">
-                                <strong>Analyzed:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}<br>
-                                <strong>By:</strong> {st.session_state.username} ({user_info.get('role', 'user')})<br>
-                                <strong>Input Length:</strong> {len(symptom_input)} characters
-                            </p>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                    with result_col2:
-                        # Diagnosis and Recommendations
-                        diagnosis_text = data.get("diagnosis", "No diagnosis available")
-                        st.markdown(f"""
-                        <div class="diagnosis-card">
-                            <h3 class="result-title">🩺 AI Diagnosis & Recommendations</h3>
-                            <div style="line-height: 1.6; color: #374151;">
-                                {diagnosis_text}
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                    # Medical disclaimer
-                    st.markdown("""
+                    if data.get("job_id"):
+                        status = "completed" if data["status"] == "complete" else "running"
+                        st.session_state.active_job = {"job_id": data["job_id"], "status": status}
+                        # Keep the job id in the URL so the result survives a page reload
+                        st.query_params["job"] = data["job_id"]
+                    else:
+                        # Answered in full without a job (deadline 0): nothing to poll or reload.
+                        # The id only keys this result in the history.
+                        st.session_state.active_job = {
+                            "job_id": uuid.uuid4().hex, "status": "completed",
+                            "job": {"status": "completed", "result": data,
+                                    "created_at": started, "updated_at": time.time()}
+                        }
+                        if "job" in st.query_params:
+                            del st.query_params["job"]  # an earlier job's, no longer shown
+                    # The results panel and history live outside this fragment
+                    st.rerun()
+                elif response.status_code == 429:
+                    audit("diagnosis_failed", st.session_state.username, status_code=429)
+                    retry_after = response.headers.get("Retry-After", "a few")
+                    st.markdown(f"""
                     <div class="warning-card">
-                        <h4>⚠️ Important Medical Disclaimer</h4>
-                        <p>This AI analysis is for informational purposes only and should not replace professional medical advice.
-                        Always consult with qualified healthcare providers for proper diagnosis and treatment.</p>
+                        <h3>⏳ Too Many Requests</h3>
+                        <p>You have reached your diagnosis limit for now. Please try again in {retry_after} seconds.</p>
                     </div>
                     """, unsafe_allow_html=True)
-
-                    st.markdown('</div>', unsafe_allow_html=True)
-
-                    # Save to session history
-                    if 'diagnosis_history' not in st.session_state:
-                        st.session_state.diagnosis_history = []
-
-                    diagnosis_record = {
-                        "timestamp": datetime.now().isoformat(),
-                        "user": st.session_state.username,
-                        "input": symptom_input,
-                        "symptom_area": data.get("symptom_area", ""),
-                        "diagnosis": data.get("diagnosis", "")[:200] + "..." if len(data.get("diagnosis", "")) > 200 else data.get("diagnosis", "")
-                    }
-                    st.session_state.diagnosis_history.append(diagnosis_record)
-
                 else:
+                    audit("diagnosis_failed", st.session_state.username, status_code=response.status_code)
                     st.markdown(f"""
                     <div class="warning-card">
                         <h3>❌ Server Error</h3>
@@ -564,6 +369,7 @@ if analyze_button:
                     """, unsafe_allow_html=True)
 
             except requests.exceptions.Timeout:
+                audit("diagnosis_failed", st.session_state.username, reason="timeout")
                 st.markdown("""
                 <div class="warning-card">
                     <h3>⏱️ Request Timeout</h3>
@@ -571,6 +377,7 @@ if analyze_button:
                 </div>
                 """, unsafe_allow_html=True)
             except requests.exceptions.ConnectionError:
+                audit("diagnosis_failed", st.session_state.username, reason="connection_error")
                 st.markdown("""
                 <div class="warning-card">
                     <h3>🔌 Connection Error</h3>
@@ -578,6 +385,7 @@ if analyze_button:
                 </div>
                 """, unsafe_allow_html=True)
             except Exception as e:
+                audit("diagnosis_failed", st.session_state.username, reason=type(e).__name__)
                 st.markdown(f"""
                 <div class="warning-card">
                     <h3>❌ Unexpected Error</h3>
@@ -585,6 +393,216 @@ if analyze_button:
                 </div>
                 """, unsafe_allow_html=True)
 
+
+input_panel()
+
+# Results section
+def render_diagnosis_result(data):
+    """Render a completed diagnosis"""
+    # Results container
+    st.markdown('<div class="results-container">', unsafe_allow_html=True)
+
+    # Success indicator
+    st.markdown("""
+    <div style="text-align: center; margin-bottom: 2rem;">
+        <span class="status-indicator status-success">✅ Analysis Complete</span>
+    </div>
+    """, unsafe_allow_html=True)
+
+    # Results in two columns for better layout
+    result_col1, result_col2 = st.columns([1, 2])
+
+    with result_col1:
+        # Symptom Category
+        st.markdown(f"""
+        <div class="symptom-card">
+            <h3 class="result-title">🎯 Symptom Category</h3>
+            <h2 style="color: #3b82f6; margin: 0; font-size: 1.5rem;">{data.get("symptom_area", "Unknown")}</h2>
+        </div>
+        """, unsafe_allow_html=True)
+
+        # Analysis metadata
+        analyzed_at = datetime.fromtimestamp(data["completed_at"]) if data.get("completed_at") else datetime.now()
+        st.markdown(f"""
+        <div style="background: #f8fafc; padding: 1rem; border-radius: 8px; margin-top: 1rem;">
+            <p style="margin: 0; font-size: 0.875rem; color: #64748b;">
+                <strong>Analyzed:</strong> {analyzed_at.strftime('%Y-%m-%d %H:%M:%S')}<br>
+                <strong>By:</strong> {st.session_state.username} ({user_info.get('role', 'user')})<br>
+                <strong>Input Length:</strong> {len(data.get("input", ""))} characters
+            </p>
+        </div>
+        """, unsafe_allow_html=True)
+
+    with result_col2:
+        # Diagnosis and Recommendations
+        diagnosis_text = data.get("diagnosis", "No diagnosis available")
+        st.markdown(f"""
+        <div class="diagnosis-card">
+            <h3 class="result-title">🩺 AI Diagnosis & Recommendations</h3>
+            <div style="line-height: 1.6; color: #374151;">
+                {diagnosis_text}
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+
+    # Medical disclaimer
+    st.markdown("""
+    <div class="warning-card">
+        <h4>⚠️ Important Medical Disclaimer</h4>
+        <p>This AI analysis is for informational purposes only and should not replace professional medical advice.
+        Always consult with qualified healthcare providers for proper diagnosis and treatment.</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+    st.markdown('</div>', unsafe_allow_html=True)
+
+
+def first_outcome(job_id):
+    """True the first time this session sees a job's final outcome; reruns render it again"""
+    if 'recorded_jobs' not in st.session_state:
+        st.session_state.recorded_jobs = set()
+    if job_id in st.session_state.recorded_jobs:
+        return False
+    st.session_state.recorded_jobs.add(job_id)
+    return True
+
+
+def record_diagnosis(job_id, data, latency_ms):
+    """Persist a finished job and add it to the session ring buffer exactly once"""
+    if not first_outcome(job_id):
+        return
+
+    audit("diagnosis_completed", st.session_state.username,
+          symptom_area=data.get("symptom_area", ""), latency_ms=latency_ms, job_id=job_id)
+
+    # Save to the persistent store; job_id makes this idempotent across reloads
+    row = history_store.add(
+        user=st.session_state.username,
+        input_text=data.get("input", ""),
+        symptom_area=data.get("symptom_area", ""),
+        diagnosis=data.get("diagnosis", ""),
+        latency_ms=latency_ms,
+        job_id=job_id
+    )
+    if row["id"] is not None:
+        st.session_state.diagnosis_history.append(to_session_record(row))
+
+
+def clear_active_job():
+    st.session_state.active_job = None
+    if "job" in st.query_params:
+        del st.query_params["job"]
+
+
+def cancel_active_job():
+    job_id = st.session_state.active_job["job_id"]
+    try:
+        get_http_client().delete(f"{backend_url}/jobs/{job_id}", headers=backend_headers(), timeout=5)
+    except requests.exceptions.RequestException:
+        pass
+    audit("diagnosis_failed", st.session_state.username, reason="cancelled", job_id=job_id)
+    clear_active_job()
+
+
+def job_results_panel():
+    """Poll the active job; only this fragment reruns while the job is pending"""
+    active_job = st.session_state.get("active_job")
+    if not active_job:
+        return
+    job_id = active_job["job_id"]
+
+    # A finished job does not change, so reruns render it without asking the backend
+    job = active_job.get("job")
+    if job is None:
+        try:
+            response = get_http_client().get(f"{backend_url}/jobs/{job_id}", headers=backend_headers(), timeout=5)
+        except requests.exceptions.RequestException:
+            st.markdown("""
+            <div class="warning-card">
+                <h3>🔌 Connection Error</h3>
+                <p>Lost connection to the backend server. Still waiting for your results...</p>
+            </div>
+            """, unsafe_allow_html=True)
+            return
+
+        if response.status_code == 404:
+            clear_active_job()
+            st.info("This analysis is no longer available. Please submit your symptoms again.")
+            return
+        if response.status_code != 200:
+            st.markdown(f"""
+            <div class="warning-card">
+                <h3>❌ Server Error</h3>
+                <p>Error {response.status_code}: {response.text}</p>
+            </div>
+            """, unsafe_allow_html=True)
+            return
+
+        job = response.json()
+        if job["status"] not in ("queued", "running"):
+            active_job["job"] = job
+
+    was_pending = active_job.get("status") in (None, "queued", "running")
+    active_job["status"] = job["status"]
+
+    if job["status"] in ("queued", "running"):
+        # The category is known almost at once; show it while the diagnosis is generated
+        symptom_area = (job.get("partial") or {}).get("symptom_area")
+        if symptom_area:
+            st.markdown(f"""
+            <div class="symptom-card">
+                <h3 class="result-title">🎯 Symptom Category</h3>
+                <h2 style="color: #3b82f6; margin: 0; font-size: 1.5rem;">{symptom_area}</h2>
+            </div>
+            """, unsafe_allow_html=True)
+        # Loading state
+        st.markdown("""
+        <div class="loading-container">
+            <div class="loading-spinner"></div>
+        </div>
+        """, unsafe_allow_html=True)
+        st.markdown('<h3 style="text-align: center; color: #667eea;">🤖 AI is analyzing your symptoms...</h3>', unsafe_allow_html=True)
+        stage = "Waiting in queue" if job["status"] == "queued" else (job.get("stage") or "running").replace("_", " ").title()
+        st.progress(job.get("progress") or 0.0, text=stage)
+        st.button("✖️ Cancel Analysis", key="cancel_job", on_click=cancel_active_job)
+        return
+
+    if job["status"] == "completed":
+        data = dict(job["result"] or {}, completed_at=job["updated_at"])
+        render_diagnosis_result(data)
+        latency_ms = round((job["updated_at"] - job["created_at"]) * 1000, 1)
+        record_diagnosis(job_id, data, latency_ms)
+    elif job["status"] == "failed":
+        if first_outcome(job_id):
+            audit("diagnosis_failed", st.session_state.username, reason="job_failed", job_id=job_id)
+        st.markdown(f"""
+        <div class="warning-card">
+            <h3>❌ Analysis Failed</h3>
+            <p>An error occurred: {job.get("error")}</p>
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.info("Analysis cancelled")
+
+    if was_pending and st.session_state.get("polling_job"):
+        # Full rerun so the fragment is redefined without polling
+        st.rerun()
+
+
+# Resume a job after a page reload
+if not st.session_state.get("active_job") and st.query_params.get("job"):
+    st.session_state.active_job = {"job_id": st.query_params["job"], "status": None}
+
+if st.session_state.get("active_job"):
+    st.session_state.polling_job = st.session_state.active_job.get("status") in (None, "queued", "running")
+    st.fragment(run_every=JOB_POLL_INTERVAL if st.session_state.polling_job else None)(job_results_panel)()
+
+# Case search for clinicians
+if user_info.get('role') in CLINICIAN_ROLES:
+    st.markdown('<br>', unsafe_allow_html=True)
+    with st.expander("🔎 Case Search - Past Diagnoses"):
+        st.fragment(show_case_search)()
+
 # Modern footer
 st.markdown('<br><br>', unsafe_allow_html=True)
 st.markdown("""
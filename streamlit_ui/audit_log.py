@@ -0,0 +1,304 @@
+"""
+Audit logging for Medical Diagnostics Application
+Append-only event log written in batches by a background flusher
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Configuration
+AUDIT_CONFIG = {
+    "log_dir": os.getenv(
+        "AUDIT_LOG_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "audit")
+    ),
+    "flush_interval": float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0")),  # seconds
+    "batch_size": int(os.getenv("AUDIT_BATCH_SIZE", "1000")),
+    "segment_max_bytes": int(os.getenv("AUDIT_SEGMENT_MAX_BYTES", str(8 * 1024 * 1024))),
+    "segment_max_age": int(os.getenv("AUDIT_SEGMENT_MAX_AGE", "86400")),  # 1 day
+    # Segments entirely older than this are deleted; 0 keeps them all
+    "retention_days": float(os.getenv("AUDIT_RETENTION_DAYS", "2190")),  # 6 years
+}
+
+# Known event types, used by the admin panel filter
+EVENT_TYPES = [
+    "login_success",
+    "login_failure",
+    "login_blocked",
+    "account_locked",
+    "logout",
+    "session_expired",
+    "user_registered",
+    "password_reset",
+    "account_unlocked",
+    "user_deleted",
+    "user_data_exported",
+    "settings_saved",
+    "session_data_cleared",
+    "diagnosis_requested",
+    "diagnosis_completed",
+    "diagnosis_failed",
+]
+
+SEGMENT_PREFIX = "audit-"
+SEGMENT_SUFFIX = ".log.gz"
+INDEX_SUFFIX = ".idx"
+
+
+class AuditLog:
+    """
+    Append-only audit log.
+
+    Writers only put a tuple on an in-memory queue. A daemon thread drains the
+    queue every flush interval and appends each batch to the active segment as
+    an independent gzip member, so a batch can be decompressed on its own.
+    Every batch gets one line in the segment's sparse index:
+    ``<ts_min> <ts_max> <offset> <length> <count>``.
+    """
+
+    def __init__(self, log_dir: Optional[str] = None, flush_interval: Optional[float] = None,
+                 batch_size: Optional[int] = None, segment_max_bytes: Optional[int] = None,
+                 segment_max_age: Optional[int] = None, retention_days: Optional[float] = None):
+        self.log_dir = log_dir or AUDIT_CONFIG["log_dir"]
+        self.flush_interval = flush_interval or AUDIT_CONFIG["flush_interval"]
+        self.batch_size = batch_size or AUDIT_CONFIG["batch_size"]
+        self.segment_max_bytes = segment_max_bytes or AUDIT_CONFIG["segment_max_bytes"]
+        self.segment_max_age = segment_max_age or AUDIT_CONFIG["segment_max_age"]
+        self.retention_days = AUDIT_CONFIG["retention_days"] if retention_days is None else retention_days
+
+        self._queue = queue.SimpleQueue()
+        self._segment_path = None
+        self._segment_started = 0.0
+        self._segment_size = 0
+        self._closed = False
+        self.dropped_batches = 0
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="audit-log-flusher", daemon=True)
+        self._thread.start()
+
+    # -- hot path -----------------------------------------------------------
+
+    def log(self, event: str, actor: Optional[str] = None, **details: Any):
+        """Enqueue an audit event without blocking the caller"""
+        self._queue.put((time.time(), event, actor, details))
+
+    # -- flusher ------------------------------------------------------------
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until everything enqueued before this call is on disk"""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Flush pending events and stop the flusher thread"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            waiters = []
+            stop = False
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    # Never let a disk error kill the flusher
+                    self.dropped_batches += 1
+                    print(f"❌ Error writing audit batch: {e}")
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[tuple]):
+        lines = []
+        ts_min = ts_max = batch[0][0]
+        for ts, event, actor, details in batch:
+            ts_min = min(ts_min, ts)
+            ts_max = max(ts_max, ts)
+            record = {"ts": ts, "event": event, "actor": actor, "details": details}
+            lines.append(json.dumps(record, default=str, separators=(",", ":")))
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip member
+        member = compressor.compress(payload) + compressor.flush()
+
+        self._maybe_rotate(ts_min)
+        offset = self._segment_size
+        try:
+            with open(self._segment_path, "ab") as f:
+                f.write(member)
+            with open(self._index_path(self._segment_path), "a") as f:
+                f.write(f"{ts_min:.6f} {ts_max:.6f} {offset} {len(member)} {len(batch)}\n")
+        except OSError:
+            # The segment may end in part of this batch, which would shift the
+            # offsets of later ones; continue in a new segment
+            self._segment_path = None
+            raise
+        self._segment_size += len(member)
+
+    def _maybe_rotate(self, ts: float):
+        expired = ts - self._segment_started >= self.segment_max_age
+        if self._segment_path is None or expired or self._segment_size >= self.segment_max_bytes:
+            # Segment names carry their start time in ms so they sort chronologically
+            self._segment_started = ts
+            name = f"{SEGMENT_PREFIX}{int(ts * 1000):015d}{SEGMENT_SUFFIX}"
+            self._segment_path = os.path.join(self.log_dir, name)
+            # A segment started in the same millisecond, or before a restart, is appended to
+            self._segment_size = os.path.getsize(self._segment_path) if os.path.exists(self._segment_path) else 0
+            self.prune(ts)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Delete segments whose events are all older than the retention period; returns how many"""
+        if not self.retention_days:
+            return 0
+        cutoff = (time.time() if now is None else now) - self.retention_days * 86400
+        segments = self.list_segments()
+        pruned = 0
+        # A segment ends where the next one starts; the newest is never pruned
+        for segment, following in zip(segments, segments[1:]):
+            if following["start"] > cutoff or segment["path"] == self._segment_path:
+                break
+            for path in (segment["path"], self._index_path(segment["path"])):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            pruned += 1
+        return pruned
+
+    # -- queries ------------------------------------------------------------
+
+    @staticmethod
+    def _index_path(segment_path: str) -> str:
+        return segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+    def list_segments(self) -> List[Dict[str, Any]]:
+        """Return segments sorted by start time"""
+        segments = []
+        for name in os.listdir(self.log_dir):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                start_ms = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+                if start_ms.isdigit():
+                    path = os.path.join(self.log_dir, name)
+                    segments.append({"path": path, "start": int(start_ms) / 1000.0,
+                                     "bytes": os.path.getsize(path)})
+        segments.sort(key=lambda s: s["start"])
+        return segments
+
+    def query(self, start: float, end: float, event_types: Optional[Iterable[str]] = None,
+              actor: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return events with start <= ts <= end, oldest first"""
+        results = []
+        for record in self.iter_query(start, end, event_types, actor):
+            results.append(record)
+            if limit and len(results) >= limit:
+                break
+        return results
+
+    def iter_query(self, start: float, end: float, event_types: Optional[Iterable[str]] = None,
+                   actor: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yield events with start <= ts <= end, oldest first.
+
+        Only segments overlapping the range are opened, and inside a segment
+        only batches whose index entry overlaps the range are decompressed,
+        one batch at a time.
+        """
+        wanted = set(event_types) if event_types else None
+        segments = self.list_segments()
+
+        for i, segment in enumerate(segments):
+            if segment["start"] > end:
+                break
+            if i + 1 < len(segments) and segments[i + 1]["start"] < start:
+                continue
+
+            for offset, length in self._batches_in_range(segment["path"], start, end):
+                with open(segment["path"], "rb") as f:
+                    f.seek(offset)
+                    try:
+                        data = zlib.decompress(f.read(length), 31)
+                    except zlib.error:
+                        continue  # batch cut short by a crash or a partial copy
+                for line in data.splitlines():
+                    record = json.loads(line)
+                    if not start <= record["ts"] <= end:
+                        continue
+                    if wanted is not None and record["event"] not in wanted:
+                        continue
+                    if actor and record.get("actor") != actor:
+                        continue
+                    yield record
+
+    def _batches_in_range(self, segment_path: str, start: float, end: float):
+        index_path = self._index_path(segment_path)
+        if not os.path.exists(index_path):
+            return []
+        batches = []
+        with open(index_path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 5:
+                    continue  # torn write at the tail of the index
+                ts_min, ts_max = float(parts[0]), float(parts[1])
+                if ts_max >= start and ts_min <= end:
+                    batches.append((int(parts[2]), int(parts[3])))
+        return batches
+
+
+_audit_log = None
+_audit_log_lock = threading.Lock()
+
+
+def get_audit_log() -> AuditLog:
+    """Return the process-wide audit log, starting it on first use"""
+    global _audit_log
+    if _audit_log is None:
+        with _audit_log_lock:
+            if _audit_log is None:
+                _audit_log = AuditLog()
+                atexit.register(_audit_log.close)
+    return _audit_log
+
+
+def audit(event: str, actor: Optional[str] = None, **details: Any):
+    """Record an audit event; never raises into the caller"""
+    try:
+        get_audit_log().log(event, actor, **details)
+    except Exception:
+        pass
@@ -5,19 +5,36 @@ Supports multiple authentication methods: Local, Firebase, and OAuth
 
 import streamlit as st
 import hashlib
+import hmac
 import json
 import os
+import secrets
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
+from urllib.parse import urlencode
+import jwt
 import requests
+from audit_log import audit
+from auth_config import APP_CONFIG, FIREBASE_CONFIG, get_auth_provider_config, get_configured_providers
+from http_client import get_http_client
+from token_cache import get_jwks, get_token_cache, verify_jwt
 
 # Configuration
 AUTH_CONFIG = {
     "session_timeout": 3600,  # 1 hour in seconds
     "max_login_attempts": 3,
     "lockout_duration": 300,  # 5 minutes in seconds
+    "provider_timeout": 10,  # seconds for Firebase/OAuth calls
+    "oauth_state_max_age": 600,  # seconds a sign-in redirect may take
 }
 
+# Providers whose sign-in ends with an ID token that can be verified
+OIDC_PROVIDERS = ("firebase", "google")
+
+class AuthConfigError(Exception):
+    """Raised when a provider is configured too incompletely to verify its tokens"""
+
 class AuthManager:
     def __init__(self, auth_type="local"):
         """
@@ -141,6 +158,7 @@ class AuthManager:
     def authenticate_local(self, username: str, password: str) -> bool:
         """Authenticate user with local credentials"""
         if self.is_account_locked(username):
+            audit("login_blocked", username, reason="account_locked")
             st.error(f"Account locked. Try again later.")
             return False
         
@@ -153,18 +171,23 @@ class AuthManager:
                 users[username]["last_login"] = datetime.now().isoformat()
                 users[username]["locked_until"] = None
                 self.save_users(users)
+                audit("login_success", username, role=users[username].get("role", "user"))
                 return True
             else:
                 # Increment failed attempts
                 users[username]["login_attempts"] += 1
+                audit("login_failure", username, attempts=users[username]["login_attempts"])
                 if users[username]["login_attempts"] >= AUTH_CONFIG["max_login_attempts"]:
                     lock_time = datetime.now() + timedelta(seconds=AUTH_CONFIG["lockout_duration"])
                     users[username]["locked_until"] = lock_time.isoformat()
+                    audit("account_locked", username, locked_until=users[username]["locked_until"])
                     st.error(f"Too many failed attempts. Account locked for {AUTH_CONFIG['lockout_duration']//60} minutes.")
                 else:
                     remaining = AUTH_CONFIG["max_login_attempts"] - users[username]["login_attempts"]
                     st.error(f"Invalid credentials. {remaining} attempts remaining.")
                 self.save_users(users)
+        else:
+            audit("login_failure", username, reason="unknown_user")
         return False
     
     def register_user(self, username: str, password: str, email: str, role: str = "user") -> bool:
@@ -183,6 +206,7 @@ class AuthManager:
             "locked_until": None
         }
         self.save_users(users)
+        audit("user_registered", username, role=role)
         return True
     
     def get_user_info(self, username: str) -> Optional[Dict]:
@@ -199,7 +223,12 @@ class FirebaseAuth:
         config should contain: api_key, auth_domain, project_id
         """
         self.config = config
-        self.auth_url = f"https://identitytoolkit.googleapis.com/v1/accounts"
+        self.auth_url = config.get("identity_url") or "https://identitytoolkit.googleapis.com/v1/accounts"
+        self.token_url = config.get("token_url") or "https://securetoken.googleapis.com/v1/token"
+        issuer = config.get("issuer") or (
+            f"https://securetoken.google.com/{config['project_id']}" if config.get("project_id") else ""
+        )
+        self.issuers = [name.strip() for name in issuer.split(",") if name.strip()]
     
     def sign_up(self, email: str, password: str) -> Dict[str, Any]:
         """Sign up new user with Firebase"""
@@ -209,8 +238,8 @@ class FirebaseAuth:
             "password": password,
             "returnSecureToken": True
         }
-        response = requests.post(url, json=data)
-        return response.json()
+        response = get_http_client().post(url, json=data, timeout=AUTH_CONFIG["provider_timeout"])
+        return self._cache_tokens(response.json())
     
     def sign_in(self, email: str, password: str) -> Dict[str, Any]:
         """Sign in user with Firebase"""
@@ -220,8 +249,41 @@ class FirebaseAuth:
             "password": password,
             "returnSecureToken": True
         }
-        response = requests.post(url, json=data)
-        return response.json()
+        response = get_http_client().post(url, json=data, timeout=AUTH_CONFIG["provider_timeout"])
+        return self._cache_tokens(response.json())
+
+    def _cache_tokens(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        if result.get("idToken") and result.get("localId"):
+            get_token_cache().store(
+                f"firebase:{result['localId']}",
+                {"id_token": result["idToken"], "refresh_token": result.get("refreshToken")},
+                result.get("expiresIn", 3600)
+            )
+        return result
+
+    def refresh_id_token(self, refresh_token: str) -> Dict[str, Any]:
+        """Trade a refresh token for a new ID token"""
+        response = get_http_client().post(
+            f"{self.token_url}?key={self.config['api_key']}",
+            data={"grant_type": "refresh_token", "refresh_token": refresh_token},
+            timeout=AUTH_CONFIG["provider_timeout"]
+        )
+        response.raise_for_status()
+        result = response.json()
+        return {"id_token": result["id_token"], "refresh_token": result.get("refresh_token"),
+                "expires_in": result.get("expires_in", 3600)}
+
+    def get_id_token(self, uid: str) -> Optional[str]:
+        """The user's cached ID token, refreshed shortly before it expires"""
+        entry = get_token_cache().get(f"firebase:{uid}", self.refresh_id_token)
+        return entry["id_token"] if entry else None
+
+    def verify_id_token(self, id_token: str) -> Dict[str, Any]:
+        """Claims of a Firebase ID token, checked locally against the cached signing keys"""
+        if not (self.config.get("jwks_url") and self.config.get("project_id") and self.issuers):
+            raise AuthConfigError("Firebase needs FIREBASE_PROJECT_ID and FIREBASE_JWKS_URL to verify ID tokens")
+        return verify_jwt(id_token, get_jwks(self.config["jwks_url"]),
+                          audience=self.config["project_id"], issuers=self.issuers)
 
 class OAuthProvider:
     """OAuth 2.0 Authentication provider"""
@@ -229,11 +291,18 @@ class OAuthProvider:
     def __init__(self, provider_config: Dict[str, str]):
         """
         Initialize OAuth provider
-        provider_config should contain: client_id, client_secret, redirect_uri, auth_url, token_url
+        provider_config should contain: client_id, client_secret, redirect_uri, auth_url, token_url,
+        and for OpenID Connect also jwks_url and issuer (comma-separated if several)
         """
         self.config = provider_config
+        self.issuers = [name.strip() for name in (provider_config.get("issuer") or "").split(",") if name.strip()]
+        if provider_config.get("jwks_url") and not self.issuers:
+            raise AuthConfigError(
+                f"OAuth client {provider_config.get('client_id')!r} has a jwks_url but no issuer; "
+                "set its *_ISSUER variable so ID tokens can be verified"
+            )
     
-    def get_auth_url(self) -> str:
+    def get_auth_url(self, state: Optional[str] = None) -> str:
         """Get OAuth authorization URL"""
         params = {
             "client_id": self.config["client_id"],
@@ -241,11 +310,17 @@ class OAuthProvider:
             "response_type": "code",
             "scope": "openid email profile"
         }
-        query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-        return f"{self.config['auth_url']}?{query_string}"
+        if state:
+            params["state"] = state
+        return f"{self.config['auth_url']}?{urlencode(params)}"
     
     def exchange_code_for_token(self, code: str) -> Dict[str, Any]:
-        """Exchange authorization code for access token"""
+        """Exchange authorization code for access token
+        
+        With an OpenID Connect provider the ID token is verified locally and
+        its claims added as "claims"; the tokens are then cached under the
+        subject, see get_access_token.
+        """
         data = {
             "client_id": self.config["client_id"],
             "client_secret": self.config["client_secret"],
@@ -253,9 +328,125 @@ class OAuthProvider:
             "grant_type": "authorization_code",
             "redirect_uri": self.config["redirect_uri"]
         }
-        response = requests.post(self.config["token_url"], data=data)
+        response = get_http_client().post(self.config["token_url"], data=data,
+                                          headers={"Accept": "application/json"},
+                                          timeout=AUTH_CONFIG["provider_timeout"])
+        result = response.json()
+        if result.get("id_token") and self.config.get("jwks_url"):
+            result["claims"] = self.verify_id_token(result["id_token"])
+            get_token_cache().store(
+                f"{self.config['client_id']}:{result['claims']['sub']}",
+                {name: result.get(name) for name in ("access_token", "id_token", "refresh_token")},
+                result.get("expires_in", 3600)
+            )
+        return result
+
+    def refresh_access_token(self, refresh_token: str) -> Dict[str, Any]:
+        """Trade a refresh token for a new access token"""
+        data = {
+            "client_id": self.config["client_id"],
+            "client_secret": self.config["client_secret"],
+            "refresh_token": refresh_token,
+            "grant_type": "refresh_token"
+        }
+        response = get_http_client().post(self.config["token_url"], data=data,
+                                          headers={"Accept": "application/json"},
+                                          timeout=AUTH_CONFIG["provider_timeout"])
+        response.raise_for_status()
         return response.json()
 
+    def get_access_token(self, subject: str) -> Optional[str]:
+        """The subject's cached access token, refreshed shortly before it expires"""
+        entry = get_token_cache().get(f"{self.config['client_id']}:{subject}", self.refresh_access_token)
+        return entry.get("access_token") if entry else None
+
+    def verify_id_token(self, id_token: str) -> Dict[str, Any]:
+        """Claims of an OpenID Connect ID token, checked locally against the cached signing keys"""
+        if not self.config.get("jwks_url"):
+            raise AuthConfigError(f"OAuth client {self.config.get('client_id')!r} has no jwks_url to verify ID tokens")
+        return verify_jwt(id_token, get_jwks(self.config["jwks_url"]),
+                          audience=self.config["client_id"], issuers=self.issuers)
+
+def get_provider(provider: str):
+    """FirebaseAuth or OAuthProvider for a configured provider name"""
+    config = get_auth_provider_config(provider)
+    return FirebaseAuth(config) if provider == "firebase" else OAuthProvider(config)
+
+def oauth_state(provider: str) -> str:
+    """Signed state for a sign-in redirect; it survives the new session the redirect opens"""
+    payload = f"{provider}.{int(time.time())}.{secrets.token_urlsafe(16)}"
+    signature = hmac.new(APP_CONFIG["secret_key"].encode(), payload.encode(), hashlib.sha256).hexdigest()
+    return f"{payload}.{signature}"
+
+def check_oauth_state(state: str) -> Optional[str]:
+    """The provider a state was issued for, or None if it is forged or stale"""
+    payload, _, signature = (state or "").rpartition(".")
+    expected = hmac.new(APP_CONFIG["secret_key"].encode(), payload.encode(), hashlib.sha256).hexdigest()
+    if not payload or not hmac.compare_digest(signature, expected):
+        return None
+    provider, issued, _ = payload.split(".", 2)
+    if time.time() - int(issued) > AUTH_CONFIG["oauth_state_max_age"]:
+        return None
+    return provider
+
+def provider_login(provider: str, claims: Dict[str, Any]) -> bool:
+    """Log in the user named by verified ID token claims"""
+    username = claims.get("email") or f"{provider}:{claims['sub']}"
+    if APP_CONFIG["require_email_verification"] and not claims.get("email_verified"):
+        audit("login_failure", username, provider=provider, reason="email_not_verified")
+        st.error("Please verify your email address before signing in.")
+        return False
+    user_info = {
+        "email": claims.get("email", "N/A"),
+        "role": APP_CONFIG["default_role"],
+        "provider": provider,
+        "subject": claims["sub"],
+        "last_login": datetime.now().isoformat(),
+    }
+    login(username, user_info)
+    audit("login_success", username, role=user_info["role"], provider=provider)
+    return True
+
+def provider_session_alive(user_info: Dict) -> bool:
+    """False once a provider sign-in's tokens have expired and could not be refreshed"""
+    provider = (user_info or {}).get("provider")
+    if not provider:
+        return True
+    if provider == "firebase":
+        return get_provider(provider).get_id_token(user_info["subject"]) is not None
+    return get_provider(provider).get_access_token(user_info["subject"]) is not None
+
+def handle_oauth_callback():
+    """Finish a provider sign-in when the provider redirects back with a code"""
+    code, state = st.query_params.get("code"), st.query_params.get("state")
+    if not code:
+        return
+    for name in ("code", "state", "scope", "authuser", "prompt"):
+        if name in st.query_params:
+            del st.query_params[name]
+    provider = check_oauth_state(state)
+    if provider not in OIDC_PROVIDERS:
+        audit("login_failure", None, reason="bad_oauth_state")
+        st.error("Sign-in link expired or invalid. Please try again.")
+        return
+    try:
+        result = get_provider(provider).exchange_code_for_token(code)
+        if "claims" not in result:
+            raise jwt.InvalidTokenError(result.get("error_description") or result.get("error") or "no ID token")
+    except AuthConfigError as e:
+        print(f"❌ {provider} sign-in misconfigured: {e}")
+        st.error(f"{provider.title()} sign-in is misconfigured. Contact administrator.")
+        return
+    except requests.exceptions.RequestException as e:
+        st.error(f"{provider.title()} is unreachable: {e}")
+        return
+    except (jwt.InvalidTokenError, jwt.PyJWKClientError) as e:
+        audit("login_failure", None, provider=provider, reason="invalid_id_token")
+        st.error(f"{provider.title()} sign-in failed: {e}")
+        return
+    if provider_login(provider, result["claims"]):
+        st.rerun()
+
 def init_session_state():
     """Initialize session state variables"""
     if "authenticated" not in st.session_state:
@@ -272,9 +463,15 @@ def check_session_timeout():
     if st.session_state.authenticated and st.session_state.login_time:
         login_time = datetime.fromisoformat(st.session_state.login_time)
         if datetime.now() - login_time > timedelta(seconds=AUTH_CONFIG["session_timeout"]):
+            audit("session_expired", st.session_state.username)
             logout()
             st.warning("Session expired. Please log in again.")
             return True
+        if not provider_session_alive(st.session_state.user_info):
+            audit("session_expired", st.session_state.username, reason="provider_token_expired")
+            logout()
+            st.warning("Your sign-in has expired. Please log in again.")
+            return True
     return False
 
 def login(username: str, user_info: Dict):
@@ -286,6 +483,8 @@ def login(username: str, user_info: Dict):
 
 def logout():
     """Log out user"""
+    if st.session_state.get("authenticated"):
+        audit("logout", st.session_state.username)
     st.session_state.authenticated = False
     st.session_state.username = None
     st.session_state.user_info = None
@@ -305,9 +504,35 @@ def require_auth(func):
         return func(*args, **kwargs)
     return wrapper
 
+def firebase_sign_in(email: str, password: str):
+    """Sign in with Firebase email and password, logging in on a verified ID token"""
+    try:
+        firebase = get_provider("firebase")
+        result = firebase.sign_in(email, password)
+        if "idToken" not in result:
+            audit("login_failure", email, provider="firebase",
+                  reason=result.get("error", {}).get("message", "no_id_token"))
+            st.error("Invalid credentials.")
+            return
+        claims = firebase.verify_id_token(result["idToken"])
+    except AuthConfigError as e:
+        print(f"❌ Firebase sign-in misconfigured: {e}")
+        st.error("Firebase sign-in is misconfigured. Contact administrator.")
+        return
+    except requests.exceptions.RequestException as e:
+        st.error(f"Firebase is unreachable: {e}")
+        return
+    except (jwt.InvalidTokenError, jwt.PyJWKClientError) as e:
+        audit("login_failure", email, provider="firebase", reason="invalid_id_token")
+        st.error(f"Firebase sign-in failed: {e}")
+        return
+    if provider_login("firebase", claims):
+        st.rerun()
+
 def show_login_page():
     """Display login/register page"""
     st.title("🔐 Medical Diagnostics - Authentication")
+    handle_oauth_callback()
     
     tab1, tab2, tab3 = st.tabs(["Login", "Register", "OAuth"])
     
@@ -349,19 +574,28 @@ def show_login_page():
     
     with tab3:
         st.subheader("OAuth Login")
-        st.info("OAuth integration requires additional setup. Contact administrator.")
-        
-        # Example OAuth buttons (would need actual implementation)
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            if st.button("🔵 Google"):
-                st.info("Google OAuth not configured")
-        with col2:
-            if st.button("📘 Facebook"):
-                st.info("Facebook OAuth not configured")
-        with col3:
-            if st.button("🐙 GitHub"):
-                st.info("GitHub OAuth not configured")
+        configured = dict(get_configured_providers())
+        if not configured:
+            st.info("OAuth integration requires additional setup. Contact administrator.")
+
+        if "firebase" in configured:
+            with st.form("firebase_login_form"):
+                email = st.text_input("Email", key="firebase_email")
+                firebase_password = st.text_input("Password", type="password", key="firebase_password")
+                if st.form_submit_button(f"Sign in with {configured['firebase']}"):
+                    firebase_sign_in(email, firebase_password)
+
+        for provider, label in configured.items():
+            if provider == "firebase":
+                continue
+            if provider in OIDC_PROVIDERS:
+                try:
+                    st.link_button(label, get_provider(provider).get_auth_url(oauth_state(provider)))
+                except AuthConfigError as e:
+                    print(f"❌ {provider} sign-in misconfigured: {e}")
+                    st.error(f"{label} sign-in is misconfigured. Contact administrator.")
+            elif st.button(label):
+                st.info(f"{label} sign-in is not available: it issues no ID token to verify")
     
     # Default credentials info
     with st.expander("ℹ️ Default Credentials"):
@@ -16,7 +16,15 @@ FIREBASE_CONFIG = {
     "project_id": os.getenv("FIREBASE_PROJECT_ID", ""),
     "storage_bucket": os.getenv("FIREBASE_STORAGE_BUCKET", ""),
     "messaging_sender_id": os.getenv("FIREBASE_MESSAGING_SENDER_ID", ""),
-    "app_id": os.getenv("FIREBASE_APP_ID", "")
+    "app_id": os.getenv("FIREBASE_APP_ID", ""),
+    # Endpoints are overridable to run against a local stand-in identity provider
+    "identity_url": os.getenv("FIREBASE_IDENTITY_URL", "https://identitytoolkit.googleapis.com/v1/accounts"),
+    "token_url": os.getenv("FIREBASE_TOKEN_URL", "https://securetoken.googleapis.com/v1/token"),
+    "jwks_url": os.getenv(
+        "FIREBASE_JWKS_URL",
+        "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+    ),
+    "issuer": os.getenv("FIREBASE_ISSUER", ""),  # defaults to https://securetoken.google.com/<project_id>
 }
 
 # Google OAuth Configuration
@@ -24,9 +32,11 @@ GOOGLE_OAUTH_CONFIG = {
     "client_id": os.getenv("GOOGLE_CLIENT_ID", ""),
     "client_secret": os.getenv("GOOGLE_CLIENT_SECRET", ""),
     "redirect_uri": os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8501/auth/callback"),
-    "auth_url": "https://accounts.google.com/o/oauth2/auth",
-    "token_url": "https://oauth2.googleapis.com/token",
-    "userinfo_url": "https://www.googleapis.com/oauth2/v2/userinfo"
+    "auth_url": os.getenv("GOOGLE_AUTH_URL", "https://accounts.google.com/o/oauth2/auth"),
+    "token_url": os.getenv("GOOGLE_TOKEN_URL", "https://oauth2.googleapis.com/token"),
+    "userinfo_url": "https://www.googleapis.com/oauth2/v2/userinfo",
+    "jwks_url": os.getenv("GOOGLE_JWKS_URL", "https://www.googleapis.com/oauth2/v3/certs"),
+    "issuer": os.getenv("GOOGLE_ISSUER", "https://accounts.google.com,accounts.google.com"),  # comma-separated
 }
 
 # GitHub OAuth Configuration
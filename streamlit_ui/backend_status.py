@@ -0,0 +1,74 @@
+"""
+Backend status polling for Medical Diagnostics Application
+One background thread per process keeps a cached health status that every session reads
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict
+
+import streamlit as st
+
+from http_client import HTTPClient, get_http_client
+
+# Configuration
+STATUS_CONFIG = {
+    "interval": float(os.getenv("STATUS_POLL_INTERVAL", "10")),  # seconds between checks
+    "timeout": float(os.getenv("STATUS_POLL_TIMEOUT", "3")),
+}
+
+
+class BackendStatusPoller:
+    """Polls the backend health endpoint on its own interval and caches the result"""
+
+    def __init__(self, backend_url: str, client: HTTPClient, interval: float = None,
+                 timeout: float = None):
+        self.backend_url = backend_url
+        self.client = client
+        self.interval = interval or STATUS_CONFIG["interval"]
+        self.timeout = timeout or STATUS_CONFIG["timeout"]
+        # Replaced as a whole on every poll, so readers never see a half-written status
+        self._status = {"state": "unknown", "status_code": None, "latency_ms": None,
+                        "error": None, "checked_at": None}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="backend-status-poller", daemon=True)
+        self._thread.start()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the cached status plus its age in seconds; never touches the network"""
+        status = dict(self._status)
+        checked_at = status["checked_at"]
+        status["age"] = time.time() - checked_at if checked_at else None
+        return status
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            self._poll()
+            if self._stop.wait(self.interval):
+                return
+
+    def _poll(self):
+        started = time.perf_counter()
+        try:
+            response = self.client.get(f"{self.backend_url}/", timeout=self.timeout)
+            state = "online" if response.status_code == 200 else "error"
+            status_code, error = response.status_code, None
+        except Exception as e:
+            state, status_code, error = "offline", None, type(e).__name__
+        self._status = {
+            "state": state,
+            "status_code": status_code,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "error": error,
+            "checked_at": time.time(),
+        }
+
+
+@st.cache_resource
+def get_backend_status_poller(backend_url: str) -> BackendStatusPoller:
+    """Return the process-wide poller for a backend URL, shared by all sessions"""
+    return BackendStatusPoller(backend_url, get_http_client())
@@ -0,0 +1,117 @@
+"""Case search benchmark: HistoryStore.search latency on a large history database
+
+Builds a synthetic history (500 users, 12 categories, two years of records)
+once and keeps it for later runs, then times searches for common, rare,
+phrase, prefix and NOT queries under the filter combinations the case search
+page sends, plus keyset paging to page 5. Run it from streamlit_ui/:
+
+    python bench_case_search.py
+    python bench_case_search.py --rows 200000 --repeat 10 --db /tmp/history-200k.db
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from history_store import HistoryStore
+
+SYMPTOMS = (
+    "pain fever cough headache nausea fatigue chest dizziness rash swelling shortness breath "
+    "sore throat back abdominal vomiting diarrhea joint muscle weakness numbness blurred vision "
+    "palpitations anxiety insomnia itching bleeding bruising weight loss appetite thirst urination"
+).split()
+DIAGNOSES = (
+    "possible viral infection consider rest fluids monitor temperature consult physician if symptoms "
+    "persist antipyretics hydration bacterial antibiotics referral cardiology neurology imaging blood "
+    "test recommended follow up urgent evaluation likely benign migraine tension asthma allergy "
+    "dermatitis gastritis reflux hypertension arrhythmia angina anemia diabetes thyroid"
+).split()
+# Rare terms, each in a few dozen records
+RARE = [f"term{i}" for i in range(20000)]
+CATEGORIES = ["Cardiology", "Neurology", "Dermatology", "Gastroenterology", "Pulmonology", "Orthopedics",
+              "Endocrinology", "ENT", "Ophthalmology", "Psychiatry", "Urology", "General"]
+USERS = [f"user{i}@example.com" for i in range(500)]
+
+QUERIES = ["fever", "term123", '"chest pain"', "dizz*", "fever NOT cough"]
+
+TARGET_MS = 20
+
+
+def text(pool, words):
+    return " ".join(random.choice(RARE) if random.random() < 0.1 else random.choice(pool) for _ in range(words))
+
+
+def build(path, rows):
+    """Fill a new database at path with rows records, oldest first"""
+    store = HistoryStore(path)
+    conn = store._conn()
+    now = time.time()
+    span = 2 * 365 * 86400
+    started = time.perf_counter()
+    conn.execute("BEGIN")
+    for start in range(0, rows, 10000):
+        conn.executemany(
+            "INSERT INTO diagnoses (ts, user, input, symptom_area, diagnosis, latency_ms) VALUES (?, ?, ?, ?, ?, ?)",
+            [(now - span + span * i / rows, random.choice(USERS), text(SYMPTOMS, 12), random.choice(CATEGORIES),
+              text(DIAGNOSES, 40), 100.0) for i in range(start, min(start + 10000, rows))]
+        )
+    conn.execute("COMMIT")
+    conn.execute("INSERT INTO diagnoses_fts (diagnoses_fts) VALUES ('optimize')")
+    print(f"Built {rows:,} records in {time.perf_counter() - started:.0f}s at {path}")
+    return store
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def fifth_page(store, query, filters):
+    after = None
+    for _ in range(5):
+        found = store.search(query, after=after, **filters)
+        after = found["next"]
+        if after is None:
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", help="database to use, built if missing (default: a temp file per --rows)")
+    args = parser.parse_args()
+
+    random.seed(7)
+    path = args.db or os.path.join(tempfile.gettempdir(), f"bench-history-{args.rows}.db")
+    store = HistoryStore(path) if os.path.exists(path) else build(path, args.rows)
+    print(f"{store.count():,} records")
+
+    now = time.time()
+    month = {"start": now - 30 * 86400, "end": now}
+    filter_sets = {
+        "none": {},
+        "30 days": month,
+        "user": {"user": USERS[7]},
+        "user, 30 days": {"user": USERS[7], **month},
+        "category, 30 days": {"category": CATEGORIES[0], **month},
+    }
+
+    print(f"\n{'query':<18}{'filters':<20}{'page 1 ms':>10}{'page 5 ms':>10}")
+    for query in QUERIES:
+        for name, filters in filter_sets.items():
+            first = timed(lambda: store.search(query, **filters), args.repeat)
+            fifth = timed(lambda: fifth_page(store, query, filters), args.repeat) / 5
+            mark = "✅" if first <= TARGET_MS else "❌"
+            print(f"{query:<18}{name:<20}{first:>10.1f}{fifth:>10.1f}  {mark}")
+    print(f"\n✅/❌: page 1 within {TARGET_MS} ms; page 5 is the mean per page while paging to it")
+
+
+if __name__ == "__main__":
+    main()
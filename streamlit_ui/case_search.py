@@ -0,0 +1,95 @@
+"""
+Case Search for Medical Diagnostics Application
+Full-text search over past diagnoses for clinicians
+"""
+
+import streamlit as st
+from datetime import datetime, timedelta, time as dt_time
+from history_store import get_history_store
+
+CLINICIAN_ROLES = ("doctor", "admin")
+
+
+def set_case_page(page: int, cursor=None):
+    # A callback, so the page changes without a second rerun. case_cursors
+    # holds the cursor each visited page starts after, for going back.
+    cursors = st.session_state.setdefault("case_cursors", [None])
+    if page > len(cursors):
+        cursors.append(cursor)
+    del cursors[page:]
+    st.session_state.case_page = page
+
+
+def show_case_search():
+    """Display the case search interface"""
+    if not st.session_state.authenticated or st.session_state.user_info.get('role') not in CLINICIAN_ROLES:
+        st.error("🚫 Access Denied: Clinician privileges required")
+        return
+
+    history_store = get_history_store()
+
+    with st.form("case_search_form"):
+        query = st.text_input(
+            "Search",
+            placeholder='e.g. "chest pain" dizz*   or   fever NOT cough',
+            key="case_query"
+        )
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            today = datetime.now().date()
+            date_range = st.date_input("Date Range", value=(today - timedelta(days=30), today),
+                                       max_value=today, key="case_range")
+        with col2:
+            category = st.selectbox("Category", ["All"] + history_store.categories(), key="case_category")
+        with col3:
+            user = st.text_input("User", key="case_user")
+        if st.form_submit_button("🔎 Search"):
+            set_case_page(1)
+
+    if not query.strip():
+        st.caption('Use "quotes" for phrases, a trailing * for prefixes, and AND / OR / NOT.')
+        return
+
+    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+        start_date, end_date = date_range
+    else:
+        start_date = end_date = date_range[0] if isinstance(date_range, (list, tuple)) else date_range
+
+    cursors = st.session_state.get("case_cursors", [None])
+    page = min(st.session_state.get("case_page", 1), len(cursors))
+    found = history_store.search(
+        query,
+        user=user.strip() or None,
+        category=None if category == "All" else category,
+        start=datetime.combine(start_date, dt_time.min).timestamp(),
+        end=datetime.combine(end_date, dt_time.max).timestamp(),
+        after=cursors[page - 1]
+    )
+
+    if not found["results"]:
+        st.info("No matching cases")
+        return
+
+    for row in found["results"]:
+        timestamp = datetime.fromtimestamp(row["ts"]).strftime("%Y-%m-%d %H:%M")
+        with st.container(border=True):
+            st.markdown(f"**{row['symptom_area']}** · {timestamp} · {row['user']}")
+            st.markdown(row["snippet"])
+            with st.expander("Full case"):
+                st.write(f"**Symptoms:** {row['input']}")
+                st.write(f"**Diagnosis:** {row['diagnosis']}")
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if page > 1:
+            st.button("◀ Previous", key="case_prev", on_click=set_case_page, args=(page - 1,))
+    with col2:
+        st.caption(f"Page {page}")
+    with col3:
+        if found["has_more"]:
+            st.button("Next ▶", key="case_next", on_click=set_case_page, args=(page + 1, found["next"]))
+
+
+if __name__ == "__main__":
+    # This allows running case search as a standalone page
+    show_case_search()
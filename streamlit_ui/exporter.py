@@ -0,0 +1,234 @@
+"""
+Data export for Medical Diagnostics Application
+Streams users and diagnosis history as NDJSON, CSV or Parquet in fixed-size chunks
+
+Used by the admin panel and from the command line:
+    python exporter.py users --format csv --output users.csv
+    python exporter.py diagnoses --format parquet --output diagnoses.parquet --days 30
+"""
+
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+EXPORT_FORMATS = {
+    "ndjson": {"extension": "ndjson", "mime": "application/x-ndjson"},
+    "csv": {"extension": "csv", "mime": "text/csv"},
+    "parquet": {"extension": "parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+DEFAULT_CHUNK_SIZE = 5000
+# Largest export the admin panel hands to the browser, which holds it in memory;
+# bigger ones are left to this command line tool
+DOWNLOAD_MAX_BYTES = int(os.getenv("EXPORT_DOWNLOAD_MAX_MB", "50")) * 1024 * 1024
+
+# Only these fields leave the system; everything else (password hashes,
+# lockout state, free-text symptoms) is stripped.
+USER_FIELDS: List[Tuple[str, str]] = [
+    ("username", "string"),
+    ("email", "string"),
+    ("role", "string"),
+    ("created_at", "string"),
+    ("last_login", "string"),
+]
+
+DIAGNOSIS_FIELDS: List[Tuple[str, str]] = [
+    ("timestamp", "string"),
+    ("user", "string"),
+    ("symptom_area", "string"),
+    ("latency_ms", "float"),
+]
+
+DATASETS = {
+    "users": USER_FIELDS,
+    "diagnoses": DIAGNOSIS_FIELDS,
+}
+
+
+def iter_user_rows(users: Dict[str, Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Yield export rows for a users mapping, keeping only allowlisted fields"""
+    for username, info in users.items():
+        yield {
+            "username": username,
+            "email": info.get("email"),
+            "role": info.get("role"),
+            "created_at": info.get("created_at"),
+            "last_login": info.get("last_login"),
+        }
+
+
+def iter_diagnosis_rows(store, start: float = 0.0, end: float = None) -> Iterator[Dict[str, Any]]:
+    """Yield export rows for stored diagnoses, reading the history store in chunks"""
+    for record in store.iter_range(start, end):
+        yield {
+            "timestamp": datetime.fromtimestamp(record["ts"]).isoformat(),
+            "user": record["user"],
+            "symptom_area": record["symptom_area"],
+            "latency_ms": record["latency_ms"],
+        }
+
+
+def _chunks(rows: Iterable[Dict[str, Any]], chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_ndjson(rows, fields, out: BinaryIO, chunk_size: int) -> int:
+    names = [name for name, _ in fields]
+    count = 0
+    for chunk in _chunks(rows, chunk_size):
+        lines = [json.dumps({name: row.get(name) for name in names}, default=str) for row in chunk]
+        out.write(("\n".join(lines) + "\n").encode("utf-8"))
+        count += len(chunk)
+    return count
+
+
+def _write_csv(rows, fields, out: BinaryIO, chunk_size: int) -> int:
+    names = [name for name, _ in fields]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=names, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        out.write(buffer.getvalue().encode("utf-8"))
+        buffer.seek(0)
+        buffer.truncate()
+        count += len(chunk)
+    out.write(buffer.getvalue().encode("utf-8"))
+    return count
+
+
+def _write_parquet(rows, fields, out: BinaryIO, chunk_size: int) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    types = {"string": pa.string(), "float": pa.float64(), "int": pa.int64()}
+    schema = pa.schema([(name, types[kind]) for name, kind in fields])
+    count = 0
+    # Each chunk becomes one row group, so only one chunk is ever in memory
+    with pq.ParquetWriter(out, schema, compression="snappy") as writer:
+        for chunk in _chunks(rows, chunk_size):
+            columns = {name: [row.get(name) for row in chunk] for name, _ in fields}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            count += len(chunk)
+    return count
+
+
+WRITERS = {
+    "ndjson": _write_ndjson,
+    "csv": _write_csv,
+    "parquet": _write_parquet,
+}
+
+
+def export_rows(rows: Iterable[Dict[str, Any]], fields: List[Tuple[str, str]], fmt: str,
+                out: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Stream rows to a binary file object and return the number of rows written"""
+    if fmt not in WRITERS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return WRITERS[fmt](rows, fields, out, chunk_size)
+
+
+def export_to_tempfile(dataset: str, rows: Iterable[Dict[str, Any]], fmt: str,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[str, int]:
+    """Stream an export into a temporary file and return (path, row_count)"""
+    suffix = "." + EXPORT_FORMATS[fmt]["extension"]
+    fd, path = tempfile.mkstemp(prefix=f"{dataset}_export_", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            count = export_rows(rows, DATASETS[dataset], fmt, out, chunk_size)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
+
+
+def export_for_download(dataset: str, rows: Iterable[Dict[str, Any]], fmt: str,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE, max_bytes: int = None) -> Tuple[str, int, int]:
+    """Stream an export into a temporary file for a browser download; returns (path, row_count, size)
+
+    Over max_bytes (default DOWNLOAD_MAX_BYTES) the file is deleted and path
+    is None: the download button would hold all of it in memory.
+    """
+    path, count = export_to_tempfile(dataset, rows, fmt, chunk_size)
+    size = os.path.getsize(path)
+    if size > (DOWNLOAD_MAX_BYTES if max_bytes is None else max_bytes):
+        os.remove(path)
+        return None, count, size
+    return path, count, size
+
+
+def available_formats() -> List[str]:
+    """Export formats whose writer can run here; Parquet needs the optional pyarrow"""
+    return [fmt for fmt in EXPORT_FORMATS if fmt != "parquet" or importlib.util.find_spec("pyarrow")]
+
+
+def cli_command(dataset: str, fmt: str) -> str:
+    """The command line that writes the same export on the server"""
+    return f"python exporter.py {dataset} --format {fmt} --output {export_file_name(dataset, fmt)}"
+
+
+def export_file_name(dataset: str, fmt: str) -> str:
+    """Build a timestamped download file name"""
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f"{dataset}_{stamp}.{EXPORT_FORMATS[fmt]['extension']}"
+
+
+def _load_users_file(path: str) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    """Command line entry point"""
+    default_users_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "users.json")
+
+    parser = argparse.ArgumentParser(description="Export users or diagnosis history")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="ndjson")
+    parser.add_argument("--output", "-o", help="Output file (default: stdout)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--users-file", default=default_users_file)
+    parser.add_argument("--history-db", default=None, help="History database (default: HISTORY_DB_PATH)")
+    parser.add_argument("--days", type=int, default=None,
+                        help="Only export diagnoses from the last N days")
+    args = parser.parse_args(argv)
+
+    if args.dataset == "users":
+        rows = iter_user_rows(_load_users_file(args.users_file))
+    else:
+        start = time.time() - args.days * 86400 if args.days else 0.0
+        from history_store import HistoryStore
+        rows = iter_diagnosis_rows(HistoryStore(args.history_db), start=start)
+
+    if args.output:
+        with open(args.output, "wb") as out:
+            count = export_rows(rows, DATASETS[args.dataset], args.format, out, args.chunk_size)
+    else:
+        count = export_rows(rows, DATASETS[args.dataset], args.format, sys.stdout.buffer, args.chunk_size)
+        sys.stdout.buffer.flush()
+    print(f"✅ Exported {count} {args.dataset} rows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
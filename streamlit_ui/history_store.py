@@ -0,0 +1,361 @@
+"""
+Diagnosis history storage for Medical Diagnostics Application
+Persistent SQLite store keyed by user and time, with keyset-paginated reads
+and an FTS5 full-text index for case search
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import streamlit as st
+
+# Configuration
+HISTORY_CONFIG = {
+    "db_path": os.getenv(
+        "HISTORY_DB_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "history.db")
+    ),
+    "session_buffer": int(os.getenv("HISTORY_SESSION_BUFFER", "20")),  # records kept in session state
+    "page_size": int(os.getenv("HISTORY_PAGE_SIZE", "10")),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS diagnoses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    user TEXT NOT NULL,
+    input TEXT NOT NULL,
+    symptom_area TEXT,
+    diagnosis TEXT,
+    latency_ms REAL,
+    job_id TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS diagnoses_user_ts ON diagnoses (user, ts DESC, id DESC);
+CREATE INDEX IF NOT EXISTS diagnoses_ts ON diagnoses (ts DESC, id DESC);
+"""
+
+# Filter terms indexed next to the text, so user and category filters are
+# part of the MATCH and FTS5 ranks only the rows that pass them. Values are
+# hex-encoded into single tokens whatever characters they contain.
+_FTS_TAGS = "'u' || hex({row}.user) || ' c' || hex(coalesce({row}.symptom_area, ''))"
+
+# External-content FTS5 table kept in sync by triggers, so indexing is
+# incremental and the text is not stored twice. The content is a view that
+# adds the tags column to diagnoses.
+_FTS_SCHEMA = f"""
+CREATE VIEW IF NOT EXISTS diagnoses_fts_content AS
+    SELECT id, input, symptom_area, diagnosis, {_FTS_TAGS.format(row='diagnoses')} AS tags FROM diagnoses;
+CREATE VIRTUAL TABLE diagnoses_fts USING fts5(
+    input, symptom_area, diagnosis, tags,
+    content='diagnoses_fts_content', content_rowid='id',
+    tokenize='porter unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS diagnoses_fts_insert AFTER INSERT ON diagnoses BEGIN
+    INSERT INTO diagnoses_fts (rowid, input, symptom_area, diagnosis, tags)
+    VALUES (new.id, new.input, new.symptom_area, new.diagnosis, {_FTS_TAGS.format(row='new')});
+END;
+CREATE TRIGGER IF NOT EXISTS diagnoses_fts_delete AFTER DELETE ON diagnoses BEGIN
+    INSERT INTO diagnoses_fts (diagnoses_fts, rowid, input, symptom_area, diagnosis, tags)
+    VALUES ('delete', old.id, old.input, old.symptom_area, old.diagnosis, {_FTS_TAGS.format(row='old')});
+END;
+CREATE TRIGGER IF NOT EXISTS diagnoses_fts_update AFTER UPDATE ON diagnoses BEGIN
+    INSERT INTO diagnoses_fts (diagnoses_fts, rowid, input, symptom_area, diagnosis, tags)
+    VALUES ('delete', old.id, old.input, old.symptom_area, old.diagnosis, {_FTS_TAGS.format(row='old')});
+    INSERT INTO diagnoses_fts (rowid, input, symptom_area, diagnosis, tags)
+    VALUES (new.id, new.input, new.symptom_area, new.diagnosis, {_FTS_TAGS.format(row='new')});
+END;
+"""
+
+# Replaces an index from before the tags column
+_FTS_DROP = """
+DROP TRIGGER IF EXISTS diagnoses_fts_insert;
+DROP TRIGGER IF EXISTS diagnoses_fts_delete;
+DROP TRIGGER IF EXISTS diagnoses_fts_update;
+DROP TABLE IF EXISTS diagnoses_fts;
+DROP VIEW IF EXISTS diagnoses_fts_content;
+"""
+
+# Column weights for bm25(): symptom input, category, diagnosis text, tags
+_FTS_WEIGHTS = (3.0, 2.0, 1.0, 0.0)
+
+# Only these columns are searched by the user's query
+_FTS_TEXT_COLUMNS = "{input symptom_area diagnosis}"
+
+_FTS_OPERATORS = {"AND", "OR", "NOT"}
+
+# (ts, id) of the last row on a page; pass it back to get the next older page
+Cursor = Tuple[float, int]
+
+# (rank, id) of the last search result on a page; pass it back to get the next page
+SearchCursor = Tuple[float, int]
+
+
+class HistoryStore:
+    """Diagnosis records in a local SQLite database, one connection per thread"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or HISTORY_CONFIG["db_path"]
+        self._local = threading.local()
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        self._ensure_fts(conn)
+
+    @staticmethod
+    def _ensure_fts(conn: sqlite3.Connection):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'diagnoses_fts'"
+        ).fetchone()
+        if exists:
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(diagnoses_fts)")}
+            if "tags" in columns:
+                return
+            print("🔄 Rebuilding the case search index with filter tags")
+            conn.executescript(_FTS_DROP)
+        conn.executescript(_FTS_SCHEMA)
+        # Index records written before the FTS table (or its current schema) existed
+        conn.execute("INSERT INTO diagnoses_fts (diagnoses_fts) VALUES ('rebuild')")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def add(self, user: str, input_text: str, symptom_area: str, diagnosis: str,
+            latency_ms: Optional[float] = None, job_id: Optional[str] = None,
+            ts: Optional[float] = None) -> Dict[str, Any]:
+        """Store a diagnosis; a repeated job_id is ignored so reloads don't duplicate it"""
+        record = {
+            "ts": ts or time.time(),
+            "user": user,
+            "input": input_text,
+            "symptom_area": symptom_area,
+            "diagnosis": diagnosis,
+            "latency_ms": latency_ms,
+            "job_id": job_id,
+        }
+        cursor = self._conn().execute(
+            "INSERT OR IGNORE INTO diagnoses (ts, user, input, symptom_area, diagnosis, latency_ms, job_id) "
+            "VALUES (:ts, :user, :input, :symptom_area, :diagnosis, :latency_ms, :job_id)",
+            record
+        )
+        record["id"] = cursor.lastrowid if cursor.rowcount else None
+        return record
+
+    def recent(self, user: Optional[str] = None, before: Optional[Cursor] = None,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Newest-first page of records, for one user or all users"""
+        limit = limit or HISTORY_CONFIG["page_size"]
+        clauses, params = [], []
+        if user is not None:
+            clauses.append("user = ?")
+            params.append(user)
+        if before is not None:
+            clauses.append("(ts < ? OR (ts = ? AND id < ?))")
+            params.extend([before[0], before[0], before[1]])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT * FROM diagnoses {where} ORDER BY ts DESC, id DESC LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_range(self, start: float = 0.0, end: Optional[float] = None,
+                   chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Yield all records in [start, end], oldest first, reading one chunk at a time"""
+        end = end or time.time()
+        last = (start, -1)
+        while True:
+            rows = self._conn().execute(
+                "SELECT * FROM diagnoses WHERE (ts > ? OR (ts = ? AND id > ?)) AND ts <= ? "
+                "ORDER BY ts, id LIMIT ?",
+                (last[0], last[0], last[1], end, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last = (rows[-1]["ts"], rows[-1]["id"])
+
+    def count(self, user: Optional[str] = None) -> int:
+        if user is None:
+            return self._conn().execute("SELECT COUNT(*) FROM diagnoses").fetchone()[0]
+        return self._conn().execute("SELECT COUNT(*) FROM diagnoses WHERE user = ?", (user,)).fetchone()[0]
+
+    def counts_by_user(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT user, COUNT(*) FROM diagnoses GROUP BY user").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def categories(self) -> List[str]:
+        rows = self._conn().execute(
+            "SELECT DISTINCT symptom_area FROM diagnoses WHERE symptom_area IS NOT NULL ORDER BY 1"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def search(self, query: str, user: Optional[str] = None, category: Optional[str] = None,
+               start: Optional[float] = None, end: Optional[float] = None,
+               after: Optional[SearchCursor] = None, page_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Ranked full-text search over symptom input, category and diagnosis.
+
+        Supports "quoted phrases", prefix* terms and AND/OR/NOT; bare terms
+        are ANDed. User and category filters are tags in the MATCH and the
+        date range bounds the rowids searched, so bm25 ranks only rows that
+        can pass the filters. Results are ordered by (rank, id); pass the
+        returned next cursor as after for the following page.
+        """
+        page_size = page_size or HISTORY_CONFIG["page_size"]
+        text = build_match_expression(query)
+        if not text:
+            return {"results": [], "has_more": False, "next": None}
+        conn = self._conn()
+
+        match = f"{_FTS_TEXT_COLUMNS} : ({text})"
+        fts_clauses, fts_params = ["diagnoses_fts MATCH ?"], []
+        filters, filter_params = [], []
+        if user:
+            match += f' AND tags : "u{_tag(user)}"'
+            filters.append("d.user = ?")
+            filter_params.append(user)
+        if category:
+            match += f' AND tags : "c{_tag(category)}"'
+            filters.append("d.symptom_area = ?")
+            filter_params.append(category)
+        if start is not None or end is not None:
+            # Search only the ids of records in the date range, found on the ts
+            # index; the exact ts filter stays, as ids need not follow ts
+            start = start if start is not None else float("-inf")
+            end = end if end is not None else float("inf")
+            low, high = conn.execute(
+                "SELECT min(id), max(id) FROM diagnoses WHERE ts BETWEEN ? AND ?", (start, end)
+            ).fetchone()
+            if low is None:
+                return {"results": [], "has_more": False, "next": None}
+            fts_clauses.append("rowid BETWEEN ? AND ?")
+            fts_params.extend([low, high])
+            filters.append("d.ts BETWEEN ? AND ?")
+            filter_params.extend([start, end])
+        if after is not None:
+            filters.append("(m.rank, m.id) > (?, ?)")
+            filter_params.extend(after)
+
+        # Ranks and ids only, joined to the records just for the exact filters
+        join = "JOIN diagnoses d ON d.id = m.id" if user or category or start is not None else ""
+        ranked = conn.execute(
+            "SELECT m.id, m.rank FROM ("
+            "SELECT rowid AS id, bm25(diagnoses_fts, ?, ?, ?, ?) AS rank FROM diagnoses_fts "
+            f"WHERE {' AND '.join(fts_clauses)}) m {join} "
+            f"{'WHERE ' + ' AND '.join(filters) if filters else ''} "
+            "ORDER BY m.rank, m.id LIMIT ?",
+            list(_FTS_WEIGHTS) + [match] + fts_params + filter_params + [page_size + 1]
+        ).fetchall()
+        page = ranked[:page_size]
+        if not page:
+            return {"results": [], "has_more": False, "next": None}
+
+        ids = [row["id"] for row in page]
+        placeholders = ",".join("?" * len(ids))
+        records = {
+            row["id"]: dict(row)
+            for row in conn.execute(f"SELECT * FROM diagnoses WHERE id IN ({placeholders})", ids)
+        }
+        # The filtered match and the page's id range keep the scan short;
+        # "+rowid IN" is checked by SQLite, as FTS5 would rerun the whole query
+        # once per listed id. Each text column is snipped and the one with the
+        # most hits kept, so the tags never show. A NULL column snips to NULL.
+        snippet = "snippet(diagnoses_fts, {}, '**', '**', ' … ', 12)"
+        snippets = {
+            row[0]: max((fragment or "" for fragment in row[1:]), key=lambda fragment: fragment.count("**"))
+            for row in conn.execute(
+                f"SELECT rowid, {', '.join(snippet.format(column) for column in range(3))} "
+                "FROM diagnoses_fts WHERE diagnoses_fts MATCH ? AND rowid BETWEEN ? AND ? "
+                f"AND +rowid IN ({placeholders})",
+                [match, min(ids), max(ids)] + ids
+            )
+        }
+
+        results = [
+            dict(records[row["id"]], rank=row["rank"], snippet=snippets.get(row["id"], ""))
+            for row in page
+        ]
+        has_more = len(ranked) > page_size
+        return {
+            "results": results,
+            "has_more": has_more,
+            "next": (page[-1]["rank"], page[-1]["id"]) if has_more else None,
+        }
+
+
+def _tag(value: str) -> str:
+    """Token form of a filter value in the tags column, as SQLite's hex() writes it"""
+    return value.encode("utf-8").hex().upper()
+
+
+def build_match_expression(query: str) -> str:
+    """Turn user input into a safe FTS5 MATCH expression"""
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query or ""):
+        if phrase:
+            terms = phrase.replace('"', " ").split()
+            if terms:
+                parts.append('"' + " ".join(terms) + '"')
+        elif word in _FTS_OPERATORS:
+            if parts and parts[-1] not in _FTS_OPERATORS:
+                parts.append(word)
+        else:
+            prefix = word.endswith("*")
+            token = re.sub(r"[^\w]", " ", word.rstrip("*")).strip()
+            if token:
+                parts.append('"' + token + '"' + ("*" if prefix else ""))
+    while parts and parts[-1] in _FTS_OPERATORS:
+        parts.pop()
+    return " ".join(parts)
+
+
+def page_cursor(records: List[Dict[str, Any]]) -> Optional[Cursor]:
+    """Cursor for the page after the given newest-first records"""
+    if not records:
+        return None
+    return (records[-1]["ts"], records[-1]["id"])
+
+
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    """Return the process-wide history store"""
+    return HistoryStore()
+
+
+def to_session_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact form of a stored record kept in the session ring buffer"""
+    diagnosis = row.get("diagnosis") or ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(row["ts"])),
+        "user": row["user"],
+        "input": row["input"],
+        "symptom_area": row.get("symptom_area") or "",
+        "diagnosis": diagnosis[:200] + "..." if len(diagnosis) > 200 else diagnosis
+    }
+
+
+def init_session_history(username: str):
+    """Load the user's newest records into a bounded ring buffer once per login"""
+    if st.session_state.get("history_user") == username and "diagnosis_history" in st.session_state:
+        return
+    recent = get_history_store().recent(user=username, limit=HISTORY_CONFIG["session_buffer"])
+    st.session_state.diagnosis_history = deque(
+        (to_session_record(row) for row in reversed(recent)),
+        maxlen=HISTORY_CONFIG["session_buffer"]
+    )
+    st.session_state.history_user = username
+    st.session_state.history_cursors = [None]
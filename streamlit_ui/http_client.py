@@ -0,0 +1,145 @@
+"""
+Shared HTTP client for Medical Diagnostics Application
+One pooled, keep-alive session per process for every outbound call the UI makes
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Configuration
+HTTP_CONFIG = {
+    "pool_connections": int(os.getenv("HTTP_POOL_CONNECTIONS", "10")),  # hosts kept pooled
+    "pool_maxsize": int(os.getenv("HTTP_POOL_MAXSIZE", "20")),  # connections per host
+    "pool_timeout": float(os.getenv("HTTP_POOL_TIMEOUT", "10")),  # seconds to wait for a free connection
+    "connect_timeout": float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05")),
+    "read_timeout": float(os.getenv("API_TIMEOUT", "30")),
+    "retries": int(os.getenv("HTTP_RETRIES", "2")),
+    "backoff_factor": float(os.getenv("HTTP_BACKOFF_FACTOR", "0.3")),
+}
+
+# Only these are retried after the request was sent; POST is retried on connect errors only
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class HTTPClient:
+    """requests.Session with bounded keep-alive pools, default timeouts and retries"""
+
+    def __init__(self, pool_connections: int = None, pool_maxsize: int = None,
+                 connect_timeout: float = None, read_timeout: float = None,
+                 retries: int = None, backoff_factor: float = None, pool_timeout: float = None):
+        self.pool_maxsize = pool_maxsize or HTTP_CONFIG["pool_maxsize"]
+        self.pool_timeout = HTTP_CONFIG["pool_timeout"] if pool_timeout is None else pool_timeout
+        self.connect_timeout = connect_timeout or HTTP_CONFIG["connect_timeout"]
+        self.read_timeout = read_timeout or HTTP_CONFIG["read_timeout"]
+        retries = HTTP_CONFIG["retries"] if retries is None else retries
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor or HTTP_CONFIG["backoff_factor"],
+            status_forcelist=(502, 503, 504),
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False,
+        )
+        # pool_maxsize is a hard per-host limit through the per-host semaphores
+        # below: urllib3's own pool_block would wait for a free connection
+        # forever, since requests never passes it a pool timeout
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections or HTTP_CONFIG["pool_connections"],
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+            pool_block=False,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+
+        self._lock = threading.Lock()
+        self._slots = {}  # scheme://host:port -> BoundedSemaphore of pool_maxsize
+        self._requests = 0
+        self._errors = 0
+        self._pool_timeouts = 0
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None,
+                **kwargs: Any) -> requests.Response:
+        """Send a request; timeout defaults to (connect_timeout, read_timeout)"""
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (min(self.connect_timeout, timeout), timeout)
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            self._requests += 1
+            slots = self._slots.get(host)
+            if slots is None:
+                slots = self._slots[host] = threading.BoundedSemaphore(self.pool_maxsize)
+        if not slots.acquire(timeout=self.pool_timeout):
+            with self._lock:
+                self._errors += 1
+                self._pool_timeouts += 1
+            raise requests.exceptions.ConnectTimeout(
+                f"No free connection to {host} within {self.pool_timeout}s ({self.pool_maxsize} in use)"
+            )
+        try:
+            return self.session.request(method, url, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            slots.release()
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Connection reuse statistics across all pooled hosts"""
+        pools = self._adapter.poolmanager.pools
+        hosts = {}
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            hosts[host] = {
+                "requests": pool.num_requests,
+                "connections_opened": pool.num_connections,
+            }
+        sent = sum(h["requests"] for h in hosts.values())
+        opened = sum(h["connections_opened"] for h in hosts.values())
+        return {
+            "calls": self._requests,
+            "errors": self._errors,
+            "pool_timeouts": self._pool_timeouts,
+            "requests_sent": sent,
+            "connections_opened": opened,
+            "connection_reuse_ratio": round(1 - opened / sent, 3) if sent else 0.0,
+            "hosts": hosts,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+@st.cache_resource
+def get_http_client() -> HTTPClient:
+    """Return the process-wide HTTP client, created once per Streamlit server"""
+    return HTTPClient()
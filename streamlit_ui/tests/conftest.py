@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The UI is flat modules imported from streamlit_ui itself
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
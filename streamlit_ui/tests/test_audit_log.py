@@ -0,0 +1,101 @@
+import gzip
+
+import pytest
+
+from audit_log import AuditLog
+
+
+@pytest.fixture
+def make_log(tmp_path):
+    logs = []
+
+    def make(**kwargs):
+        log = AuditLog(str(tmp_path), flush_interval=0.05, **kwargs)
+        logs.append(log)
+        return log
+
+    yield make
+    for log in logs:
+        log.close()
+
+
+def write(log, *events):
+    """Write one batch of (ts, event, actor) as the flusher would"""
+    log._write_batch([(ts, event, actor, {"n": i}) for i, (ts, event, actor) in enumerate(events)])
+
+
+def test_segments_roll_over_by_size_and_age(make_log):
+    log = make_log(segment_max_bytes=10_000, segment_max_age=100)
+    write(log, (1000, "login_success", "alice"))
+    write(log, (1050, "logout", "alice"))
+    write(log, (1100, "login_success", "bob"))  # 100 s after the segment started
+    log.segment_max_bytes = 1
+    write(log, (1101, "logout", "bob"))  # the last segment is over 1 byte
+    segments = log.list_segments()
+    assert [segment["start"] for segment in segments] == [1000, 1100, 1101]
+    # Each segment is a plain multi-member gzip file
+    with gzip.open(segments[0]["path"], "rt") as f:
+        assert [line.count('"event"') for line in f] == [1, 1]
+
+
+def test_events_logged_live_are_read_back(make_log):
+    log = make_log()
+    log.log("login_success", "alice", provider="google")
+    assert log.flush()
+    [record] = log.query(0, float("inf"))
+    assert (record["event"], record["actor"], record["details"]) == ("login_success", "alice", {"provider": "google"})
+
+
+def test_query_reads_only_batches_in_range(make_log):
+    log = make_log(segment_max_age=100)
+    write(log, (1000, "login_success", "alice"), (1010, "logout", "alice"))
+    write(log, (1020, "login_failure", "bob"))
+    write(log, (1200, "diagnosis_requested", "alice"), (1210, "diagnosis_completed", "alice"))
+    # Corrupt the first batch: a query that the index keeps away from it still works
+    first = log.list_segments()[0]["path"]
+    with open(first, "r+b") as f:
+        f.write(b"\0" * 20)
+
+    assert [r["ts"] for r in log.query(1015, 1205)] == [1020, 1200]
+    assert [r["event"] for r in log.query(1015, 1300, event_types=["diagnosis_completed"])] == ["diagnosis_completed"]
+    assert [r["ts"] for r in log.query(1015, 1300, actor="alice")] == [1200, 1210]
+    assert log.query(1030, 1190) == []
+    assert [r["ts"] for r in log.query(1200, 1300, limit=1)] == [1200]
+
+
+def test_torn_last_segment_is_read_up_to_the_tear(make_log, tmp_path):
+    log = make_log()
+    write(log, (1000, "login_success", "alice"))
+    write(log, (1001, "logout", "alice"))
+    path = log.list_segments()[0]["path"]
+    # A crash cut the last batch short and left half an index line
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 5)
+    with open(log._index_path(path), "a") as f:
+        f.write("1002.0 1002.0 9")
+    assert [r["event"] for r in log.query(0, 2000)] == ["login_success"]
+
+    # After a restart, new batches go to a new segment and stay readable
+    log.close()
+    restarted = make_log()
+    write(restarted, (1003, "login_success", "bob"))
+    assert [r["actor"] for r in restarted.query(0, 2000)] == ["alice", "bob"]
+
+
+def test_segment_started_in_the_same_millisecond_is_appended_to(make_log):
+    log = make_log(segment_max_bytes=1)
+    write(log, (1000.0001, "login_success", "alice"))
+    write(log, (1000.0002, "logout", "alice"))
+    assert len(log.list_segments()) == 1
+    assert [r["event"] for r in log.query(0, 2000)] == ["login_success", "logout"]
+
+
+def test_segments_past_retention_are_pruned_on_rotation(make_log):
+    log = make_log(segment_max_age=86400, retention_days=2)
+    write(log, (0, "login_success", "alice"))
+    write(log, (86400, "logout", "alice"))
+    write(log, (2 * 86400, "login_success", "bob"))
+    # The first segment ended when the second began, more than two days before this one
+    write(log, (3 * 86400 + 1, "logout", "bob"))
+    assert [segment["start"] for segment in log.list_segments()] == [86400, 2 * 86400, 3 * 86400 + 1]
+    assert [r["ts"] for r in log.query(0, 4 * 86400)] == [86400, 2 * 86400, 3 * 86400 + 1]
@@ -0,0 +1,104 @@
+import csv
+import importlib.util
+import io
+import json
+import os
+import tempfile
+
+import pytest
+
+import exporter
+from history_store import HistoryStore
+
+USERS = {
+    f"user{i}": {
+        "email": f"user{i}@example.com", "role": "doctor" if i % 2 else "user",
+        "created_at": "2024-01-01T00:00:00", "last_login": None,
+        "password_hash": "$2b$12$secret", "salt": "pepper", "failed_attempts": 3, "locked_until": 99.0,
+    }
+    for i in range(5)
+}
+
+
+def export(rows, fmt, chunk_size=2):
+    out = io.BytesIO()
+    count = exporter.export_rows(rows, exporter.USER_FIELDS, fmt, out, chunk_size)
+    return count, out.getvalue()
+
+
+def test_parquet_is_offered_only_with_pyarrow(monkeypatch):
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None if name == "pyarrow" else find_spec(name))
+    assert exporter.available_formats() == ["ndjson", "csv"]
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: object())
+    assert exporter.available_formats() == ["ndjson", "csv", "parquet"]
+
+
+def test_cli_command_names_dataset_and_format():
+    command = exporter.cli_command("diagnoses", "csv")
+    assert command.startswith("python exporter.py diagnoses --format csv --output diagnoses_")
+    assert command.endswith(".csv")
+
+
+def test_chunks_split_rows_at_the_chunk_size():
+    assert [len(chunk) for chunk in exporter._chunks(range(5), 2)] == [2, 2, 1]
+    assert [len(chunk) for chunk in exporter._chunks(range(4), 2)] == [2, 2]
+    assert list(exporter._chunks([], 2)) == []
+
+
+@pytest.mark.parametrize("users", [4, 5])
+def test_ndjson_reads_back_across_chunks(users):
+    rows = list(exporter.iter_user_rows(dict(list(USERS.items())[:users])))
+    count, data = export(iter(rows), "ndjson")
+    assert count == users
+    assert [json.loads(line) for line in data.decode().splitlines()] == rows
+
+
+@pytest.mark.parametrize("users", [4, 5])
+def test_csv_reads_back_across_chunks_with_one_header(users):
+    rows = list(exporter.iter_user_rows(dict(list(USERS.items())[:users])))
+    count, data = export(iter(rows), "csv")
+    read = list(csv.DictReader(io.StringIO(data.decode())))
+    assert count == len(read) == users
+    assert [row["username"] for row in read] == [row["username"] for row in rows]
+    assert data.decode().count("username,email") == 1
+
+
+def test_parquet_reads_back_one_row_group_per_chunk():
+    pq = pytest.importorskip("pyarrow.parquet")
+    rows = list(exporter.iter_user_rows(USERS))
+    count, data = export(iter(rows), "parquet")
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert count == 5 and parquet.metadata.num_row_groups == 3
+    assert parquet.read().to_pylist() == rows
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_sensitive_user_fields_are_stripped(fmt):
+    _, data = export(exporter.iter_user_rows(USERS), fmt)
+    for secret in ("password_hash", "$2b$12$secret", "pepper", "failed_attempts", "locked_until"):
+        assert secret.encode() not in data
+
+
+def test_diagnosis_rows_leave_out_the_free_text(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.add("alice", "chest pain at night", "Cardiology", "Possible angina", latency_ms=120.0, ts=100)
+    store.add("bob", "itchy rash", None, None, ts=200)
+    rows = list(exporter.iter_diagnosis_rows(store))
+    assert [(row["user"], row["symptom_area"]) for row in rows] == [("alice", "Cardiology"), ("bob", None)]
+    assert set(rows[0]) == {name for name, _ in exporter.DIAGNOSIS_FIELDS}
+    out = io.BytesIO()
+    exporter.export_rows(iter(rows), exporter.DIAGNOSIS_FIELDS, "csv", out)
+    assert b"chest pain" not in out.getvalue() and b"angina" not in out.getvalue()
+
+
+def test_download_over_the_cap_is_refused_and_deleted(monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    path, count, size = exporter.export_for_download("users", exporter.iter_user_rows(USERS), "ndjson")
+    assert count == 5 and os.path.getsize(path) == size < exporter.DOWNLOAD_MAX_BYTES
+    os.remove(path)
+
+    monkeypatch.setattr(exporter, "DOWNLOAD_MAX_BYTES", size - 1)
+    path, count, too_big = exporter.export_for_download("users", exporter.iter_user_rows(USERS), "ndjson")
+    assert path is None and count == 5 and too_big == size
+    assert os.listdir(tmp_path) == []
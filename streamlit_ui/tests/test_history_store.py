@@ -0,0 +1,90 @@
+import sqlite3
+
+import pytest
+
+from history_store import HistoryStore, build_match_expression
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("chest pain", '"chest" "pain"'),
+    ('"shortness of breath" fever', '"shortness of breath" "fever"'),
+    ("cardi*", '"cardi"*'),
+    ("rash OR itch", '"rash" OR "itch"'),
+    ("cough NOT smoker", '"cough" NOT "smoker"'),
+    # Operators need a term on both sides; stray ones are dropped
+    ("OR headache AND", '"headache"'),
+    ("fever AND OR chills", '"fever" AND "chills"'),
+    # FTS syntax in user input is neutralised, not passed through
+    ("col:value (x) ^y", '"col value" "x" "y"'),
+    ('he said "', '"he" "said"'),
+    ("", ""),
+    ("  ***  ", ""),
+])
+def test_build_match_expression(query, expected):
+    assert build_match_expression(query) == expected
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.add("alice", "sharp chest pain on exertion", "Cardiology", "Possible angina", ts=100)
+    store.add("alice", "itchy rash on arms", "Dermatology", "Contact dermatitis", ts=200)
+    store.add("bob", "chest tightness and cough", "Pulmonology", "Possible asthma; cardiac causes excluded", ts=300)
+    return store
+
+
+def test_search_ranks_and_filters(store):
+    assert [r["user"] for r in store.search("chest")["results"]] == ["alice", "bob"]
+    assert [r["symptom_area"] for r in store.search("chest", user="bob")["results"]] == ["Pulmonology"]
+    assert store.search("chest", category="Dermatology")["results"] == []
+    assert [r["ts"] for r in store.search("chest", start=150)["results"]] == [300]
+    assert [r["ts"] for r in store.search("cardi*")["results"]] == [100, 300]
+
+
+def test_search_pages(store):
+    first = store.search("on OR chest", page_size=2)
+    assert len(first["results"]) == 2 and first["has_more"]
+    second = store.search("on OR chest", after=first["next"], page_size=2)
+    assert len(second["results"]) == 1 and not second["has_more"] and second["next"] is None
+    ranked = [(r["rank"], r["id"]) for r in first["results"] + second["results"]]
+    assert ranked == sorted(ranked) and len(set(ranked)) == 3
+
+
+def test_search_snippets_come_from_the_text(store):
+    store.add("carol", "chest pain at rest", "Cardiology", "Unstable angina, refer urgently", ts=400)
+    [row] = store.search("angina", user="carol", category="Cardiology")["results"]
+    assert "**angina**" in row["snippet"].lower()
+    assert "636172" not in row["snippet"].lower()  # hex of "car", from the tags
+
+
+def test_search_hits_with_empty_columns(store):
+    # add() takes None for the category and diagnosis, and snippet() then gives NULL
+    store.add("alice", "chest pain and dizziness", None, None, ts=400)
+    found = store.search("dizziness")["results"]
+    assert [(r["symptom_area"], r["diagnosis"]) for r in found] == [(None, None)]
+    assert "**dizziness**" in found[0]["snippet"]
+    assert len(store.search("chest")["results"]) == 3
+
+
+def test_filters_need_exact_values(store):
+    # Tags are whole tokens, so a filter value never matches by prefix
+    store.add("alice.smith", "chest pain", "Cardiology", "Angina", ts=400)
+    assert {r["user"] for r in store.search("chest", user="alice")["results"]} == {"alice"}
+    assert store.search("chest", start=1000, end=2000)["results"] == []
+
+
+def test_old_index_is_rebuilt_with_tags(tmp_path):
+    path = str(tmp_path / "history.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE diagnoses (id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, user TEXT NOT NULL,
+            input TEXT NOT NULL, symptom_area TEXT, diagnosis TEXT, latency_ms REAL, job_id TEXT UNIQUE);
+        CREATE VIRTUAL TABLE diagnoses_fts USING fts5(input, symptom_area, diagnosis,
+            content='diagnoses', content_rowid='id');
+        INSERT INTO diagnoses (ts, user, input, symptom_area, diagnosis) VALUES (1, 'dave', 'knee pain', 'Orthopedics', 'Sprain');
+    """)
+    conn.close()
+    store = HistoryStore(path)
+    assert [r["user"] for r in store.search("knee", user="dave", category="Orthopedics")["results"]] == ["dave"]
+    store.add("erin", "knee swelling", "Orthopedics", "Effusion", ts=2)
+    assert [r["user"] for r in store.search("knee", user="erin")["results"]] == ["erin"]
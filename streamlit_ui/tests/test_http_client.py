@@ -0,0 +1,44 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from http_client import HTTPClient
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(0.5)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_wait_for_a_free_connection_is_bounded(server):
+    client = HTTPClient(pool_maxsize=1, pool_timeout=0.1, retries=0)
+    first = threading.Thread(target=client.get, args=(server,))
+    first.start()
+    time.sleep(0.1)  # the first call holds the only connection
+
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.Timeout):
+        client.get(server)
+    assert time.monotonic() - started < 0.4
+    first.join()
+    # The connection is free again
+    assert client.get(server).text == "ok"
+    assert client.metrics()["pool_timeouts"] == 1
@@ -0,0 +1,236 @@
+"""ID token verification and token refresh against a local stand-in identity provider"""
+
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import auth
+from auth import AuthConfigError, FirebaseAuth, OAuthProvider
+from token_cache import JWKSCache, TokenCache, verify_jwt
+
+AUDIENCE = "test-client"
+ISSUER = "https://idp.test"
+
+
+def b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+class SigningKey:
+    def __init__(self, kid):
+        self.kid = kid
+        self.private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def jwk(self):
+        data = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.private.public_key()))
+        return {**data, "kid": self.kid, "use": "sig", "alg": "RS256"}
+
+    def sign(self, **claims):
+        now = int(time.time())
+        claims = {"iss": ISSUER, "aud": AUDIENCE, "sub": "user-1", "iat": now, "exp": now + 3600, **claims}
+        return jwt.encode(claims, self.private, algorithm="RS256", headers={"kid": self.kid})
+
+
+class IdentityProvider:
+    """Serves a JWKS and an OAuth token endpoint, counting the calls to each"""
+
+    def __init__(self):
+        self.keys = [SigningKey("key-1")]
+        self.jwks_fetches = 0
+        self.token_requests = []
+        self.max_age = 3600
+        idp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                idp.jwks_fetches += 1
+                self.reply({"keys": [key.jwk() for key in idp.keys]},
+                           {"Cache-Control": f"public, max-age={idp.max_age}"})
+
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                form = {name: values[0] for name, values in form.items()}
+                idp.token_requests.append(form)
+                count = len(idp.token_requests)
+                self.reply({
+                    # Firebase's refresh endpoint spells it id_token too
+                    "id_token": idp.keys[-1].sign(email="user@example.com"),
+                    "access_token": f"access-{count}",
+                    "refresh_token": f"refresh-{count}",
+                    "expires_in": 3600,
+                })
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def rotate(self):
+        self.keys.append(SigningKey(f"key-{len(self.keys) + 1}"))
+        self.keys.pop(0)
+
+
+@pytest.fixture
+def idp():
+    idp = IdentityProvider()
+    yield idp
+    idp.server.shutdown()
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    """Fresh token and key caches per test instead of the process-wide ones"""
+    tokens, jwks = TokenCache(refresh_margin=300), {}
+    monkeypatch.setattr(auth, "get_token_cache", lambda: tokens)
+    monkeypatch.setattr(auth, "get_jwks", lambda url: jwks.setdefault(url, JWKSCache(url, min_refetch=60)))
+    return tokens
+
+
+def oauth(idp, **overrides):
+    return OAuthProvider({
+        "client_id": AUDIENCE, "client_secret": "secret", "redirect_uri": "http://localhost:8501/",
+        "auth_url": f"{idp.url}/authorize", "token_url": f"{idp.url}/token",
+        "jwks_url": f"{idp.url}/jwks", "issuer": ISSUER, **overrides
+    })
+
+
+def test_valid_token_is_verified_with_one_key_fetch(idp):
+    jwks = JWKSCache(f"{idp.url}/jwks")
+    for _ in range(3):
+        claims = verify_jwt(idp.keys[0].sign(), jwks, AUDIENCE, [ISSUER])
+    assert claims["sub"] == "user-1"
+    assert idp.jwks_fetches == 1
+
+
+def test_expired_key_set_is_fetched_again(idp):
+    idp.max_age = 0
+    jwks = JWKSCache(f"{idp.url}/jwks")
+    verify_jwt(idp.keys[0].sign(), jwks, AUDIENCE, [ISSUER])
+    verify_jwt(idp.keys[0].sign(), jwks, AUDIENCE, [ISSUER])
+    assert idp.jwks_fetches == 2
+
+
+def test_rotated_key_is_picked_up(idp):
+    jwks = JWKSCache(f"{idp.url}/jwks", min_refetch=0)
+    verify_jwt(idp.keys[0].sign(), jwks, AUDIENCE, [ISSUER])
+    old = idp.keys[0]
+    idp.rotate()
+    assert verify_jwt(idp.keys[0].sign(), jwks, AUDIENCE, [ISSUER])["sub"] == "user-1"
+    assert idp.jwks_fetches == 2
+    # Tokens signed with the retired key stop verifying once the new set is in
+    with pytest.raises(jwt.InvalidTokenError):
+        verify_jwt(old.sign(), jwks, AUDIENCE, [ISSUER])
+
+
+def test_unknown_key_ids_refetch_at_most_once_per_interval(idp):
+    jwks = JWKSCache(f"{idp.url}/jwks", min_refetch=60)
+    verify_jwt(idp.keys[0].sign(), jwks, AUDIENCE, [ISSUER])
+    forger = SigningKey("forged")
+    for _ in range(5):
+        with pytest.raises(jwt.InvalidTokenError):
+            verify_jwt(forger.sign(), jwks, AUDIENCE, [ISSUER])
+    assert idp.jwks_fetches == 1
+
+
+def unsigned_token(alg, secret=b""):
+    header = b64(json.dumps({"alg": alg, "typ": "JWT", "kid": "key-1"}).encode())
+    now = int(time.time())
+    payload = b64(json.dumps({"iss": ISSUER, "aud": AUDIENCE, "sub": "admin", "iat": now, "exp": now + 60}).encode())
+    signing_input = f"{header}.{payload}".encode()
+    signature = b64(hmac.new(secret, signing_input, hashlib.sha256).digest()) if secret else ""
+    return f"{header}.{payload}.{signature}"
+
+
+def test_none_and_hmac_algorithms_are_rejected(idp):
+    jwks = JWKSCache(f"{idp.url}/jwks")
+    # The classic key confusion: HMAC keyed with the provider's public key
+    public_pem = idp.keys[0].private.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    for token in (unsigned_token("none"), unsigned_token("HS256", public_pem)):
+        with pytest.raises(jwt.InvalidAlgorithmError):
+            verify_jwt(token, jwks, AUDIENCE, [ISSUER])
+    assert idp.jwks_fetches == 0
+
+
+def test_wrong_audience_and_issuer_are_rejected(idp):
+    jwks = JWKSCache(f"{idp.url}/jwks")
+    with pytest.raises(jwt.InvalidAudienceError):
+        verify_jwt(idp.keys[0].sign(aud="someone-else"), jwks, AUDIENCE, [ISSUER])
+    with pytest.raises(jwt.InvalidIssuerError):
+        verify_jwt(idp.keys[0].sign(iss="https://evil.test"), jwks, AUDIENCE, [ISSUER])
+
+
+def test_code_exchange_verifies_and_caches_tokens(idp, caches):
+    provider = oauth(idp)
+    result = provider.exchange_code_for_token("code-1")
+    assert result["claims"]["email"] == "user@example.com"
+    assert provider.get_access_token("user-1") == "access-1"
+    assert len(idp.token_requests) == 1
+
+
+def test_tokens_near_expiry_are_refreshed_once(idp, caches):
+    provider = oauth(idp)
+    provider.exchange_code_for_token("code-1")
+    caches._tokens[f"{AUDIENCE}:user-1"]["expires_at"] = time.time() + 60  # within the refresh margin
+
+    assert provider.get_access_token("user-1") == "access-2"
+    assert provider.get_access_token("user-1") == "access-2"
+    assert idp.token_requests[-1] == {
+        "client_id": AUDIENCE, "client_secret": "secret", "refresh_token": "refresh-1", "grant_type": "refresh_token"
+    }
+    assert len(idp.token_requests) == 2
+
+
+def test_expired_tokens_without_refresh_end_the_session(idp, caches):
+    provider = oauth(idp)
+    caches.store(f"{AUDIENCE}:user-1", {"access_token": "stale"}, expires_in=-1)
+    assert provider.get_access_token("user-1") is None
+    assert not auth.provider_session_alive({"provider": "google", "subject": "user-1"})
+
+
+def test_firebase_refresh_goes_to_the_token_endpoint(idp, caches):
+    firebase = FirebaseAuth({"api_key": "k", "project_id": AUDIENCE, "token_url": f"{idp.url}/token",
+                             "jwks_url": f"{idp.url}/jwks", "issuer": ISSUER})
+    caches.store("firebase:user-1", {"id_token": "old", "refresh_token": "r"}, expires_in=10)
+    token = firebase.get_id_token("user-1")
+    assert firebase.verify_id_token(token)["sub"] == "user-1"
+    assert idp.token_requests[0]["grant_type"] == "refresh_token"
+
+
+def test_missing_issuer_is_a_clear_config_error(idp):
+    with pytest.raises(AuthConfigError, match="issuer"):
+        oauth(idp, issuer="")
+    with pytest.raises(AuthConfigError):
+        FirebaseAuth({"api_key": "k", "jwks_url": f"{idp.url}/jwks"}).verify_id_token("x.y.z")
+
+
+def test_oauth_state_is_signed_and_expires(monkeypatch):
+    state = auth.oauth_state("google")
+    assert auth.check_oauth_state(state) == "google"
+    assert auth.check_oauth_state(state.replace("google", "firebase", 1)) is None
+    assert auth.check_oauth_state("garbage") is None
+    monkeypatch.setitem(auth.AUTH_CONFIG, "oauth_state_max_age", -1)
+    assert auth.check_oauth_state(state) is None
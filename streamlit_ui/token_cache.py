@@ -0,0 +1,181 @@
+"""
+Provider token cache and local ID token verification for Medical Diagnostics Application
+Tokens are reused until shortly before they expire; JWTs are checked against each provider's cached signing keys
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Union
+
+import jwt
+import streamlit as st
+
+from http_client import get_http_client
+
+# Configuration
+TOKEN_CONFIG = {
+    "refresh_margin": float(os.getenv("TOKEN_REFRESH_MARGIN", "300")),  # seconds before expiry to refresh
+    "jwks_refresh_interval": float(os.getenv("JWKS_REFRESH_INTERVAL", "3600")),  # longest signing keys are kept
+    "jwks_min_refetch": float(os.getenv("JWKS_MIN_REFETCH", "60")),  # unknown key ids refetch at most this often
+    "jwt_leeway": float(os.getenv("JWT_LEEWAY", "30")),  # seconds of clock skew tolerated
+    "provider_timeout": 10,  # seconds for key and token endpoint calls
+}
+
+# Provider ID tokens are RSA-signed; "none" and HMAC algorithms are never accepted
+JWT_ALGORITHMS = ["RS256"]
+
+
+class TokenCache:
+    """Provider tokens per key, refreshed shortly before they expire
+
+    An entry holds whatever the provider returned (id_token, access_token,
+    refresh_token) plus its expiry. get() hands out the cached entry and only
+    calls the provider once the entry is within refresh_margin of expiring;
+    concurrent reruns share one refresh per key.
+    """
+
+    def __init__(self, refresh_margin: float = None):
+        self.refresh_margin = TOKEN_CONFIG["refresh_margin"] if refresh_margin is None else refresh_margin
+        self._tokens: Dict[str, Dict[str, Any]] = {}
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._refreshes = 0
+        self._refresh_errors = 0
+
+    def store(self, key: str, tokens: Dict[str, Any], expires_in: Union[int, float, str]) -> Dict[str, Any]:
+        entry = {name: value for name, value in tokens.items() if value}
+        entry["expires_at"] = time.time() + float(expires_in)
+        with self._lock:
+            self._tokens[key] = entry
+        return entry
+
+    def discard(self, key: str):
+        with self._lock:
+            self._tokens.pop(key, None)
+
+    def get(self, key: str, refresh: Callable[[str], Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """The key's tokens, refreshed through refresh(refresh_token) when close to expiry; None once expired"""
+        with self._lock:
+            entry = self._tokens.get(key)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        if entry is None or not self._refresh_due(entry):
+            return entry
+
+        with key_lock:
+            # Another rerun may have refreshed while this one waited
+            with self._lock:
+                entry = self._tokens.get(key)
+            if entry is None or not self._refresh_due(entry):
+                return entry
+            if refresh is not None and entry.get("refresh_token"):
+                try:
+                    tokens = refresh(entry["refresh_token"])
+                    with self._lock:
+                        self._refreshes += 1
+                    return self.store(key, {**entry, **tokens}, tokens.get("expires_in", 3600))
+                except Exception as e:
+                    with self._lock:
+                        self._refresh_errors += 1
+                    print(f"❌ Token refresh failed: {e}")
+            if entry["expires_at"] <= time.time():
+                self.discard(key)
+                return None
+            return entry
+
+    def _refresh_due(self, entry: Dict[str, Any]) -> bool:
+        return entry["expires_at"] - self.refresh_margin <= time.time()
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {"cached": len(self._tokens), "refreshes": self._refreshes, "refresh_errors": self._refresh_errors}
+
+
+class JWKSCache:
+    """A provider's JSON Web Key Set, fetched through the shared HTTP client and cached
+
+    Keys are kept for the response's Cache-Control max-age, capped at
+    jwks_refresh_interval. A token signed with a key id not in the set
+    triggers a refetch, at most once per jwks_min_refetch seconds, so key
+    rotation is picked up without letting forged key ids hammer the provider.
+    If a refetch fails the keys already held stay in use.
+    """
+
+    def __init__(self, url: str, refresh_interval: float = None, min_refetch: float = None):
+        self.url = url
+        self.refresh_interval = refresh_interval or TOKEN_CONFIG["jwks_refresh_interval"]
+        self.min_refetch = TOKEN_CONFIG["jwks_min_refetch"] if min_refetch is None else min_refetch
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._fetches = 0
+
+    def key(self, kid: str) -> jwt.PyJWK:
+        with self._lock:
+            now = time.time()
+            stale = now >= self._expires_at
+            unknown = kid not in self._keys and now - self._fetched_at >= self.min_refetch
+            if stale or unknown:
+                try:
+                    self._fetch()
+                except Exception as e:
+                    if not self._keys:
+                        raise jwt.PyJWKClientError(f"Could not fetch signing keys: {e}") from e
+                    print(f"❌ Signing key refresh failed, keeping cached keys: {e}")
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key {kid!r}")
+        return key
+
+    def _fetch(self):
+        self._fetched_at = time.time()
+        response = get_http_client().get(self.url, timeout=TOKEN_CONFIG["provider_timeout"])
+        response.raise_for_status()
+        keys = {}
+        for data in response.json().get("keys", []):
+            if data.get("kid") and data.get("use", "sig") == "sig":
+                keys[data["kid"]] = jwt.PyJWK(data)
+        self._keys = keys
+        self._expires_at = self._fetched_at + min(self.refresh_interval, _max_age(response.headers))
+        self._fetches += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"keys": len(self._keys), "fetches": self._fetches,
+                    "expires_in": max(0, round(self._expires_at - time.time()))}
+
+
+def _max_age(headers) -> float:
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name.lower() == "max-age" and value.isdigit():
+            return float(value)
+    return float("inf")
+
+
+def verify_jwt(token: str, jwks: JWKSCache, audience: str, issuers: Sequence[str]) -> Dict[str, Any]:
+    """Claims of a provider-signed JWT, verified locally; raises jwt.InvalidTokenError"""
+    header = jwt.get_unverified_header(token)
+    if header.get("alg") not in JWT_ALGORITHMS:
+        raise jwt.InvalidAlgorithmError(f"Algorithm {header.get('alg')!r} not allowed")
+    key = jwks.key(header.get("kid"))
+    claims = jwt.decode(
+        token, key.key, algorithms=JWT_ALGORITHMS, audience=audience,
+        leeway=TOKEN_CONFIG["jwt_leeway"], options={"require": ["exp", "iat", "iss", "aud", "sub"]}
+    )
+    if claims["iss"] not in issuers:
+        raise jwt.InvalidIssuerError(f"Issuer {claims['iss']!r} not accepted")
+    return claims
+
+
+@st.cache_resource
+def get_token_cache() -> TokenCache:
+    """Return the process-wide token cache, created once per Streamlit server"""
+    return TokenCache()
+
+
+@st.cache_resource
+def get_jwks(url: str) -> JWKSCache:
+    """Return the process-wide signing key cache for one JWKS URL"""
+    return JWKSCache(url)